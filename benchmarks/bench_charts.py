@@ -0,0 +1,94 @@
+"""Графики веса: рендер прямо в event loop (как раньше) против ChartService.
+
+Меряет число графиков в секунду и максимальную задержку event loop: фоновая
+корутина «тикает» каждые 5 мс, и мы смотрим, насколько она опаздывает.
+Для холодного рабочего процесса показывает время до первого графика и
+проверяет, что в процесс не попали main.py и модули бота.
+
+Запуск: python benchmarks/bench_charts.py
+"""
+import asyncio
+import datetime
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from charts import ChartService
+
+CHARTS = 24
+TICK = 0.005
+
+
+def make_series(seed, days=90):
+    start = datetime.date(2025, 1, 1)
+    return [((start + datetime.timedelta(days=i)).isoformat(), 90 + seed * 0.1 - i * 0.05 + i % 5 * 0.1) for i in range(days)]
+
+
+def render_inline(series):
+    # Прежний способ из progress_command: pyplot и глобальное состояние
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    dates = [datetime.date.fromisoformat(d) for d, _ in series]; weights = [w for _, w in series]
+    plt.figure(figsize=(10, 6)); plt.plot(dates, weights, marker='o', linestyle='-'); plt.title("График веса", fontsize=16); plt.xlabel("Дата"); plt.ylabel("Вес (кг)"); plt.grid(True); plt.gcf().autofmt_xdate()
+    buf = io.BytesIO(); plt.savefig(buf, format='png', bbox_inches='tight'); buf.seek(0); plt.close()
+    return buf
+
+
+async def measure(label, render_all):
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            stalls.append(max(0.0, time.perf_counter() - expected))
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+    started = time.perf_counter()
+    await render_all()
+    elapsed = time.perf_counter() - started
+    done.set(); await tick_task
+    print(f"{label:<28} {CHARTS / elapsed:>8.1f} графиков/с   макс. задержка loop {max(stalls) * 1000:>7.1f} мс")
+
+
+async def cold_worker():
+    service = ChartService(max_workers=1)
+    started = time.perf_counter()
+    await service.weight_chart(make_series(-2))
+    elapsed = time.perf_counter() - started
+    modules = set(await service.worker_modules())
+    service.shutdown()
+    bot_modules = sorted(modules & {"main", "__mp_main__", "telegram", "tornado", "google.generativeai", "db"})
+    print(f"Холодный процесс: первый график за {elapsed:.2f} с, модулей {len(modules)}, модули бота: {bot_modules or 'нет'}")
+
+
+async def main():
+    await cold_worker()
+    series = [make_series(i) for i in range(CHARTS)]
+
+    async def inline():
+        for s in series:
+            render_inline(s); await asyncio.sleep(0)
+
+    service = ChartService(max_workers=2)
+    await service.weight_chart(make_series(-1))  # запуск рабочих процессов и импорт matplotlib в них
+
+    async def pooled():
+        await asyncio.gather(*(service.weight_chart(s) for s in series))
+
+    render_inline(make_series(-1))
+    await measure("pyplot в event loop", inline)
+    await measure("ChartService (процессы)", pooled)
+    await measure("ChartService (повтор, кэш)", pooled)
+    print(f"Статистика: {service.stats()}")
+    service.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
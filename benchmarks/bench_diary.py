@@ -0,0 +1,63 @@
+"""Чтение «съедено сегодня» и средних за неделю: готовые итоги FoodDiary против пересчета по сырым записям.
+
+Запуск: python benchmarks/bench_diary.py [число пользователей]
+"""
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from diary_store import FoodDiary
+
+DAYS = 30
+MEALS_PER_DAY = 4
+QUERIES = 5000
+
+
+def main(users=500):
+    rng = random.Random(0)
+    today = datetime.date(2026, 1, 31)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        diary = FoodDiary(db, today=lambda: today)
+        started = time.perf_counter()
+        for user in range(users):
+            for offset in range(DAYS):
+                day = today - datetime.timedelta(days=offset)
+                for _ in range(MEALS_PER_DAY):
+                    diary.add(user, ["блюдо"], {"calories": rng.randint(200, 800), "protein": 20, "fat": 10, "carbs": 50}, day=day)
+        print(f"Записей: {users * DAYS * MEALS_PER_DAY} за {time.perf_counter() - started:.1f} с")
+
+        random_ids = [rng.randrange(users) for _ in range(QUERIES)]
+        week_ago = (today - datetime.timedelta(days=6)).isoformat()
+        # Для честного сравнения пересчету нужен индекс по пользователю, которого в рабочей схеме нет
+        db.execute("CREATE INDEX bench_entries_chat ON diary_entries (chat_id, day)")
+        cold = FoodDiary(db, today=lambda: today)  # окна еще не загружены
+        for label, chat_ids, read in (
+            ("пересчет по сырым записям", random_ids, lambda chat_id: (
+                db.execute("SELECT SUM(kcal), SUM(p), SUM(f), SUM(c) FROM diary_entries WHERE chat_id = ? AND day = ?", (str(chat_id), today.isoformat())).fetchone(),
+                db.execute("SELECT SUM(kcal), COUNT(DISTINCT day) FROM diary_entries WHERE chat_id = ? AND day >= ?", (str(chat_id), week_ago)).fetchone())),
+            ("FoodDiary, первое обращение", range(users), lambda chat_id: (cold.today(chat_id), cold.rolling(chat_id))),
+            ("FoodDiary, окно в памяти", random_ids, lambda chat_id: (diary.today(chat_id), diary.rolling(chat_id))),
+        ):
+            times = []
+            for chat_id in chat_ids:
+                t0 = time.perf_counter(); read(chat_id); times.append(time.perf_counter() - t0)
+            times.sort()
+            print(f"{label:<30} p50 {statistics.median(times) * 1e6:7.1f} мкс  p99 {times[int(len(times) * 0.99)] * 1e6:7.1f} мкс")
+
+        later = FoodDiary(db, today=lambda: today + datetime.timedelta(days=60))
+        started = time.perf_counter()
+        removed, removed_days = later.compact()
+        print(f"Компактизация через 60 дней: удалено {removed} сырых записей за {(time.perf_counter() - started) * 1000:.0f} мс, итоги дней остались")
+        db.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,36 @@
+"""Скорость локального разбора строк дневника питания через FoodIndex.
+
+Запуск: python benchmarks/bench_food_index.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from food_index import FoodIndex
+
+TYPICAL_LINES = [
+    "овсянка 50г", "яйцо 2 шт", "2 яйца", "банан", "куриную грудку 150 гр", "гречка отварная 200г",
+    "творог 5% 200г", "молоко 2,5% 250 мл", "кефир 1% 500 мл", "хлеб ржаной 2 шт", "яблоко 1",
+    "рис отварной 180 г", "огурец", "помидоры 200г", "сыр 30 г", "кофе с молоком 200 мл",
+    "греческий йогурт 150г", "лосось 120г", "грецкие орехи 20г", "шоколад темный 25 г",
+    "шаурма 300г", "пицца маргарита 2 куска", "салат цезарь", "бананн 1",
+]
+
+
+def main(count=20000):
+    index = FoodIndex().load(os.path.join(ROOT, "data", "food_composition.json"))
+    rng = random.Random(42)
+    lines = [rng.choice(TYPICAL_LINES) for _ in range(count)]
+    t0 = time.perf_counter()
+    for line in lines: index.resolve(line)
+    elapsed = time.perf_counter() - t0
+    print(f"Строк: {count}, время: {elapsed:.3f} с, {count / elapsed:,.0f} строк/с, {elapsed / count * 1e6:.1f} мкс/строка")
+    print(f"Статистика: {index.stats()}")
+
+
+if __name__ == "__main__":
+    main()
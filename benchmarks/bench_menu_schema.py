@@ -0,0 +1,122 @@
+"""Размер ответа Gemini для меню на неделю: прежняя схема JSON против компактной.
+
+Без ключа сравнивается размер одного и того же меню, записанного в обеих
+схемах (ответ модели с отступами, как она обычно его возвращает), и оценка
+числа выходных токенов. С GEMINI_API_KEY оба промпта реально отправляются
+в Gemini, и печатаются токены и задержка по usage_metadata.
+
+Запуск: python benchmarks/bench_menu_schema.py [число запросов на схему]
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm import LLMGateway
+from menu_format import MENU_SCHEMA, build_shopping_list, expand_menu
+
+DAYS = 7
+CHARS_PER_TOKEN = 3  # грубая оценка для русского текста
+
+PROFILE = "- Пол: мужской\n- Возраст: 35\n- Рост: 180 см\n- Уровень активности: 3 из 5\n- Цель диеты: похудение"
+TARGETS = "Суточная цель по калориям: примерно 2200 ккал.\nЦель по БЖУ: Белки ~140г, Жиры ~70г, Углеводы ~250г."
+
+LEGACY_PROMPT = f"""
+Выступи в роли диетолога. Создай план питания на {DAYS} дней для пользователя со следующими параметрами:
+{PROFILE}
+
+{TARGETS}
+
+Пожалуйста, верни ответ ИСКЛЮЧИТЕЛЬНО в формате JSON. Не добавляй никакого текста до или после JSON.
+Структура JSON должна быть следующей:
+{{
+  "weekly_plan": [
+    {{
+      "day_name": "День 1",
+      "meals": [
+        {{
+          "meal_name": "Завтрак (Название блюда)",
+          "items": [{{"food_item": "название продукта", "grams": 100}}],
+          "total_calories": 350, "total_protein": 20, "total_fat": 10, "total_carbs": 45,
+          "recipe": "Краткий рецепт приготовления."
+        }},
+        {{ "meal_name": "Обед (Название блюда)", "items": [], "total_calories": 550, "total_protein": 40, "total_fat": 20, "total_carbs": 50, "recipe": "..."}},
+        {{ "meal_name": "Ужин (Название блюда)", "items": [], "total_calories": 400, "total_protein": 30, "total_fat": 15, "total_carbs": 35, "recipe": "..."}}
+      ]
+    }}
+  ],
+  "shopping_list": ["Продукт 1: X г", "Продукт 2: Y г"]
+}}
+Создай разнообразные и простые блюда. Список покупок должен включать все ингредиенты на {DAYS} дней.
+"""
+
+COMPACT_PROMPT = f"""
+Выступи в роли диетолога. Создай план питания на {DAYS} дней для пользователя со следующими параметрами:
+{PROFILE}
+
+{TARGETS}
+
+Верни ответ ИСКЛЮЧИТЕЛЬНО в формате компактного JSON, без текста до или после:
+{MENU_SCHEMA}
+d — дни ({DAYS}), m — приемы пищи дня (завтрак, обед, ужин). В блюде: t — прием пищи, n — название,
+i — продукты [название, количество, г/мл/шт], k — [ккал, белки, жиры, углеводы], r — краткий рецепт.
+Создай разнообразные и простые блюда. Список покупок и итоги по дням не нужны.
+"""
+
+SAMPLE_MEALS = [
+    ("Завтрак", "Овсянка с ягодами", [["овсяные хлопья", 60, "г"], ["молоко 2.5%", 200, "мл"], ["черника", 80, "г"], ["мед", 10, "г"]], [390, 14, 9, 62],
+     "Залить хлопья молоком, варить 5 минут, добавить ягоды и мед."),
+    ("Обед", "Курица с гречкой и салатом", [["куриная грудка", 150, "г"], ["гречка", 70, "г"], ["огурец", 1, "шт"], ["помидор", 1, "шт"], ["оливковое масло", 10, "мл"]],
+     [610, 50, 16, 58], "Отварить гречку. Курицу запечь 25 минут при 180°C. Нарезать овощи, заправить маслом."),
+    ("Ужин", "Запеченная треска с овощами", [["треска", 200, "г"], ["брокколи", 150, "г"], ["морковь", 1, "шт"], ["лимон", 0.5, "шт"]], [330, 42, 4, 22],
+     "Рыбу и овощи выложить на противень, сбрызнуть лимоном, запекать 20 минут."),
+]
+
+
+def sample_compact():
+    return {"d": [{"m": [{"t": t, "n": f"{n} {day + 1}", "i": i, "k": k, "r": r} for t, n, i, k, r in SAMPLE_MEALS]} for day in range(DAYS)]}
+
+
+def sample_legacy(compact):
+    expanded = expand_menu(compact)
+    for day in expanded["weekly_plan"]:
+        for meal in day["meals"]:
+            meal["items"] = [{"food_item": item["food_item"], "grams": item["amount"]} for item in meal["items"]]
+    meals = [meal for day in expanded["weekly_plan"] for meal in day["meals"]]
+    return {"weekly_plan": expanded["weekly_plan"], "shopping_list": build_shopping_list(meals)}
+
+
+def offline():
+    compact = sample_compact()
+    legacy_text = json.dumps(sample_legacy(compact), ensure_ascii=False, indent=2)
+    compact_text = json.dumps(compact, ensure_ascii=False, indent=1)
+    print(f"Меню на {DAYS} дней, одинаковое содержание (оценка: 1 токен ≈ {CHARS_PER_TOKEN} символа)")
+    for label, prompt, answer in (("прежняя схема", LEGACY_PROMPT, legacy_text), ("компактная", COMPACT_PROMPT, compact_text)):
+        print(f"{label:<14} промпт {len(prompt):>5} симв. (~{len(prompt) // CHARS_PER_TOKEN} ток.)   ответ {len(answer):>6} симв. (~{len(answer) // CHARS_PER_TOKEN} ток.)")
+    print(f"Ответ короче в {len(legacy_text) / len(compact_text):.1f} раза; время генерации растет примерно линейно с числом выходных токенов")
+
+
+def create_model():
+    import google.generativeai as genai
+    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+    return genai.GenerativeModel("gemini-1.5-flash-latest")
+
+
+async def online(runs):
+    gateway = LLMGateway(create_model, max_concurrency=1)
+    for _ in range(runs):
+        await gateway.generate_json(LEGACY_PROMPT, label="legacy", single_flight=False)
+        await gateway.generate_json(COMPACT_PROMPT, label="compact", single_flight=False)
+    stats = gateway.stats()["labels"]
+    for label in ("legacy", "compact"):
+        s = stats[label]
+        print(f"{label:<8} запросов {s['calls']:>3}  промпт {s['prompt_tokens'] / s['calls']:>6.0f} ток.  ответ {s['output_tokens'] / s['calls']:>6.0f} ток.  "
+              f"задержка p50 {s['latency_p50']:.1f} с, p95 {s['latency_p95']:.1f} с")
+
+
+if __name__ == "__main__":
+    offline()
+    if os.environ.get("GEMINI_API_KEY"):
+        asyncio.run(online(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
@@ -0,0 +1,81 @@
+"""Доставка меню на неделю: последовательные send_message против OutboundRateLimiter.
+
+Telegram подменяется моделью: ответ приходит через RTT, а чат, превысивший
+всплеск в FLOOD_BURST сообщений при темпе выше 1 в секунду, получает RetryAfter.
+Несколько пользователей получают меню одновременно.
+
+Запуск: python benchmarks/bench_outbound.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter
+
+from outbound import OutboundRateLimiter
+
+RTT = 0.05
+FLOOD_BURST = 20
+USERS = 5
+DAYS, MEALS = 7, 3
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.chats = {}
+        self.delivered = 0
+        self.flood_errors = 0
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(RTT)
+        now = time.monotonic()
+        tokens, updated = self.chats.get(chat_id, (FLOOD_BURST, now))
+        tokens = min(FLOOD_BURST, tokens + (now - updated))
+        if tokens < 1:
+            self.chats[chat_id] = (tokens, now)
+            self.flood_errors += 1
+            raise RetryAfter(3)
+        self.chats[chat_id] = (tokens - 1, now)
+        self.delivered += 1
+
+
+def messages_for_week(merged):
+    per_day = 1 if merged else 1 + MEALS
+    return DAYS * per_day + 1  # + предложение показать список покупок
+
+
+async def deliver_sequential(telegram, chat_id, count):
+    # Прежнее поведение: отправки одна за другой, RetryAfter не обрабатывается
+    for i in range(count):
+        try: await telegram.send_message(chat_id, f"msg {i}")
+        except RetryAfter: pass
+
+
+async def deliver_limited(limiter, telegram, chat_id, count):
+    for i in range(count):
+        await limiter.process_request(telegram.send_message, (chat_id, f"msg {i}"), {}, "sendMessage", {"chat_id": chat_id}, None)
+
+
+async def run(label, deliver, count):
+    telegram = FakeTelegram()
+    started = time.perf_counter()
+    await asyncio.gather(*(deliver(telegram, 1000 + u, count) for u in range(USERS)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {count:>3} сообщ./польз.  {elapsed:6.2f} с  доставлено {telegram.delivered:>4}/{count * USERS}  RetryAfter: {telegram.flood_errors}")
+
+
+async def main():
+    await run("последовательно, по сообщению на блюдо", deliver_sequential, messages_for_week(False))
+    for merged in (False, True):
+        limiter = OutboundRateLimiter()
+        await limiter.initialize()
+        label = "лимитер, " + ("день одним сообщением" if merged else "по сообщению на блюдо")
+        await run(label, lambda t, c, n: deliver_limited(limiter, t, c, n), messages_for_week(merged))
+        await limiter.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
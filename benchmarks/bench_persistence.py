@@ -0,0 +1,74 @@
+"""Сохранение user_data: PicklePersistence против SQLitePersistence.
+
+Каждый пользователь хранит меню на неделю и незавершённую запись еды, как
+в боте. На каждом проходе сохранения изменились DIRTY пользователей.
+PicklePersistence пишет весь файл заново, SQLitePersistence — только
+изменённые строки.
+
+Запуск: python benchmarks/bench_persistence.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from copy import deepcopy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import PicklePersistence
+
+from db import Database
+from sqlite_persistence import SQLitePersistence
+
+USERS = (100, 1000, 10000)
+DIRTY = 20
+ROUNDS = 5
+
+
+def user_data(user_id):
+    meal = {"meal_type": "Обед", "dish_name": f"Блюдо {user_id}", "calories": 650, "protein": 40, "fat": 20, "carbs": 70,
+            "ingredients": ["куриная грудка 150 г", "рис 80 г", "огурец 1 шт"], "recipe": "Отварить рис, обжарить курицу. " * 8}
+    days = [{"day": f"День {d + 1}", "meals": [dict(meal, meal_type=t) for t in ("Завтрак", "Обед", "Ужин")]} for d in range(7)]
+    return {"setup_step": None, "last_weekly_menu": {"weekly_plan": days, "shopping_list": ["рис 560 г"] * 20},
+            "current_food_log_session_items": ["гречка 200 г", "яйцо 2 шт"]}
+
+
+async def flush_pickle(path, users):
+    persistence = PicklePersistence(filepath=path, single_file=True, on_flush=True)
+    for user_id in range(users): await persistence.update_user_data(user_id, user_data(user_id))
+    await persistence.flush()
+    timings = []
+    for r in range(ROUNDS):
+        for user_id in range(DIRTY): await persistence.update_user_data(user_id, deepcopy(user_data(user_id + r)))
+        started = time.perf_counter()
+        await persistence.flush()
+        timings.append(time.perf_counter() - started)
+    return min(timings), os.path.getsize(path)
+
+
+async def flush_sqlite(path, users):
+    db = Database(path)
+    persistence = SQLitePersistence(db)
+    await asyncio.gather(*(persistence.update_user_data(user_id, user_data(user_id)) for user_id in range(users)))
+    timings = []
+    for r in range(ROUNDS):
+        started = time.perf_counter()
+        await asyncio.gather(*(persistence.update_user_data(user_id, deepcopy(user_data(user_id + r))) for user_id in range(DIRTY)))
+        timings.append(time.perf_counter() - started)
+    db.close()
+    return min(timings), os.path.getsize(path)
+
+
+async def main():
+    print(f"Изменено пользователей за проход: {DIRTY}, лучшее из {ROUNDS}")
+    print(f"{'пользователей':>13} {'pickle, мс':>11} {'sqlite, мс':>11} {'pickle, МБ':>11} {'sqlite, МБ':>11}")
+    for users in USERS:
+        with tempfile.TemporaryDirectory() as tmp:
+            pickle_time, pickle_size = await flush_pickle(os.path.join(tmp, "data.pkl"), users)
+            sqlite_time, sqlite_size = await flush_sqlite(os.path.join(tmp, "data.db"), users)
+        print(f"{users:>13} {pickle_time * 1000:>11.1f} {sqlite_time * 1000:>11.1f} {pickle_size / 2**20:>11.1f} {sqlite_size / 2**20:>11.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""Стоимость одного нажатия «Прогресс веса» в зависимости от длины истории.
+
+Сравнивается прежний способ (вся история, strptime и склейка строк) со сводкой
+по WeightTrend и страницей истории по ключу.
+
+Запуск: python benchmarks/bench_progress.py
+"""
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from weight_store import WeightStore
+
+HISTORY_LENGTHS = (30, 365, 3650)
+PAGE_SIZE = 10
+TAPS = 300
+
+
+def legacy_tap(store, chat_id):
+    sorted_log = store.series(chat_id)
+    text = "📈 Прогресс веса по дням:\n"; dates = [datetime.datetime.strptime(d, "%Y-%m-%d").date() for d, w in sorted_log]
+    for date_obj, (_, weight) in zip(dates, sorted_log): text += f"▫️ {date_obj.strftime('%d.%m.%Y')}: {weight} кг\n"
+    return text
+
+
+def trend_tap(store, chat_id):
+    trend = store.trend(chat_id)
+    rows, _, _ = store.page(chat_id, PAGE_SIZE)
+    return (trend.ema, trend.slope(), trend.weekly_deltas(), trend.projected_date(75), "\n".join(f"{day}: {weight}" for day, weight in rows))
+
+
+def measure(func, *args):
+    times = []
+    for _ in range(TAPS):
+        t0 = time.perf_counter(); result = func(*args); times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e6, result
+
+
+def main():
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = WeightStore(Database(os.path.join(tmp, "bench.db")))
+        start = datetime.date(2016, 1, 1)
+        for length in HISTORY_LENGTHS:
+            chat_id = f"user{length}"
+            started = time.perf_counter()
+            for i in range(length): store.save(chat_id, round(100 - i * 0.005 + rng.uniform(-0.8, 0.8), 1), (start + datetime.timedelta(days=i)).isoformat())
+            save_us = (time.perf_counter() - started) / length * 1e6
+            legacy_us, text = measure(legacy_tap, store, chat_id)
+            trend_us, _ = measure(trend_tap, store, chat_id)
+            print(f"история {length:>5} дн.: прежний ответ {legacy_us:8.0f} мкс ({len(text)} симв.), сводка и страница {trend_us:6.0f} мкс, запись веса {save_us:5.0f} мкс")
+
+
+if __name__ == "__main__":
+    main()
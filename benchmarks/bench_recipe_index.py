@@ -0,0 +1,63 @@
+"""Поиск рецепта по продуктам в RecipeIndex при десятках тысяч сохраненных рецептов.
+
+Рецепты синтетические: 4–8 продуктов из словаря с распределением Ципфа,
+как в реальных ответах (яйца и лук встречаются часто, спаржа — редко).
+
+Запуск: python benchmarks/bench_recipe_index.py [число рецептов]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from recipe_index import RecipeIndex, canonical_ingredients
+
+COMMON = ["яйца", "лук", "морковь", "картофель", "молоко", "сливочное масло", "сыр", "помидоры", "чеснок", "куриное филе",
+          "рис", "гречка", "макароны", "огурцы", "сметана", "творог", "мука", "капуста", "говядина", "фарш"]
+SYLLABLES = ["ба", "ве", "ги", "до", "жу", "за", "ки", "ло", "му", "не", "по", "ру", "си", "ту", "фа", "хо"]
+# Редкие продукты — выдуманные слова, чтобы они не сливались после нормализации
+VOCABULARY = COMMON + [a + b + c + d for a, b, c, d in random.Random(0).sample([(a, b, c, d) for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES for d in SYLLABLES], 400)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+QUERIES = 2000
+
+
+def random_ingredients(rng, low, high):
+    return list(dict.fromkeys(rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(low, high))))
+
+
+def main(count=50000):
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        index = RecipeIndex(db)
+        started = time.perf_counter()
+        rows = [(f"sig{i}", random_ingredients(rng, 4, 8)) for i in range(count)]
+        with db.transaction():
+            for i, (signature, ingredients) in enumerate(rows):
+                index.add({"dish_name": f"Блюдо {i}", "ingredients_used": ingredients, "recipe_steps": ["Шаг 1", "Шаг 2"]})
+        print(f"Добавлено рецептов: {len(index)} за {time.perf_counter() - started:.1f} с")
+
+        started = time.perf_counter()
+        reloaded = RecipeIndex(db)
+        print(f"Загрузка индекса при старте: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        fridges = [", ".join(random_ingredients(rng, 5, 12)) for _ in range(QUERIES)]
+        parsed = [canonical_ingredients(fridge) for fridge in fridges]
+        match_times, find_times = [], []
+        for fridge, available in zip(fridges, parsed):
+            t0 = time.perf_counter(); reloaded.match(available); match_times.append(time.perf_counter() - t0)
+            t0 = time.perf_counter(); reloaded.find(fridge, exclusions=["чеснок"]); find_times.append(time.perf_counter() - t0)
+        for label, times in (("match (только индекс)", match_times), ("find (разбор + чтение рецепта)", find_times)):
+            times.sort()
+            print(f"{label:<32} p50 {statistics.median(times) * 1e6:6.0f} мкс  p99 {times[int(len(times) * 0.99)] * 1e6:6.0f} мкс")
+        print(f"Статистика: {reloaded.stats()}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,48 @@
+"""Планировщик напоминаний на 100k подписчиков: память индекса и время тика.
+
+Запуск: python benchmarks/bench_reminders.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from reminders import ReminderScheduler
+from weight_store import WeightStore
+
+
+def main():
+    for users in (1_000, 10_000, 100_000):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"))
+            WeightStore(db)
+            today = datetime.date.today().isoformat()
+            db.executemany("INSERT INTO weights (chat_id, day, weight) VALUES (?, ?, ?)", [(str(c), today, 80.0) for c in range(0, users, 3)])
+            store = WeightStore(db)  # каждый третий уже взвесился сегодня
+
+            t0 = time.perf_counter()
+            ReminderScheduler(db).subscribe_many(range(users))
+            subscribe_time = time.perf_counter() - t0
+
+            tracemalloc.start()
+            scheduler = ReminderScheduler(db)  # загрузка подписок после «перезапуска»
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            t0 = time.perf_counter()
+            for slot in range(scheduler.slots_count): scheduler.water_recipients(slot)
+            water_tick = (time.perf_counter() - t0) / scheduler.slots_count
+            t0 = time.perf_counter()
+            pending = [c for c in scheduler.subscribers() if store.latest_day(c) != today]
+            weigh_tick = time.perf_counter() - t0
+            print(f"{users:>7} подписчиков: подписка {subscribe_time * 1000:7.1f} мс, индекс {memory / users:5.0f} байт/польз., "
+                  f"тик воды {water_tick * 1000:6.2f} мс, отбор для взвешивания {weigh_tick * 1000:6.1f} мс ({len(pending)} получателей)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Холодный старт бота: время импорта main.py и время до первого обработанного апдейта.
+
+Каждый замер — отдельный процесс Python. Bot API подменяется локальной
+заглушкой, поэтому сеть и токен не нужны. Для сравнения отдельно меряется
+импорт google.generativeai и matplotlib.pyplot, которые раньше грузились
+при импорте main.py.
+
+Запуск: python benchmarks/bench_startup.py [число запусков]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child():
+    started = time.perf_counter()
+    import asyncio
+    sys.path.insert(0, ROOT)
+    import main
+    imported = time.perf_counter()
+
+    from telegram import Update
+    from telegram.request import BaseRequest
+
+    replies = []
+
+    class OfflineRequest(BaseRequest):
+        @property
+        def read_timeout(self): return None
+        async def initialize(self): pass
+        async def shutdown(self): pass
+
+        async def do_request(self, url, method, request_data=None, **kwargs):
+            api_method = url.rsplit("/", 1)[-1]
+            if api_method == "getMe":
+                result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"}
+            elif api_method == "sendMessage":
+                replies.append(time.perf_counter())
+                params = request_data.parameters if request_data else {}
+                result = {"message_id": len(replies), "date": 0, "chat": {"id": int(params.get("chat_id", 1)), "type": "private"}, "text": params.get("text", "")}
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def run():
+        main.init_storage()
+        app = main.build_application("123456:TEST", request=OfflineRequest())
+        await app.initialize()
+        update = Update.de_json({"update_id": 1, "message": {
+            "message_id": 1, "date": int(time.time()), "text": "Вес 80.5",
+            "chat": {"id": 42, "type": "private"}, "from": {"id": 42, "is_bot": False, "first_name": "Тест"}}}, app.bot)
+        await app.process_update(update)
+        await app.shutdown()
+
+    asyncio.run(run())
+    print(json.dumps({"import": imported - started, "first_update": replies[0] - started,
+                      "genai_loaded": "google.generativeai" in sys.modules, "pyplot_loaded": "matplotlib.pyplot" in sys.modules}))
+
+
+def measure(code_args, runs):
+    results = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_FILE=os.path.join(tmp, "bench.db"))
+            env.pop("GEMINI_API_KEY", None)
+            out = subprocess.run([sys.executable, *code_args], cwd=tmp, env=env, capture_output=True, text=True, check=True)
+            results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def main(runs=5):
+    bot = measure([os.path.abspath(__file__), "--child"], runs)
+    heavy = measure(["-c", "import json, time; t = time.perf_counter(); import google.generativeai, matplotlib.pyplot; print(json.dumps({'import': time.perf_counter() - t}))"], runs)
+    median = lambda rows, key: statistics.median(r[key] for r in rows) * 1000
+    print(f"Импорт main.py:                          {median(bot, 'import'):7.0f} мс (медиана из {runs})")
+    print(f"До первого обработанного апдейта:        {median(bot, 'first_update'):7.0f} мс")
+    print(f"google.generativeai + matplotlib.pyplot: {median(heavy, 'import'):7.0f} мс (столько добавлял бы импорт при старте)")
+    print(f"Тяжелые модули загружены при старте: genai={bot[0]['genai_loaded']}, pyplot={bot[0]['pyplot_loaded']}")
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child()
+    else:
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
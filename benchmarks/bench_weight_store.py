@@ -0,0 +1,68 @@
+"""Сравнение стоимости записи/чтения веса: старый JSON-файл против WeightStore.
+
+Запуск: python benchmarks/bench_weight_store.py
+"""
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database
+from weight_store import WeightStore
+
+OPS = 200
+
+
+def make_log(users, days):
+    start = datetime.date(2024, 1, 1)
+    dates = [(start + datetime.timedelta(days=i)).isoformat() for i in range(days)]
+    return {str(1000 + u): {d: 80.0 + (i % 7) * 0.1 for i, d in enumerate(dates)} for u in range(users)}
+
+
+def bench_json(path, users):
+    # Повторяет прежние save_weight/get_latest_weight из main.py
+    def save(chat_id, weight):
+        with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+        data.setdefault(str(chat_id), {})["2030-01-01"] = weight
+        with open(path, "w", encoding="utf-8") as f: json.dump(data, f, indent=4)
+
+    def latest(chat_id):
+        with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+        log = data.get(str(chat_id), {})
+        return log[sorted(log.keys())[-1]] if log else None
+
+    return _measure(save, latest, users, 20 if users >= 1000 else OPS)
+
+
+def bench_store(path, json_path, users):
+    store = WeightStore(Database(path))
+    store.import_json(json_path)
+    return _measure(store.save, store.latest, users, OPS)
+
+
+def _measure(save, latest, users, ops):
+    t0 = time.perf_counter()
+    for i in range(ops): save(1000 + i % users, 79.5)
+    t1 = time.perf_counter()
+    for i in range(ops): latest(1000 + i % users)
+    t2 = time.perf_counter()
+    return (t1 - t0) / ops * 1e6, (t2 - t1) / ops * 1e6
+
+
+def main():
+    print(f"{'users':>7} {'days':>5} | {'json save':>11} {'json latest':>12} | {'store save':>11} {'store latest':>13}  (мкс/операция)")
+    for users, days in [(10, 30), (100, 90), (1000, 180), (5000, 365)]:
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, "weight_log.json")
+            with open(json_path, "w", encoding="utf-8") as f: json.dump(make_log(users, days), f, indent=4)
+            store_save, store_latest = bench_store(os.path.join(tmp, "bench.db"), json_path, users)
+            json_save, json_latest = bench_json(json_path, users) if users * days <= 200_000 else (float("nan"),) * 2
+        print(f"{users:>7} {days:>5} | {json_save:>11.0f} {json_latest:>12.0f} | {store_save:>11.0f} {store_latest:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
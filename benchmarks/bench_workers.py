@@ -0,0 +1,190 @@
+"""Несколько воркеров бота на одной базе: пропускная способность и отсутствие повторных напоминаний.
+
+Для каждого числа воркеров запускаются отдельные процессы main.py с общей
+базой SQLite и вебхуками на локальных портах. Bot API подменен заглушкой
+с задержкой ответа, как у настоящего Telegram. Апдейты раздаются воркерам
+по кругу, как это делал бы балансировщик; чужие апдейты воркер пересылает
+владельцу. После нагрузки каждый воркер проходит все слоты напоминаний
+о воде и рассылку о взвешивании, и проверяется, что каждый подписчик
+получил каждое напоминание ровно один раз.
+
+Воркер обрабатывает апдейты последовательно и почти все время ждет ответа
+Bot API, поэтому пропускная способность растет с числом воркеров и на
+одном ядре, пока процессор не станет узким местом.
+
+Запуск: python benchmarks/bench_workers.py [число воркеров ...]
+"""
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOKEN = "123456:BENCH"
+USERS = 2000
+UPDATES = 2000
+API_LATENCY = 0.03  # секунд на ответ Bot API
+CONCURRENCY = 64  # одновременных запросов балансировщика
+BASE_PORT = 18600
+SEED_DAY = "2026-01-01"  # вес записан давно, поэтому напоминание о взвешивании положено всем
+
+
+class FakeBotApi:
+    """Транспорт Bot API без сети: отвечает с задержкой, считает ответы пользователям и напоминания."""
+
+    def __new__(cls, *args, **kwargs):
+        # BaseRequest импортируется в воркере вместе с main, родителю он не нужен
+        from telegram.request import BaseRequest
+
+        class Request(BaseRequest):
+            def __init__(self, replies, latency):
+                self.replies = replies
+                self.latency = latency
+                self.reminded = []
+
+            @property
+            def read_timeout(self):
+                return None
+
+            async def initialize(self):
+                pass
+
+            async def shutdown(self):
+                pass
+
+            async def do_request(self, url, method, request_data=None, **kwargs):
+                endpoint = url.rsplit("/", 1)[-1]
+                params = request_data.parameters if request_data else {}
+                if endpoint == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"}
+                elif endpoint == "sendMessage":
+                    await asyncio.sleep(self.latency)
+                    text = params.get("text", "")
+                    if text.startswith(("💧", "⚖️")): self.reminded.append((text[0], int(params["chat_id"])))
+                    else:
+                        with self.replies.get_lock(): self.replies.value += 1
+                    result = {"message_id": 1, "date": 0, "chat": {"id": int(params["chat_id"]), "type": "private"}, "text": text}
+                else:
+                    result = True
+                return 200, json.dumps({"ok": True, "result": result}).encode()
+
+        return Request(*args, **kwargs)
+
+
+def seed(db_path):
+    from db import Database
+    from profile_store import ProfileRepository
+    from reminders import ReminderScheduler
+    from weight_store import WeightStore
+
+    db = Database(db_path)
+    profiles, weights = ProfileRepository(db), WeightStore(db)
+    for i in range(USERS):
+        chat_id = str(100000 + i)
+        profiles[chat_id] = {"gender": "женский", "age": 30, "height": 165, "activity": 2, "diet_goal": "баланс", "preferences": [], "exclusions": []}
+        weights.save(chat_id, 70.0, SEED_DAY)
+    profiles.flush()
+    ReminderScheduler(db).subscribe_many(range(100000, 100000 + USERS))
+    db.set_meta("reminders_migrated", "bench")
+    db.close()
+
+
+def worker(index, count, db_path, workdir, ports, ready, go, replies, results):
+    os.chdir(workdir)
+    os.environ.update(DATABASE_FILE=db_path, WORKER_COUNT=str(count), WORKER_INDEX=str(index),
+                      WORKER_URLS=",".join(f"http://127.0.0.1:{port}/" for port in ports), TELEGRAM_OVERALL_RATE="100000")
+    import main
+    from telegram.ext import CallbackContext
+
+    async def run():
+        main.init_storage()
+        request = FakeBotApi(replies, API_LATENCY)
+        app = main.build_application(TOKEN, request=request)
+        # Прогрев графиков и напоминания по расписанию в замере не нужны: напоминания запускаем сами
+        for name in ("prewarm", "water_reminders", "weigh_in_reminders"):
+            for job in app.job_queue.get_jobs_by_name(name): job.schedule_removal()
+        await app.initialize(); await app.start()
+        await app.updater.start_webhook(listen="127.0.0.1", port=ports[index], secret_token=TOKEN.split(":")[-1], webhook_url=f"http://127.0.0.1:{ports[index]}/")
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, go.wait)
+        context = CallbackContext(app)
+        scheduler = main.reminder_scheduler
+        for slot in range(scheduler.slots_count):
+            scheduler.current_slot = lambda now=None, slot=slot: slot
+            await main.water_reminder_tick(context)
+        await main.weigh_in_reminder_tick(context)
+        forwarded = app.forwarder.stats() if isinstance(app, main.ShardedApplication) else {}
+        results.put((index, request.reminded, forwarded, len(scheduler)))
+        await app.updater.stop(); await app.stop(); await app.shutdown()
+
+    asyncio.run(run())
+
+
+async def send_updates(ports):
+    import httpx
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": TOKEN.split(":")[-1]}
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(i):
+            chat_id = 100000 + i % USERS
+            update = {"update_id": i + 1, "message": {"message_id": i + 1, "date": int(time.time()), "text": "Рассчитать КБЖУ",
+                                                      "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "U"}}}
+            async with semaphore:
+                response = await client.post(f"http://127.0.0.1:{ports[i % len(ports)]}/", json=update, headers=headers)
+                response.raise_for_status()
+        await asyncio.gather(*(post(i) for i in range(UPDATES)))
+
+
+def run(count, db_path, workdir, run_index):
+    ctx = multiprocessing.get_context("spawn")
+    ports = [BASE_PORT + run_index * 10 + i for i in range(count)]
+    replies, results = ctx.Value("q", 0), ctx.Queue()
+    ready, go = [ctx.Event() for _ in range(count)], ctx.Event()
+    processes = [ctx.Process(target=worker, args=(i, count, db_path, workdir, ports, ready[i], go, replies, results)) for i in range(count)]
+    for process in processes: process.start()
+    for event in ready:
+        if not event.wait(120): raise RuntimeError("Воркер не запустился")
+
+    started = time.perf_counter()
+    asyncio.run(send_updates(ports))
+    while replies.value < UPDATES:
+        if time.perf_counter() - started > 300: raise RuntimeError(f"Обработано только {replies.value} из {UPDATES}")
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    go.set()
+    reports = [results.get(timeout=300) for _ in range(count)]
+    for process in processes: process.join(60)
+
+    water = collections.Counter(chat_id for _, reminded, _, _ in reports for kind, chat_id in reminded if kind == "💧")
+    weigh = collections.Counter(chat_id for _, reminded, _, _ in reports for kind, chat_id in reminded if kind == "⚖")
+    duplicates = sum(n - 1 for n in water.values() if n > 1) + sum(n - 1 for n in weigh.values() if n > 1)
+    missing = USERS - len(water) + USERS - len(weigh)
+    forwarded = sum(stats.get("forwarded", 0) for _, _, stats, _ in reports)
+    owned = "/".join(str(subscribers) for _, _, _, subscribers in sorted(reports))
+    print(f"воркеров {count}: {UPDATES / elapsed:6.1f} апдейтов/с ({elapsed:5.1f} с), переслано владельцу {forwarded:>4}, "
+          f"подписчиков по воркерам {owned}, напоминаний {sum(water.values()) + sum(weigh.values())}: повторов {duplicates}, пропущено {missing}")
+    return UPDATES / elapsed, duplicates, missing
+
+
+def main(counts):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.db")
+        seed(db_path)
+        print(f"Пользователей {USERS}, апдейтов {UPDATES}, задержка Bot API {API_LATENCY * 1000:.0f} мс, ядер {os.cpu_count()}")
+        baseline = None
+        for run_index, count in enumerate(counts):
+            throughput, duplicates, missing = run(count, db_path, workdir, run_index)
+            baseline = baseline or throughput
+            if count > 1: print(f"  ускорение относительно {counts[0]} воркера: x{throughput / baseline:.2f}")
+            if duplicates or missing: raise SystemExit("Напоминания разосланы неверно")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 2, 4])
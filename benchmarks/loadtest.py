@@ -0,0 +1,414 @@
+"""Нагрузочный тест бота без сети: заглушки Bot API и Gemini, синтетические апдейты.
+
+Настоящий Application из main.build_application получает апдейты через
+update_queue, как от вебхука. Bot API — локальный HTTP-сервер в отдельном
+процессе с задержкой ответа (бот ходит к нему через TELEGRAM_API_URL);
+Gemini — подставной модуль google.generativeai, который отвечает JSON
+нужной формы с настраиваемой задержкой и размером ответа.
+
+Для каждого числа пользователей база заполняется заранее (профили, неделя
+взвешиваний, подписки на напоминания), затем виртуальные пользователи
+проходят сценарии: настройка профиля новым пользователем, запись веса, меню
+на день с рецептом, заменой блюда и списком покупок, дневник питания, рецепт
+из холодильника. Каждый размер запускается в отдельном процессе, чтобы
+честно мерить память.
+
+В отчете: апдейтов в секунду; p50/p99 времени обработки апдейта (от первого
+до последнего обработчика) и ответа (от постановки в очередь, с ожиданием
+своей очереди); прирост памяти процесса на пользователя после загрузки
+данных; блокировки event loop дольше STALL_THRESHOLD.
+
+Запуск: python benchmarks/loadtest.py [--users 1000 10000 100000] [--sessions 300] [--llm-latency 0.3] ...
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TOKEN = "123456:LOADTEST"
+FIRST_USER_ID = 1_000_000  # заранее созданные пользователи: FIRST_USER_ID .. FIRST_USER_ID + users - 1
+NEW_USER_ID = 900_000_000  # пользователи, которые проходят настройку профиля во время теста
+SEED_DAYS = 7  # дней истории веса у каждого созданного пользователя
+SCENARIO_WEIGHTS = {"onboarding": 0.15, "weight": 0.30, "menu": 0.25, "food_log": 0.20, "fridge": 0.10}
+SCENARIO_NAMES = {"onboarding": "настройка", "weight": "вес", "menu": "меню", "food_log": "дневник", "fridge": "холодильник"}
+DIET_GOALS = ("Сбалансированное похудение", "Похудение с акцентом на мышцы", "Активное жиросжигание (Низкоугл.)")
+STALL_THRESHOLD = 0.05  # секунд: опоздание event loop больше этого считается блокировкой
+LOOP_SAMPLE_INTERVAL = 0.02
+UNLIMITED_RATE = 1_000_000  # лимиты отправки Telegram мешают мерить сам бот, по умолчанию они сняты
+
+
+def food_names():
+    with open(os.path.join(ROOT, "data", "food_composition.json"), encoding="utf-8") as f:
+        return [food["name"] for food in json.load(f)["foods"]]
+
+
+def rss_bytes():
+    """Резидентная память процесса сейчас (Linux), иначе — пиковая."""
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def ms_text(seconds):
+    return f"{seconds * 1000:.0f} мс"
+
+
+def percentile(values, q):
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# --- Заглушка Bot API ---
+
+def fake_bot_api(port, latency, ready):
+    """Отдельный процесс: отвечает на методы Bot API с задержкой latency, GET /stats — счетчики вызовов."""
+    import tornado.httpserver
+    import tornado.web
+
+    counts = collections.Counter()
+    message_ids = itertools.count(1)
+
+    class BotApiHandler(tornado.web.RequestHandler):
+        async def post(self, token, method):
+            params = {key: values[-1].decode() for key, values in self.request.body_arguments.items()}
+            counts[method] += 1
+            if method == "getMe":
+                self.write({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bot", "username": "loadtest_bot"}}); return
+            await asyncio.sleep(latency)
+            if method in ("sendMessage", "sendPhoto", "editMessageText"):
+                chat_id = int(params.get("chat_id") or 0)
+                result = {"message_id": int(params.get("message_id") or next(message_ids)), "date": int(time.time()),
+                          "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+            else:
+                result = True
+            self.write({"ok": True, "result": result})
+
+    class StatsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.write(dict(counts)); counts.clear()
+
+    async def serve():
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", BotApiHandler), (r"/stats", StatsHandler)], log_function=lambda handler: None)
+        tornado.httpserver.HTTPServer(app).listen(port, address="127.0.0.1")
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+# --- Заглушка Gemini ---
+
+class FakeGemini:
+    """Отвечает на промпты бота JSON той же формы, что Gemini. size — продуктов в блюде и шагов в рецепте."""
+
+    def __init__(self, latency, size, foods):
+        self.latency = latency
+        self.size = size
+        self.foods = foods
+        self.dishes = itertools.count(1)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        text = json.dumps(self.answer(prompt), ensure_ascii=False)
+        usage = types.SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return types.SimpleNamespace(text=f"```json\n{text}\n```", usage_metadata=usage)
+
+    def meal(self, meal_type):
+        n = next(self.dishes)
+        items = [[self.foods[(n + i) % len(self.foods)], 50 + 10 * i, "г"] for i in range(self.size)]
+        return {"t": meal_type, "n": f"Блюдо {n}", "i": items, "k": [400 + n % 200, 25, 12, 45],
+                "r": " ".join(f"Шаг {i + 1}: подготовить и приготовить продукты." for i in range(self.size))}
+
+    def answer(self, prompt):
+        if "Найди замену" in prompt: return self.meal("Обед")
+        if "Создай план питания" in prompt:
+            days = int(re.search(r"план питания на (\d+)", prompt).group(1))
+            return {"d": [{"m": [self.meal(meal_type) for meal_type in ("Завтрак", "Обед", "Ужин")]} for _ in range(days)]}
+        if "Подсчитай КБЖУ" in prompt:
+            return [{"calories": 250, "protein": 12, "fat": 9, "carbs": 30} for _ in re.findall(r"^\s*\d+\. ", prompt, re.M)]
+        if "рецепт из следующих ингредиентов" in prompt:
+            ingredients = re.search(r"ингредиентов: (.*?)\.\n", prompt).group(1).split(", ")
+            return {"dish_name": f"Блюдо из холодильника {next(self.dishes)}", "description": "Быстрое блюдо на каждый день.",
+                    "ingredients_used": ingredients, "recipe_steps": [f"Шаг {i + 1}." for i in range(self.size)]}
+        raise ValueError(f"неизвестный промпт: {prompt.strip()[:80]}")
+
+
+def install_fake_gemini(latency, size, foods):
+    """Подменяет google.generativeai до импорта main: create_gemini_model работает без изменений."""
+    try:
+        import google as package
+    except ImportError:
+        package = sys.modules["google"] = types.ModuleType("google")
+    module = types.ModuleType("google.generativeai")
+    module.configure = lambda **kwargs: None
+    module.GenerativeModel = lambda name, **kwargs: FakeGemini(latency, size, foods)
+    package.generativeai = sys.modules["google.generativeai"] = module
+
+
+# --- Данные ---
+
+def seed(db_path, users, workdir):
+    """Профили, неделя взвешиваний и подписки на напоминания для users пользователей."""
+    from db import Database
+    from profile_store import ProfileRepository
+    from reminders import ReminderScheduler
+    from weight_store import WeightStore
+
+    rng = random.Random(users)
+    db = Database(db_path)
+    profiles = ProfileRepository(db)
+    today = datetime.date.today()
+    history = {}
+    for chat_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        profiles[chat_id] = {"gender": rng.choice(("мужской", "женский")), "age": rng.randint(18, 70), "height": rng.randint(150, 200),
+                             "activity": rng.randint(1, 5), "diet_goal": rng.choice(("баланс", "белок", "низкоугл")), "preferences": [], "exclusions": []}
+        weight = rng.uniform(60, 120)
+        history[str(chat_id)] = {(today - datetime.timedelta(days=day)).isoformat(): round(weight - day * 0.1, 1) for day in range(SEED_DAYS, 0, -1)}
+    profiles.flush()
+    path = os.path.join(workdir, "seed_weights.json")
+    with open(path, "w", encoding="utf-8") as f: json.dump(history, f)
+    WeightStore(db).import_json(path)
+    os.remove(path)
+    ReminderScheduler(db).subscribe_many(range(FIRST_USER_ID, FIRST_USER_ID + users))
+    db.set_meta("reminders_migrated", "loadtest")
+    db.close()
+
+
+# --- Нагрузка ---
+
+def message_body(user_id, text):
+    message = {"message_id": 1, "date": int(time.time()), "text": text, "chat": {"id": user_id, "type": "private"},
+               "from": {"id": user_id, "is_bot": False, "first_name": "Load"}}
+    if text.startswith("/"): message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return message
+
+
+def callback_body(user_id, data, query_id):
+    return {"id": str(query_id), "chat_instance": "1", "data": data, "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "message": {"message_id": 1, "date": int(time.time()), "text": "меню", "chat": {"id": user_id, "type": "private"}}}
+
+
+class LoadRunner:
+    """Виртуальные пользователи, которые по очереди проходят сценарии и ждут ответа на каждый апдейт."""
+
+    def __init__(self, main, app, users, options):
+        self.main = main
+        self.app = app
+        self.users = users
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.foods = food_names()
+        self.update_ids = itertools.count(1)
+        self.new_users = itertools.count(NEW_USER_ID)
+        self.busy = set()  # пользователи, чей сценарий идет сейчас: один пользователь не проходит два сценария сразу
+        self.pending = {}  # update_id -> [сценарий, поставлен в очередь, начало обработки, Future]
+        self.handler_times = collections.defaultdict(list)
+        self.response_times = collections.defaultdict(list)
+
+    async def on_start(self, update, context):
+        self.pending[update.update_id][2] = time.perf_counter()
+
+    async def on_finish(self, update, context):
+        scenario, queued, started, future = self.pending.pop(update.update_id)
+        now = time.perf_counter()
+        self.handler_times[scenario].append(now - started)
+        self.response_times[scenario].append(now - queued)
+        future.set_result(None)
+
+    async def send(self, scenario, user_id, text=None, callback=None):
+        from telegram import Update
+
+        update_id = next(self.update_ids)
+        body = {"update_id": update_id}
+        if callback is None: body["message"] = message_body(user_id, text)
+        else: body["callback_query"] = callback_body(user_id, callback, update_id)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = [scenario, time.perf_counter(), None, future]
+        await self.app.update_queue.put(Update.de_json(body, self.app.bot))
+        await future
+
+    def existing_user(self):
+        while True:
+            user_id = FIRST_USER_ID + self.rng.randrange(self.users)
+            if user_id not in self.busy: return user_id
+
+    async def onboarding(self, user_id):
+        rng = self.rng
+        for text in ("/start", rng.choice(("Мужской", "Женский")), str(rng.randint(18, 70)), str(rng.randint(150, 200)),
+                     f"{rng.uniform(55, 120):.1f}", str(rng.randint(1, 5)), rng.choice(DIET_GOALS)):
+            await self.send("onboarding", user_id, text)
+
+    async def weight(self, user_id):
+        await self.send("weight", user_id, f"Вес {self.rng.uniform(60, 120):.1f}")
+
+    async def menu(self, user_id):
+        await self.send("menu", user_id, "Показать меню на день")
+        menu = await self.main.get_user_menu(self.app.user_data[user_id])
+        if not menu or not menu["days"]: return
+        meal_ids = menu["days"][0]["meal_ids"]
+        await self.send("menu", user_id, callback=f"recipe:{self.rng.choice(meal_ids)}")
+        await self.send("menu", user_id, callback=f"replace:0:{self.rng.choice(meal_ids)}")
+        await self.send("menu", user_id, callback="show_shopping_list")
+
+    async def food_log(self, user_id):
+        await self.send("food_log", user_id, "Записать еду")
+        items = [f"{name} {self.rng.randint(50, 300)} г" for name in self.rng.sample(self.foods, self.rng.randint(1, 3))]
+        # Часть блюд нет в справочнике: их КБЖУ спрашивается у Gemini, затем берется из кэша
+        if self.rng.random() < 0.5: items.append(f"домашнее блюдо {self.rng.randrange(self.options['unknown_foods'])}")
+        for item in items: await self.send("food_log", user_id, item)
+        await self.send("food_log", user_id, "Готово")
+
+    async def fridge(self, user_id):
+        await self.send("fridge", user_id, "Что в холодильнике?")
+        await self.send("fridge", user_id, ", ".join(self.rng.sample(self.foods[:30], 3)))
+
+    async def virtual_user(self, sessions):
+        while sessions:
+            scenario = sessions.pop()
+            user_id = next(self.new_users) if scenario == "onboarding" else self.existing_user()
+            self.busy.add(user_id)
+            try:
+                await getattr(self, scenario)(user_id)
+            finally:
+                self.busy.discard(user_id)
+
+    async def run(self):
+        sessions = self.rng.choices(list(SCENARIO_WEIGHTS), weights=list(SCENARIO_WEIGHTS.values()), k=self.options["sessions"])
+        started = time.perf_counter()
+        await asyncio.gather(*(self.virtual_user(sessions) for _ in range(self.options["concurrency"])))
+        return time.perf_counter() - started
+
+
+async def run_load(users, options, api_url):
+    import httpx
+    import main
+    from metrics import LoopMonitor
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    gc.collect(); rss_start = rss_bytes()
+    main.init_storage()
+    app = main.build_application(TOKEN)
+    # Рассылки и фоновое заполнение пула по расписанию в замер не входят
+    for name in ("prewarm", "water_reminders", "weigh_in_reminders", "fill_menu_pool"):
+        for job in app.job_queue.get_jobs_by_name(name): job.schedule_removal()
+    if not options["telegram_limits"]: main.outbound_limiter.chat_rate = main.outbound_limiter.chat_burst = UNLIMITED_RATE
+    await app.initialize()
+    gc.collect(); rss_loaded = rss_bytes()
+    await main.chart_service.warm_up()
+
+    runner = LoadRunner(main, app, users, options)
+    app.add_handler(TypeHandler(Update, runner.on_start), group=-1)
+    app.add_handler(TypeHandler(Update, runner.on_finish), group=99)
+    lags = []
+    monitor = LoopMonitor(lags.append, interval=LOOP_SAMPLE_INTERVAL)
+    async with httpx.AsyncClient() as client:
+        await client.get(f"{api_url}/stats")  # сбрасываем счетчики прогрева
+        await app.start(); monitor.start()
+        elapsed = await runner.run()
+        await monitor.stop()
+        api_calls = (await client.get(f"{api_url}/stats")).json()
+    gc.collect(); rss_end = rss_bytes()
+    llm_calls = sum(stats["calls"] for stats in main.llm_gateway.stats()["labels"].values())
+    await app.stop(); await app.shutdown(); await app.post_shutdown(app)
+    stalls = [lag for lag in lags if lag > STALL_THRESHOLD]
+    return {"users": users, "elapsed": elapsed, "handler_times": dict(runner.handler_times), "response_times": dict(runner.response_times),
+            "rss_start": rss_start, "rss_loaded": rss_loaded, "rss_end": rss_end, "stalls": stalls, "max_lag": max(lags, default=0.0),
+            "api_calls": api_calls, "llm_calls": llm_calls}
+
+
+def worker(users, options, db_path, workdir, api_url, results):
+    os.chdir(workdir)
+    os.environ.update(DATABASE_FILE=db_path, TELEGRAM_API_URL=api_url, GEMINI_API_KEY="offline", GEMINI_REQUESTS_PER_MINUTE=str(UNLIMITED_RATE))
+    if not options["telegram_limits"]: os.environ["TELEGRAM_OVERALL_RATE"] = str(UNLIMITED_RATE)
+    install_fake_gemini(options["llm_latency"], options["llm_size"], food_names())
+    from logs import setup_logging
+    setup_logging("WARNING", json_format=False)
+    try:
+        results.put(asyncio.run(run_load(users, options, api_url)))
+    except BaseException as e:
+        results.put({"users": users, "error": f"{type(e).__name__}: {e}"}); raise
+
+
+def report(result, previous=None):
+    if "error" in result: raise SystemExit(f"пользователей {result['users']}: ошибка {result['error']}")
+    handler = [t for times in result["handler_times"].values() for t in times]
+    response = [t for times in result["response_times"].values() for t in times]
+    updates = len(handler)
+    ms = lambda seconds: f"{seconds * 1000:.0f}"
+    per_user = (result["rss_loaded"] - result["rss_start"]) / result["users"]
+    stalls = result["stalls"]
+    print(f"пользователей {result['users']:>6}: {updates / result['elapsed']:6.1f} апдейтов/с ({updates} за {result['elapsed']:.1f} с), "
+          f"обработка p50 {ms(percentile(handler, 0.5))} / p99 {ms(percentile(handler, 0.99))} мс, "
+          f"ответ p50 {ms(percentile(response, 0.5))} / p99 {ms(percentile(response, 0.99))} мс")
+    print(f"  память: {per_user / 1024:.2f} КБ на пользователя (данные {(result['rss_loaded'] - result['rss_start']) / 2 ** 20:.1f} МБ, "
+          f"после нагрузки процесс {result['rss_end'] / 2 ** 20:.0f} МБ); блокировки loop > {ms(STALL_THRESHOLD)} мс: {len(stalls)}, "
+          f"всего {sum(stalls):.2f} с, худшая {ms(result['max_lag'])} мс")
+    print("  по сценариям, обработка p50/p99 мс: " + ", ".join(
+        f"{SCENARIO_NAMES[name]} {ms(percentile(times, 0.5))}/{ms(percentile(times, 0.99))}" for name, times in sorted(result["handler_times"].items())))
+    if previous is not None:
+        # Разница между размерами без постоянных затрат на загрузку модулей и справочников
+        marginal = (result["rss_loaded"] - previous["rss_loaded"]) / (result["users"] - previous["users"])
+        print(f"  память сверх {previous['users']} пользователей: {marginal / 1024:.2f} КБ на каждого следующего")
+    api_total = sum(result["api_calls"].values())
+    print(f"  Bot API: {api_total / updates:.2f} запроса на апдейт, Gemini: {result['llm_calls']} вызовов")
+
+
+def main(options):
+    ctx = multiprocessing.get_context("spawn")
+    api_ready = ctx.Event()
+    api_url = f"http://127.0.0.1:{options['api_port']}"
+    server = ctx.Process(target=fake_bot_api, args=(options["api_port"], options["api_latency"], api_ready), daemon=True)
+    server.start()
+    if not api_ready.wait(30): raise RuntimeError("Заглушка Bot API не запустилась")
+    print(f"Сценариев {options['sessions']}, виртуальных пользователей {options['concurrency']}, задержка Bot API {ms_text(options['api_latency'])}, "
+          f"Gemini {ms_text(options['llm_latency'])}, продуктов в блюде {options['llm_size']}, ядер {os.cpu_count()}")
+    previous = None
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for users in options["users"]:
+                workdir = os.path.join(tmp, str(users)); os.mkdir(workdir)
+                db_path = os.path.join(workdir, "loadtest.db")
+                started = time.perf_counter(); seed(db_path, users, workdir)
+                print(f"База на {users} пользователей заполнена за {time.perf_counter() - started:.1f} с")
+                results = ctx.Queue()
+                process = ctx.Process(target=worker, args=(users, options, db_path, workdir, api_url, results))
+                process.start()
+                result = results.get(timeout=3600)
+                process.join(60)
+                report(result, previous)
+                previous = result
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота без сети")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000], help="числа пользователей в базе")
+    parser.add_argument("--sessions", type=int, default=300, help="сценариев на каждый размер")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных виртуальных пользователей")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="задержка ответа Bot API, с")
+    parser.add_argument("--api-port", type=int, default=18900)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="средняя задержка ответа Gemini, с")
+    parser.add_argument("--llm-size", type=int, default=5, help="продуктов в блюде и шагов в рецепте в ответах Gemini")
+    parser.add_argument("--unknown-foods", type=int, default=200, help="разных блюд, которых нет в справочнике")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты отправки Telegram (1 сообщение в секунду на чат)")
+    parser.add_argument("--seed", type=int, default=1)
+    main(vars(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""Рабочий процесс графиков.
+
+ChartService запускает его как `python chart_worker.py`: процесс читает из
+stdin задания (имя функции, аргументы) и пишет в stdout PNG. Модуль не
+импортирует ничего из бота, поэтому рабочий процесс не загружает main.py,
+Telegram и Gemini, как это делал пул multiprocessing со spawn.
+
+Кадр протокола — 4 байта длины (big-endian) и pickle: задание
+(имя, аргументы), ответ (успех, PNG или текст ошибки).
+"""
+import datetime
+import io
+import pickle
+import struct
+import sys
+
+HEADER = struct.Struct(">I")
+
+
+def render_weight_chart(days, weights):
+    """PNG графика веса. days — даты в ISO-формате, weights — значения в кг."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    dates = [datetime.date.fromisoformat(d) for d in days]
+    fig = Figure(figsize=(10, 6)); FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(dates, weights, marker='o', linestyle='-'); ax.set_title("График веса", fontsize=16)
+    ax.set_xlabel("Дата"); ax.set_ylabel("Вес (кг)"); ax.grid(True); fig.autofmt_xdate()
+    buf = io.BytesIO(); fig.savefig(buf, format='png', bbox_inches='tight')
+    return buf.getvalue()
+
+
+def render_pfc_pie_chart(protein, fat, carbs):
+    """PNG круговой диаграммы БЖУ в граммах."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    sizes = [protein, fat, carbs]
+    if sum(sizes) == 0: sizes = [1, 1, 1]
+    fig = Figure(figsize=(6, 4)); FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.pie(sizes, labels=['Белки', 'Жиры', 'Углеводы'], autopct='%1.1f%%', startangle=90, colors=['#ff9999', '#66b3ff', '#99ff99'])
+    ax.axis('equal'); ax.set_title(f"Баланс БЖУ (в граммах)\nБ: {sizes[0]}г, Ж: {sizes[1]}г, У: {sizes[2]}г")
+    buf = io.BytesIO(); fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def warm_up():
+    # Импортируем matplotlib заранее, чтобы первый график не ждал импорта
+    from matplotlib.backends import backend_agg  # noqa: F401
+    from matplotlib import figure  # noqa: F401
+
+
+def loaded_modules():
+    """Имена загруженных модулей: проверка, что в рабочий процесс не попал бот."""
+    return sorted(sys.modules)
+
+
+TASKS = {func.__name__: func for func in (render_weight_chart, render_pfc_pie_chart, warm_up, loaded_modules)}
+
+
+def serve(stdin, stdout):
+    while True:
+        header = stdin.read(HEADER.size)
+        if len(header) < HEADER.size: return  # родитель закрыл stdin
+        name, args = pickle.loads(stdin.read(HEADER.unpack(header)[0]))
+        try:
+            reply = (True, TASKS[name](*args))
+        except Exception as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        data = pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL)
+        stdout.write(HEADER.pack(len(data)) + data); stdout.flush()
+
+
+if __name__ == "__main__":
+    protocol_out = sys.stdout.buffer
+    sys.stdout = sys.stderr  # случайный print не должен испортить протокол
+    serve(sys.stdin.buffer, protocol_out)
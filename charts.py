@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import io
+import pickle
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chart_worker
+from chart_worker import HEADER, render_pfc_pie_chart, render_weight_chart
+
+
+class ChartRenderError(Exception):
+    """Исключение внутри рабочего процесса при отрисовке."""
+
+
+class _WorkerProcess:
+    """Процесс chart_worker.py: задания в stdin, PNG из stdout, по одному за раз."""
+
+    def __init__(self, proc):
+        self.proc = proc
+
+    @classmethod
+    async def start(cls):
+        proc = await asyncio.create_subprocess_exec(sys.executable, chart_worker.__file__, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE)
+        return cls(proc)
+
+    async def call(self, name, args):
+        data = pickle.dumps((name, args), protocol=pickle.HIGHEST_PROTOCOL)
+        self.proc.stdin.write(HEADER.pack(len(data)) + data)
+        await self.proc.stdin.drain()
+        size, = HEADER.unpack(await self.proc.stdout.readexactly(HEADER.size))
+        ok, result = pickle.loads(await self.proc.stdout.readexactly(size))
+        if not ok: raise ChartRenderError(result)
+        return result
+
+    def stop(self):
+        if self.proc.returncode is None:
+            try: self.proc.kill()
+            except ProcessLookupError: pass
+
+
+class ChartService:
+    """Рисует графики вне event loop и кэширует PNG по хэшу входных данных.
+
+    Рисуют до max_workers процессов chart_worker.py, запущенных как отдельные
+    программы: в отличие от пула multiprocessing со spawn, они не импортируют
+    заново main.py со всем ботом. use_processes=False — рисовать в потоках.
+    """
+
+    def __init__(self, max_workers=2, cache_size=256, use_processes=True, on_render=None):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self.use_processes = use_processes
+        self._executor = None  # потоки, если use_processes=False
+        self._slots = asyncio.Semaphore(max_workers)
+        self._idle = []  # свободные рабочие процессы
+        self._workers = set()
+        self._cache = OrderedDict()
+        self._pending = {}  # ключ -> Future уже запущенного рендера тех же данных
+        self.renders = 0
+        self.cache_hits = 0
+        self.on_render = on_render  # on_render(имя графика, секунды) после каждой отрисовки: для метрик
+
+    @property
+    def executor(self):
+        if self._executor is None: self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="charts")
+        return self._executor
+
+    async def _call(self, func, *args):
+        if not self.use_processes: return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        async with self._slots:
+            if self._idle: worker = self._idle.pop()
+            else: worker = await _WorkerProcess.start(); self._workers.add(worker)
+            try:
+                result = await worker.call(func.__name__, args)
+            except ChartRenderError:
+                self._idle.append(worker); raise
+            except BaseException:
+                # Отмена или падение процесса посреди ответа: протокол сбился, процесс заменим новым
+                worker.stop(); self._workers.discard(worker); raise
+            self._idle.append(worker)
+            return result
+
+    async def _render(self, func, *args):
+        key = hashlib.sha1(repr((func.__name__, args)).encode("utf-8")).hexdigest()
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key); self.cache_hits += 1
+        elif key in self._pending:
+            png = await asyncio.shield(self._pending[key]); self.cache_hits += 1
+        else:
+            future = asyncio.ensure_future(self._call(func, *args))
+            self._pending[key] = future
+            started = time.perf_counter()
+            try:
+                png = await future
+            finally:
+                del self._pending[key]
+                if self.on_render is not None: self.on_render(func.__name__, time.perf_counter() - started)
+            self.renders += 1
+            self._cache[key] = png
+            while len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+        return io.BytesIO(png)
+
+    async def weight_chart(self, series):
+        """series — [(день ISO, вес), ...] по возрастанию даты."""
+        return await self._render(render_weight_chart, tuple(d for d, _ in series), tuple(float(w) for _, w in series))
+
+    async def pfc_pie_chart(self, pfc_data):
+        return await self._render(render_pfc_pie_chart, pfc_data.get('protein', 0), pfc_data.get('fat', 0), pfc_data.get('carbs', 0))
+
+    async def warm_up(self):
+        """Запускает рабочие процессы и загружает в них matplotlib."""
+        await asyncio.gather(*(self._call(chart_worker.warm_up) for _ in range(self.max_workers)))
+
+    async def worker_modules(self):
+        """Модули, загруженные в рабочем процессе: проверка, что туда не попал бот."""
+        return await self._call(chart_worker.loaded_modules)
+
+    def shutdown(self):
+        for worker in self._workers: worker.stop()
+        self._workers.clear(); self._idle.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {"renders": self.renders, "cache_hits": self.cache_hits, "cached": len(self._cache), "workers": len(self._workers)}
@@ -0,0 +1,117 @@
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+BUSY_TIMEOUT = 30.0  # секунды: фоновый поток или запуск может подождать запись другого процесса
+LOOP_BUSY_TIMEOUT = 0.25  # поток event loop ждать не может: пока он ждет, стоит весь бот
+LOOP_WRITE_TIMEOUT = 10.0  # секунды: сколько retry_busy повторяет запись обработчика, прежде чем сдаться
+
+
+def connect(path: str, busy_timeout=BUSY_TIMEOUT) -> sqlite3.Connection:
+    """Открывает SQLite в режиме WAL: читатели не блокируют писателя."""
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=busy_timeout)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+    return conn
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def is_busy(error):
+    """Запись не прошла, потому что блокировку держит другое соединение."""
+    return isinstance(error, sqlite3.OperationalError) and "locked" in str(error)
+
+
+async def retry_busy(func, *args, timeout=None):
+    """Короткая запись из обработчика: func(*args) повторяется, пока база занята, не дольше timeout секунд.
+
+    Каждая попытка ждет блокировку не дольше LOOP_BUSY_TIMEOUT, а паузы между
+    попытками loop отдает другим апдейтам. func должна быть повторяемой:
+    менять состояние в памяти только после успешной записи.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (LOOP_WRITE_TIMEOUT if timeout is None else timeout)
+    delay = 0.05
+    while True:
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or loop.time() + delay > deadline: raise
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
+
+
+class Database:
+    """Соединения с общей базой для потоков одного процесса.
+
+    Область блокировок:
+    - Поток с запущенным event loop ходит в базу через свое соединение с
+      busy_timeout LOOP_BUSY_TIMEOUT. Если другой процесс держит блокировку
+      записи дольше, запрос падает с sqlite3.OperationalError («database is
+      locked»), а не останавливает бота на BUSY_TIMEOUT. Поэтому из
+      обработчиков — только короткие записи: строка или небольшая transaction(),
+      через retry_busy, которая повторяет их, пока база занята.
+    - Остальные потоки (asyncio.to_thread) и код до запуска loop работают с conn
+      под lock. lock (RLock) держится на один запрос или на всю transaction(),
+      включая ожидание чужой записи до BUSY_TIMEOUT. Поток event loop этот lock
+      не берет, поэтому фоновые сбросы больших пачек его не задерживают.
+    Выбор соединения зависит только от потока, так что запросы внутри
+    transaction() попадают в ту же транзакцию.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = connect(path)
+        self.lock = threading.RLock()
+        self._loop_conn = connect(path, LOOP_BUSY_TIMEOUT)
+        self._loop_lock = threading.RLock()  # loop бывает и не один: например, в тестах
+
+    def _connection(self):
+        return (self._loop_conn, self._loop_lock) if _in_event_loop() else (self.conn, self.lock)
+
+    def execute(self, sql, params=()):
+        conn, lock = self._connection()
+        with lock:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        with self.transaction() as conn:
+            conn.executemany(sql, rows)
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """BEGIN…COMMIT на соединении текущего потока, при исключении — ROLLBACK.
+
+        immediate=True берет блокировку записи сразу, а не при первой записи.
+        """
+        conn, lock = self._connection()
+        with lock:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key, default=None):
+        self.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def close(self):
+        with self.lock, self._loop_lock:
+            self.conn.close()
+            self._loop_conn.close()
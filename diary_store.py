@@ -0,0 +1,141 @@
+import datetime
+import json
+from array import array
+from collections import OrderedDict
+
+from db import Database
+
+WINDOW = 30  # дней, которые держатся в памяти
+WEEK = 7
+_FIELDS = 4  # ккал, белки, жиры, углеводы
+
+
+class _Window:
+    """Итоги пользователя за последние WINDOW дней: кольцевой массив по дням и скользящие суммы за 7 и 30 дней."""
+
+    __slots__ = ("day", "values", "counts", "sum7", "sum30", "days7", "days30")
+
+    def __init__(self, day):
+        self.day = day  # порядковый номер текущего дня окна
+        self.values = array("d", bytes(8 * WINDOW * _FIELDS))
+        self.counts = array("i", bytes(4 * WINDOW))  # записей за день
+        self.sum7, self.sum30 = array("d", bytes(8 * _FIELDS)), array("d", bytes(8 * _FIELDS))
+        self.days7 = self.days30 = 0  # дней с записями
+
+    def _slot(self, day):
+        return day % WINDOW
+
+    def advance(self, day):
+        """Сдвигает окно вперед до day, вычитая ушедшие дни из сумм. Не больше WINDOW шагов."""
+        if day <= self.day: return
+        if day - self.day >= WINDOW:
+            self.__init__(day); return
+        for current in range(self.day + 1, day + 1):
+            leaving7 = current - WEEK
+            if self.counts[self._slot(leaving7)]:
+                self.days7 -= 1
+                base = self._slot(leaving7) * _FIELDS
+                for k in range(_FIELDS): self.sum7[k] -= self.values[base + k]
+            slot = self._slot(current)  # тот же слот занимал день current - WINDOW
+            if self.counts[slot]:
+                self.days30 -= 1; self.counts[slot] = 0
+                base = slot * _FIELDS
+                for k in range(_FIELDS): self.sum30[k] -= self.values[base + k]; self.values[base + k] = 0.0
+        self.day = day
+
+    def add(self, day, nutrients, entries=1):
+        self.advance(day)
+        if day <= self.day - WINDOW: return
+        slot = self._slot(day)
+        in_week = day > self.day - WEEK
+        if not self.counts[slot]:
+            self.days30 += 1
+            if in_week: self.days7 += 1
+        self.counts[slot] += entries
+        base = slot * _FIELDS
+        for k in range(_FIELDS):
+            self.values[base + k] += nutrients[k]
+            self.sum30[k] += nutrients[k]
+            if in_week: self.sum7[k] += nutrients[k]
+
+    def day_totals(self, day):
+        if day > self.day or day <= self.day - WINDOW: return (0.0,) * _FIELDS
+        base = self._slot(day) * _FIELDS
+        return tuple(self.values[base:base + _FIELDS])
+
+
+class FoodDiary:
+    """Дневник питания: сырые записи, итоги по дням и скользящие итоги за неделю и месяц.
+
+    Каждая запись сразу добавляется к итогу дня в базе (diary_days) и к окну
+    пользователя в памяти, поэтому «съедено сегодня», «осталось на сегодня»
+    и средние за 7/30 дней читаются без пересчета. Окна загружаются при первом
+    обращении и вытесняются по LRU. Старые сырые записи удаляет compact():
+    итоги по дням остаются.
+    """
+
+    def __init__(self, db: Database, raw_retention_days=30, summary_retention_days=730, max_users=20000, today=datetime.date.today):
+        self.db = db
+        self.raw_retention_days = raw_retention_days
+        self.summary_retention_days = summary_retention_days
+        self.max_users = max_users
+        self._today = today
+        self.db.execute("CREATE TABLE IF NOT EXISTS diary_entries (chat_id TEXT NOT NULL, day TEXT NOT NULL, items TEXT NOT NULL, kcal REAL, p REAL, f REAL, c REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS diary_entries_day ON diary_entries (day)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS diary_days (chat_id TEXT NOT NULL, day TEXT NOT NULL, kcal REAL, p REAL, f REAL, c REAL, entries INTEGER,"
+                        " PRIMARY KEY (chat_id, day)) WITHOUT ROWID")
+        self._windows = OrderedDict()
+
+    def _window(self, chat_id):
+        today = self._today().toordinal()
+        window = self._windows.get(chat_id)
+        if window is None:
+            window = _Window(today)
+            since = datetime.date.fromordinal(today - WINDOW + 1).isoformat()
+            for day, kcal, p, f, c, entries in self.db.execute("SELECT day, kcal, p, f, c, entries FROM diary_days WHERE chat_id = ? AND day >= ?", (chat_id, since)):
+                window.add(datetime.date.fromisoformat(day).toordinal(), (kcal, p, f, c), entries)
+            self._windows[chat_id] = window
+            while len(self._windows) > self.max_users: self._windows.popitem(last=False)
+        self._windows.move_to_end(chat_id)
+        window.advance(today)
+        return window
+
+    def add(self, chat_id, items, nutrients, day=None):
+        """Записывает прием пищи. nutrients — {'calories', 'protein', 'fat', 'carbs'}."""
+        chat_id = str(chat_id)
+        day = day or self._today()
+        values = tuple(float(nutrients.get(key, 0) or 0) for key in ("calories", "protein", "fat", "carbs"))
+        window = self._window(chat_id)  # загружаем окно до записи, иначе новая запись попадет в него дважды
+        with self.db.transaction() as conn:
+            conn.execute("INSERT INTO diary_entries (chat_id, day, items, kcal, p, f, c) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (chat_id, day.isoformat(), json.dumps(items, ensure_ascii=False), *values))
+            conn.execute("INSERT INTO diary_days (chat_id, day, kcal, p, f, c, entries) VALUES (?, ?, ?, ?, ?, ?, 1)"
+                         " ON CONFLICT (chat_id, day) DO UPDATE SET kcal = kcal + excluded.kcal, p = p + excluded.p,"
+                         " f = f + excluded.f, c = c + excluded.c, entries = entries + 1", (chat_id, day.isoformat(), *values))
+        window.add(day.toordinal(), values)
+
+    def today(self, chat_id):
+        """Итог за сегодня: (ккал, белки, жиры, углеводы)."""
+        window = self._window(str(chat_id))
+        return window.day_totals(window.day)
+
+    def rolling(self, chat_id, days=WEEK):
+        """Суммы за последние 7 или 30 дней и число дней с записями: ((ккал, б, ж, у), дней)."""
+        window = self._window(str(chat_id))
+        if days == WEEK: return tuple(window.sum7), window.days7
+        if days == WINDOW: return tuple(window.sum30), window.days30
+        raise ValueError(f"days должно быть {WEEK} или {WINDOW}")
+
+    def pfc_data(self, chat_id, days=1):
+        """БЖУ в граммах в формате create_pfc_pie_chart: за сегодня или за 7/30 дней."""
+        totals = self.today(chat_id) if days == 1 else self.rolling(chat_id, days)[0]
+        return {"protein": round(totals[1]), "fat": round(totals[2]), "carbs": round(totals[3])}
+
+    def compact(self):
+        """Удаляет сырые записи старше raw_retention_days и итоги дней старше summary_retention_days."""
+        today = self._today()
+        raw_cutoff = (today - datetime.timedelta(days=self.raw_retention_days)).isoformat()
+        summary_cutoff = (today - datetime.timedelta(days=self.summary_retention_days)).isoformat()
+        removed = self.db.execute("DELETE FROM diary_entries WHERE day < ?", (raw_cutoff,)).rowcount
+        removed_days = self.db.execute("DELETE FROM diary_days WHERE day < ?", (summary_cutoff,)).rowcount
+        return removed, removed_days
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+
+from logs import fields
+
+logger = logging.getLogger(__name__)
+
+NUTRIENT_KEYS = ("calories", "protein", "fat", "carbs")
+
+UNIT_ALIASES = {
+    "г": "г", "гр": "г", "грамм": "г", "грамма": "г", "граммов": "г", "g": "г",
+    "кг": "кг", "мл": "мл", "л": "л",
+    "шт": "шт", "штук": "шт", "штука": "шт", "штуки": "шт",
+}
+_QUANTITY_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(" + "|".join(sorted(UNIT_ALIASES, key=len, reverse=True)) + r")\.?(?![а-яa-z])")
+
+
+def canonicalize_food_item(text):
+    """Приводит запись о продукте к единому виду: «Овсянка 50 гр.» -> «овсянка 50г»."""
+    text = text.lower().replace("ё", "е").strip()
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    text = _QUANTITY_RE.sub(lambda m: m.group(1) + UNIT_ALIASES[m.group(2)], text)
+    text = re.sub(r"[^\w\s.%]", " ", text)
+    return " ".join(text.split())
+
+
+def parse_nutrients(value):
+    """КБЖУ одного продукта из ответа модели; ValueError, если это не объект с числами."""
+    if not isinstance(value, dict): raise ValueError(f"ожидался объект КБЖУ, получено: {str(value)[:100]}")
+    try:
+        return {key: float(value.get(key, 0) or 0) for key in NUTRIENT_KEYS}
+    except (TypeError, ValueError):
+        raise ValueError(f"нечисловое КБЖУ: {str(value)[:100]}") from None
+
+
+def sum_nutrients(entries):
+    totals = {key: 0 for key in NUTRIENT_KEYS}
+    for entry in entries:
+        for key in NUTRIENT_KEYS:
+            totals[key] += float(entry.get(key, 0) or 0)
+    return {key: round(value) for key, value in totals.items()}
+
+
+class NutritionCache:
+    """LRU-кэш КБЖУ по отдельным продуктам со снимком на диске."""
+
+    def __init__(self, filepath=None, max_items=10000):
+        self.filepath = filepath
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._changed = False
+        self.hits = 0
+        self.misses = 0
+        self.llm_calls = 0
+        self.llm_calls_saved = 0
+
+    def get(self, item):
+        key = canonicalize_food_item(item)
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, item, nutrients):
+        key = canonicalize_food_item(item)
+        if not key: return
+        self._items[key] = parse_nutrients(nutrients)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+        self._changed = True
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items), "hits": self.hits, "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "llm_calls": self.llm_calls, "llm_calls_saved": self.llm_calls_saved,
+        }
+
+    def _read_snapshot(self, filepath):
+        if not filepath or not os.path.exists(filepath): return []
+        try:
+            with open(filepath, "r", encoding="utf-8") as f: return json.load(f).get("items", [])
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Не удалось прочитать файл", extra=fields(path=filepath, error=str(e))); return []
+
+    def load(self, *extra_paths):
+        """Загружает свой снимок. extra_paths — снимки других процессов: их продукты добавляются, если своих таких нет."""
+        # Порядок в снимке — от давно использованных к недавним
+        self._items = OrderedDict((key, value) for key, value in self._read_snapshot(self.filepath))
+        for path in extra_paths:
+            if path == self.filepath: continue
+            for key, value in self._read_snapshot(path):
+                if key not in self._items: self._items[key] = value; self._items.move_to_end(key, last=False)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def snapshot(self):
+        """Копия содержимого для записи; снимать в потоке event loop."""
+        if not self._changed: return None
+        self._changed = False
+        return list(self._items.items())
+
+    def save(self, items=None):
+        """Атомарно записывает снимок: временный файл и rename."""
+        items = self.snapshot() if items is None else items
+        if items is None or not self.filepath: return
+        tmp_path = self.filepath + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: json.dump({"items": items}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.filepath)
@@ -0,0 +1,115 @@
+import json
+import re
+
+from food_cache import canonicalize_food_item
+
+# Порции больше этого веса в граммах считаем опечаткой и отдаем в Gemini
+MAX_GRAMS = 3000
+
+_AMOUNT_RE = re.compile(r"(\d+(?:\.\d+)?)(г|кг|мл|л|шт)(?!\w)")
+_BARE_NUMBER_RE = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)(?![\w.%])")
+_UNIT_GRAMS = {"г": 1, "мл": 1, "кг": 1000, "л": 1000}
+
+
+# Падежные и родовые окончания, длинные раньше коротких
+_ENDINGS = ("ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ую", "юю", "ый", "ий", "ой", "ые", "ие",
+            "ых", "их", "ом", "ем", "ам", "ям", "ах", "ях", "а", "я", "о", "е", "у", "ю", "ы", "и", "ь", "й")
+
+
+def _inflection_key(name):
+    # Отрезает только окончание: «куриную грудку» и «куриная грудка» дают «курин грудк»,
+    # а «сырок» остается «сырок» и не совпадает с «сыр»
+    words = []
+    for word in name.split():
+        ending = next((e for e in _ENDINGS if word.endswith(e) and len(word) - len(e) >= 3), "")
+        words.append(word[:len(word) - len(ending)])
+    return " ".join(words)
+
+
+class FoodEntry:
+    __slots__ = ("name", "kcal", "p", "f", "c", "piece")
+
+    def __init__(self, name, kcal, p, f, c, piece=None):
+        self.name, self.kcal, self.p, self.f, self.c, self.piece = name, kcal, p, f, c, piece
+
+    def nutrients_for(self, grams):
+        k = grams / 100
+        return {"calories": self.kcal * k, "protein": self.p * k, "fat": self.f * k, "carbs": self.c * k}
+
+
+class FoodIndex:
+    """Локальный справочник КБЖУ с поиском по точному имени и по основе слов.
+
+    resolve() возвращает КБЖУ только для записей, которые удалось разобрать
+    уверенно: название совпало с продуктом или синонимом целиком (с точностью
+    до окончаний) и количество понятно. Поиск по префиксу и опечаткам («вино» ->
+    «виноград», «каша» -> «овсяная каша») слишком часто ошибается, поэтому его
+    нет: такие строки уходят в Gemini.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self._exact = {}
+        self._stems = {}
+        self.resolved = 0
+        self.unresolved = 0
+
+    def load(self, filepath):
+        with open(filepath, "r", encoding="utf-8") as f: data = json.load(f)
+        for food in data["foods"]:
+            self.add(FoodEntry(food["name"], food["kcal"], food["p"], food["f"], food["c"], food.get("piece")), food.get("aliases", []))
+        return self
+
+    def add(self, entry, aliases=()):
+        entry_id = len(self.entries)
+        self.entries.append(entry)
+        for name in (entry.name, *aliases):
+            key = canonicalize_food_item(name)
+            self._exact.setdefault(key, entry_id)
+            self._stems.setdefault(_inflection_key(key), entry_id)
+
+    # --- Поиск продукта ---
+
+    def find(self, name):
+        """Продукт по названию без количества: точное совпадение с названием или синонимом с точностью до окончаний."""
+        key = canonicalize_food_item(name)
+        if not key: return None
+        entry_id = self._exact.get(key)
+        if entry_id is None: entry_id = self._stems.get(_inflection_key(key))
+        return self.entries[entry_id] if entry_id is not None else None
+
+    # --- Разбор строки дневника ---
+
+    @staticmethod
+    def parse_quantity(text):
+        """Отделяет количество от названия: «овсянка 50г» -> («овсянка», 50.0, «г»)."""
+        key = canonicalize_food_item(text)
+        match = _AMOUNT_RE.search(key)
+        if match:
+            return (key[:match.start()] + key[match.end():]).strip(), float(match.group(1)), match.group(2)
+        match = _BARE_NUMBER_RE.search(key)
+        if match:
+            return (key[:match.start()] + key[match.end():]).strip(), float(match.group(1)), None
+        return key, None, None
+
+    def resolve(self, text):
+        """КБЖУ для строки вроде «овсянка 50г» или «2 яйца», либо None, если разбор не уверенный."""
+        name, amount, unit = self.parse_quantity(text)
+        entry = self.find(name) if name else None
+        grams = None
+        if entry is not None:
+            if unit in _UNIT_GRAMS: grams = amount * _UNIT_GRAMS[unit]
+            elif unit == "шт": grams = entry.piece and entry.piece * amount
+            elif amount is None: grams = entry.piece  # «банан» — одна штука
+            elif amount < 10: grams = entry.piece and entry.piece * amount  # «2 яйца» — штуки
+            else: grams = amount  # «курица 150» — граммы
+        if grams is None or not 0 < grams <= MAX_GRAMS:
+            self.unresolved += 1
+            return None
+        self.resolved += 1
+        return entry.nutrients_for(grams)
+
+    def stats(self):
+        total = self.resolved + self.unresolved
+        return {"foods": len(self.entries), "resolved": self.resolved, "unresolved": self.unresolved,
+                "resolved_rate": round(self.resolved / total, 3) if total else 0.0}
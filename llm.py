@@ -0,0 +1,154 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+
+from ratelimit import TokenBucket
+
+# Ошибки API, которые бессмысленно повторять
+NON_RETRYABLE_ERRORS = {"InvalidArgument", "PermissionDenied", "Unauthenticated", "BlockedPromptException", "StopCandidateException"}
+
+
+class LLMError(Exception):
+    pass
+
+
+def parse_json_response(text):
+    """Достает JSON из ответа модели, убирая обрамление ```json ... ```."""
+    return json.loads(text.strip().replace("```json", "").replace("```", ""))
+
+
+class _LabelStats:
+    __slots__ = ("calls", "errors", "retries", "timeouts", "deduplicated", "prompt_tokens", "output_tokens", "latencies")
+
+    def __init__(self):
+        self.calls = self.errors = self.retries = self.timeouts = self.deduplicated = 0
+        self.prompt_tokens = self.output_tokens = 0
+        self.latencies = deque(maxlen=500)
+
+    def summary(self):
+        ordered = sorted(self.latencies)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3) if ordered else None
+        return {"calls": self.calls, "errors": self.errors, "retries": self.retries, "timeouts": self.timeouts,
+                "deduplicated": self.deduplicated, "prompt_tokens": self.prompt_tokens, "output_tokens": self.output_tokens,
+                "latency_p50": pick(0.5), "latency_p95": pick(0.95), "latency_max": round(ordered[-1], 3) if ordered else None}
+
+
+class LLMGateway:
+    """Единая точка обращения к Gemini.
+
+    Один экземпляр модели на процесс, ограничение параллельности (семафор) и
+    частоты (token bucket), таймаут на каждый вызов, повторы с экспоненциальной
+    задержкой и джиттером. Одинаковые запросы, которые уже выполняются,
+    не отправляются повторно, а ждут результат первого (single-flight).
+    """
+
+    def __init__(self, model_factory, max_concurrency=4, requests_per_minute=60, timeout=60, max_retries=2,
+                 backoff_base=1.0, backoff_max=20.0, on_call=None):
+        self._model_factory = model_factory
+        self._model = None
+        self._model_lock = asyncio.Lock()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60, capacity=max_concurrency)
+        self._in_flight = {}  # ключ запроса -> Future для single-flight
+        self._stats = {}
+        self.queue_depth = 0
+        self.active = 0
+        self.on_call = on_call  # on_call(label, секунды, исход) после каждой попытки: для метрик
+
+    async def get_model(self):
+        """Модель создается один раз; фабрика (с тяжелым импортом SDK) выполняется в отдельном потоке."""
+        if self._model is None:
+            async with self._model_lock:
+                if self._model is None:
+                    self._model = await asyncio.to_thread(self._model_factory)
+        return self._model
+
+    def _label_stats(self, label):
+        return self._stats.setdefault(label, _LabelStats())
+
+    async def generate_json(self, prompt, label="llm", single_flight=True, **kwargs):
+        """JSON-ответ модели. Невалидный JSON повторяется так же, как ошибка API."""
+        return await self._run(prompt, label, parse_json_response, single_flight, kwargs)
+
+    async def _run(self, prompt, label, parse, single_flight, kwargs):
+        if not single_flight:
+            return await self._call_with_retries(prompt, label, parse, kwargs)
+        key = (label, prompt, repr(sorted(kwargs.items())))
+        existing = self._in_flight.get(key)
+        if existing is not None:
+            self._label_stats(label).deduplicated += 1
+            return await asyncio.shield(existing)
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._call_with_retries(prompt, label, parse, kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else LLMError("запрос отменен"))
+            future.exception()  # помечаем исключение как полученное, даже если ждущих нет
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _call_with_retries(self, prompt, label, parse, kwargs):
+        stats = self._label_stats(label)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                stats.retries += 1
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                await asyncio.sleep(random.uniform(0, delay))
+            try:
+                return await self._call_once(prompt, label, stats, parse, kwargs)
+            except Exception as e:
+                last_error = e
+                if type(e).__name__ in NON_RETRYABLE_ERRORS: break
+        stats.errors += 1
+        raise LLMError(f"{label}: {type(last_error).__name__}: {last_error}") from last_error
+
+    async def _call_once(self, prompt, label, stats, parse, kwargs):
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.active += 1
+        started = time.perf_counter()
+        text = None
+        outcome = "error"
+        try:
+            model = await self.get_model()
+            await self._bucket.acquire()
+            stats.calls += 1
+            try:
+                response = await asyncio.wait_for(model.generate_content_async(prompt, **kwargs), self.timeout)
+            except asyncio.TimeoutError:
+                stats.timeouts += 1; outcome = "timeout"
+                raise
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                stats.prompt_tokens += getattr(usage, "prompt_token_count", 0) or 0
+                stats.output_tokens += getattr(usage, "candidates_token_count", 0) or 0
+            text = response.text
+            result = parse(text)
+            outcome = "ok"
+            return result
+        except ValueError as e:
+            raise LLMError(f"не удалось разобрать ответ: {e}; ответ: {(text or '')[:300]}") from e
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.latencies.append(elapsed)
+            self.active -= 1
+            self._semaphore.release()
+            if self.on_call is not None: self.on_call(label, elapsed, outcome)
+
+    def stats(self):
+        return {"queue_depth": self.queue_depth, "active": self.active,
+                "labels": {label: s.summary() for label, s in self._stats.items()}}
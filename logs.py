@@ -0,0 +1,57 @@
+import contextvars
+import datetime
+import json
+import logging
+import sys
+from contextlib import contextmanager
+
+# Идентификатор текущего апдейта или задачи: попадает в каждую строку лога, записанную во время его обработки
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def fields(**values):
+    """Поля структурированной записи: logger.info("...", extra=fields(user_id=1, items=3))."""
+    return {"fields": values}
+
+
+@contextmanager
+def request_context(value):
+    token = request_id.set(value)
+    try:
+        yield
+    finally:
+        request_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON: время, уровень, логгер, сообщение, request_id и поля из extra=fields(...)."""
+
+    def format(self, record):
+        entry = {"ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+                 "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        current = request_id.get()
+        if current: entry["request_id"] = current
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Читаемый формат для локального запуска: те же поля, но в строку."""
+
+    def format(self, record):
+        text = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} [{request_id.get() or '-'}] {record.getMessage()}"
+        extra = getattr(record, "fields", None)
+        if extra: text += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+        if record.exc_info: text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+def setup_logging(level="INFO", json_format=True):
+    """Настраивает корневой логгер на stdout. Шумные библиотеки пишут только предупреждения."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_format else TextFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    for name in ("httpx", "apscheduler", "tornado.access"): logging.getLogger(name).setLevel(logging.WARNING)
@@ -1,30 +1,218 @@
 from telegram import Update, CallbackQuery, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters,
-    PicklePersistence, CallbackQueryHandler, JobQueue
+    CallbackQueryHandler, JobQueue
 )
+import asyncio
 import datetime
-import google.generativeai as genai
-import json
+import functools
+import logging
 import os
-import matplotlib.pyplot as plt
-import io
 import random
-from collections import defaultdict
+import sqlite3
+import time
+from collections import Counter, defaultdict
 
-# Создаем глобальную переменную и настраиваем API-ключ при старте
+from apscheduler.events import EVENT_JOB_SUBMITTED
+
+from db import Database, is_busy, retry_busy
+from weight_store import WeightStore
+from profile_store import ProfileRepository
+from food_cache import NutritionCache, parse_nutrients, sum_nutrients
+from food_index import FoodIndex
+from menu_pool import MenuPool, menu_pool_key
+from llm import LLMGateway
+from charts import ChartService
+from reminders import ReminderScheduler, send_batched
+from outbound import OutboundRateLimiter, PRIORITY_BROADCAST
+from sqlite_persistence import SQLitePersistence
+from meal_store import MealStore, compact_menu, day_meals, meal_id, menu_meal_ids
+from prefetch import ReplacementPrefetcher
+from recipe_index import RecipeIndex
+from diary_store import FoodDiary
+from menu_format import MEAL_SCHEMA, MENU_SCHEMA, build_shopping_list, expand_meal, expand_menu
+from sharding import ChatOrderedUpdateProcessor, ShardedApplication, UpdateForwarder, WorkerShard
+from logs import fields, request_context, request_id, setup_logging
+from metrics import LoopMonitor, Registry, SLOW_BUCKETS
+from web import serve_webhook
+
+logger = logging.getLogger("dietbot")
+
+# Ключ читаем при старте, а сам google.generativeai импортируем при первом обращении к модели
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
 
 ### НОВЫЙ КОД: Определяем имя модели в одном месте ###
 MODEL_NAME = "gemini-1.5-flash-latest"
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 4))
+GEMINI_REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 60))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 60))
+LLM_STATS_LOG_INTERVAL = 600
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", 2))
+PREWARM_DELAY = 5  # секунд после запуска до фонового прогрева тяжелых зависимостей
+# Несколько процессов бота с общей базой (DATABASE_FILE на общем томе): чаты делятся между ними по хэшу chat_id
+WORKER_COUNT = int(os.environ.get("WORKER_COUNT", 1))
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", 0))
+# Внутренние адреса вебхуков всех воркеров через запятую, по порядку номеров: туда пересылаются апдейты чужих чатов
+WORKER_URLS = [url.strip() for url in os.environ.get("WORKER_URLS", "").split(",") if url.strip()]
+SHARED_STATE_SYNC_INTERVAL = 2  # секунд между проверками профилей и рецептов, записанных другими воркерами
+# Апдейтов в обработке одновременно; апдейты одного чата все равно идут по очереди
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", 64))
+TELEGRAM_OVERALL_RATE = float(os.environ.get("TELEGRAM_OVERALL_RATE", 30))  # сообщений в секунду на бота
+# Свой сервер Bot API (telegram-bot-api --local или заглушка нагрузочного теста) вместо api.telegram.org
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json — для сбора логов, text — для чтения глазами
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # если задан, /metrics требует Authorization: Bearer <токен>
+LOOP_BLOCK_THRESHOLD = 0.25  # секунд: опоздание event loop больше этого считается блокировкой
 
 # --- Константы и глобальные переменные ---
 WEIGHT_LOG_FILE = "weight_log.json"
 USER_PROFILES_FILE = "user_profiles.json"
-PERSISTENCE_FILE = "my_bot_data.pkl"
+PERSISTENCE_FILE = "my_bot_data.pkl"  # прежний файл PicklePersistence, переносится в базу при первом запуске
+PERSISTENCE_UPDATE_INTERVAL = 60  # секунд между сохранениями user_data
+DATABASE_FILE = os.environ.get("DATABASE_FILE", "dietbot.db")
+PROFILE_FLUSH_INTERVAL = 5  # секунд между фоновыми сохранениями профилей
+def nutrition_cache_file(worker_index):
+    # Каждый воркер пишет свой снимок, читают его все
+    return "nutrition_cache.json" if worker_index == 0 else f"nutrition_cache.worker{worker_index}.json"
+
+NUTRITION_CACHE_FILE = nutrition_cache_file(WORKER_INDEX)
+NUTRITION_CACHE_SAVE_INTERVAL = 300
+MENU_POOL_FILL_TIME = datetime.time(hour=3, minute=0)  # тихие часы для фоновой генерации меню
+MENU_POOL_TARGET_PER_KEY = 5
+MENU_POOL_MAX_GENERATIONS_PER_RUN = 200
+MENU_POOL_DEMAND_BATCH = 200  # профилей между передачами управления loop при подсчете спроса на пул
+FRIDGE_SEEN_LIMIT = 20  # сколько показанных рецептов из холодильника не предлагать повторно
+PROGRESS_PAGE_SIZE = 10  # записей веса на странице истории
+PROGRESS_CHART_DAYS = 90  # период графика веса
+PROGRESS_WEEKS_SHOWN = 4
+MENU_POOL_SEEN_LIMIT = 30  # сколько выданных из пула меню помнить, чтобы не повторяться
+MENU_DAY_ATTEMPTS = 2  # попыток на каждый день многодневного меню
+REPLACEMENT_PREFETCH_PER_MEAL = int(os.environ.get("REPLACEMENT_PREFETCH_PER_MEAL", 1))  # 0 — не готовить замены заранее
+REPLACEMENT_PREFETCH_TTL = 6 * 3600  # секунд, сколько живет заготовленная замена
+WATER_REMINDER_INTERVAL = 7200
+REMINDER_SLOT_SECONDS = 300  # шаг тика напоминаний о воде
+WEIGH_IN_REMINDER_TIME = datetime.time(hour=20, minute=0)
+REMINDER_BATCH_SIZE = 25  # одновременных запросов при рассылке
+DIARY_RAW_RETENTION_DAYS = 30  # дальше в дневнике остаются только итоги по дням
+DIARY_COMPACT_TIME = datetime.time(hour=4, minute=0)
+MEALS_PRUNE_TIME = datetime.time(hour=4, minute=30)  # удаление блюд, на которые не ссылается ни одно меню
+# Одно сообщение на день меню вместо заголовка и сообщения на каждый прием пищи
+MERGE_MENU_DAY_MESSAGES = os.environ.get("MERGE_MENU_DAY_MESSAGES", "1") == "1"
+FOOD_COMPOSITION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "food_composition.json")
 user_profiles_data = {}
+database: Database | None = None
+weight_store: WeightStore | None = None
+reminder_scheduler: ReminderScheduler | None = None
+bot_persistence: SQLitePersistence | None = None
+meal_store: MealStore | None = None
+recipe_index: RecipeIndex | None = None
+food_diary: FoodDiary | None = None
+update_forwarder: UpdateForwarder | None = None
+update_processor: ChatOrderedUpdateProcessor | None = None
+worker_shard = WorkerShard(WORKER_INDEX, WORKER_COUNT)
+nutrition_cache = NutritionCache(NUTRITION_CACHE_FILE)
+food_index = FoodIndex()
+menu_pool = MenuPool()
+
+# --- Метрики ---
+metrics_registry = Registry()
+handler_seconds = metrics_registry.histogram("dietbot_handler_seconds", "Время обработки апдейта обработчиком", ("handler",))
+handler_errors = metrics_registry.counter("dietbot_handler_errors_total", "Исключения в обработчиках апдейтов", ("handler",))
+llm_call_seconds = metrics_registry.histogram("dietbot_llm_call_seconds", "Длительность одной попытки вызова Gemini", ("helper", "outcome"), buckets=SLOW_BUCKETS)
+io_seconds = metrics_registry.histogram("dietbot_io_seconds", "Файловый ввод-вывод и обслуживание базы", ("op",))
+job_lag_seconds = metrics_registry.histogram("dietbot_job_lag_seconds", "Опоздание запуска фоновой задачи относительно расписания", ("job",))
+job_seconds = metrics_registry.histogram("dietbot_job_seconds", "Длительность фоновой задачи", ("job",), buckets=SLOW_BUCKETS)
+telegram_request_seconds = metrics_registry.histogram("dietbot_telegram_request_seconds", "Длительность запроса к Bot API", ("method",))
+chart_render_seconds = metrics_registry.histogram("dietbot_chart_render_seconds", "Отрисовка графика без учета кэша", ("chart",), buckets=SLOW_BUCKETS)
+event_loop_lag = metrics_registry.histogram("dietbot_event_loop_lag_seconds", "Опоздание event loop при замере раз в 100 мс")
+event_loop_blocked = metrics_registry.counter("dietbot_event_loop_blocked_total", "Замеры, в которых event loop был занят дольше LOOP_BLOCK_THRESHOLD")
+active_handlers = Counter()  # обработчики, выполняющиеся прямо сейчас: им приписываются блокировки loop
+
+def create_gemini_model():
+    """Импортирует google.generativeai и создает модель. Вызывается один раз, вне event loop."""
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(MODEL_NAME)
+
+llm_gateway = LLMGateway(create_gemini_model, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                         requests_per_minute=GEMINI_REQUESTS_PER_MINUTE, timeout=GEMINI_TIMEOUT,
+                         on_call=lambda label, seconds, outcome: llm_call_seconds.observe(seconds, helper=label, outcome=outcome))
+chart_service = ChartService(max_workers=CHART_WORKERS, on_render=lambda name, seconds: chart_render_seconds.observe(seconds, chart=name))
+# Общий лимит Telegram на бота делится между воркерами; лимит на чат у каждого свой, ведь чат обслуживает один воркер
+outbound_limiter = OutboundRateLimiter(overall_rate=TELEGRAM_OVERALL_RATE / WORKER_COUNT,
+                                       on_request=lambda method, seconds: telegram_request_seconds.observe(seconds, method=method))
+
+LLM_COUNTERS = {"calls": "Вызовы Gemini", "errors": "Запросы к Gemini, завершившиеся ошибкой после всех повторов",
+                "retries": "Повторные попытки вызова Gemini", "timeouts": "Вызовы Gemini, прерванные по таймауту",
+                "deduplicated": "Запросы, дождавшиеся ответа на такой же выполняющийся запрос",
+                "prompt_tokens": "Токены промптов Gemini", "output_tokens": "Токены ответов Gemini"}
+
+@metrics_registry.collector
+def collect_component_stats():
+    """Счетчики, которые ведут сами компоненты, на момент запроса /metrics."""
+    samples = [("gauge", "dietbot_llm_queue_depth", "Вызовы Gemini, ждущие свободного слота", {}, llm_gateway.queue_depth),
+               ("gauge", "dietbot_llm_active", "Выполняющиеся вызовы Gemini", {}, llm_gateway.active),
+               ("counter", "dietbot_telegram_sent_total", "Отправленные сообщения", {}, outbound_limiter.sent),
+               ("counter", "dietbot_telegram_retry_after_total", "Ответы Telegram RetryAfter", {}, outbound_limiter.retry_after_count),
+               ("gauge", "dietbot_telegram_queue_depth", "Сообщения, ждущие общего лимита отправки", {}, outbound_limiter.queue_depth)]
+    for label, stats in llm_gateway.stats()["labels"].items():
+        samples += [("counter", f"dietbot_llm_{key}_total", doc, {"helper": label}, stats[key]) for key, doc in LLM_COUNTERS.items()]
+    components = {"charts": chart_service.stats(), "nutrition_cache": nutrition_cache.stats(), "food_index": food_index.stats(),
+                  "menu_pool": menu_pool.stats(), "replacements": replacement_prefetcher.stats()}
+    if recipe_index is not None: components["recipe_index"] = recipe_index.stats()
+    if isinstance(user_profiles_data, ProfileRepository): components["profiles"] = {"dirty": user_profiles_data.dirty_count}
+    if bot_persistence is not None: components["persistence"] = {"rows_written": bot_persistence.rows_written}
+    if update_forwarder is not None: components["forwarder"] = update_forwarder.stats()
+    if update_processor is not None: components["updates"] = update_processor.stats()
+    for component, stats in components.items():
+        samples += [("gauge", "dietbot_component_stat", "Статистика кэшей и очередей компонентов", {"component": component, "stat": key}, value)
+                    for key, value in stats.items() if isinstance(value, (int, float))]
+    return samples
+
+def record_loop_lag(lag):
+    event_loop_lag.observe(lag)
+    if lag < LOOP_BLOCK_THRESHOLD: return
+    event_loop_blocked.inc()
+    logger.warning("Event loop был заблокирован", extra=fields(lag=round(lag, 3), handlers=sorted(active_handlers)))
+
+loop_monitor = LoopMonitor(record_loop_lag)
+
+def observed(callback):
+    """Обертка обработчика: request_id для логов, гистограмма длительности и счетчик ошибок."""
+    name = callback.__name__
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        # Вложенный вызов (кнопка главного меню внутри handle_text_messages) сохраняет request_id апдейта
+        with request_context(request_id.get() or f"{WORKER_INDEX}-{update.update_id}"):
+            active_handlers[name] += 1
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                handler_errors.inc(handler=name); raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - started, handler=name)
+                active_handlers[name] -= 1
+                if not active_handlers[name]: del active_handlers[name]
+    return wrapper
+
+def observed_job(callback):
+    """Обертка фоновой задачи: request_id вида job:<имя> и гистограмма длительности."""
+    @functools.wraps(callback)
+    async def wrapper(context):
+        name = context.job.name
+        with request_context(f"job:{name}"), job_seconds.time(job=name):
+            return await callback(context)
+    return wrapper
+
+def timed_io(op, func, *args):
+    with io_seconds.time(op=op): return func(*args)
+
+async def timed_io_async(op, func, *args):
+    """Блокирующий ввод-вывод в отдельном потоке; время меряется вместе с ожиданием потока."""
+    with io_seconds.time(op=op): return await asyncio.to_thread(func, *args)
 
 # Состояния
 (SETUP_STATE_NONE, SETUP_STATE_GENDER, SETUP_STATE_AGE, SETUP_STATE_HEIGHT,
@@ -34,25 +222,11 @@ user_profiles_data = {}
 
 # --- Вспомогательные функции ---
 
-def load_json_data(filepath, default_value=None):
-    if default_value is None: default_value = {}
-    if not os.path.exists(filepath): return default_value
-    try:
-        with open(filepath, "r", encoding="utf-8") as f: return json.load(f)
-    except (json.JSONDecodeError, Exception) as e:
-        print(f"Error reading {filepath}: {e}"); return default_value
-
-def save_weight(chat_id, weight):
-    data = load_json_data(WEIGHT_LOG_FILE)
-    today = datetime.date.today().isoformat()
-    data.setdefault(str(chat_id), {})[today] = weight
-    with open(WEIGHT_LOG_FILE, "w", encoding="utf-8") as f: json.dump(data, f, indent=4)
+async def save_weight(chat_id, weight):
+    await retry_busy(weight_store.save, chat_id, weight)
 
 def get_latest_weight(chat_id):
-    data = load_json_data(WEIGHT_LOG_FILE)
-    user_weights = data.get(str(chat_id), {})
-    if user_weights: return user_weights[sorted(user_weights.keys())[-1]]
-    return None
+    return weight_store.latest(chat_id)
 
 async def calculate_target_calories_and_pfc(user_id):
     user_profile = user_profiles_data.get(str(user_id))
@@ -70,24 +244,15 @@ async def calculate_target_calories_and_pfc(user_id):
     else: protein, fat, carbs = int((target_calories * 0.20) / 4), int((target_calories * 0.30) / 9), int((target_calories * 0.50) / 4)
     return target_calories, protein, fat, carbs
 
-def create_pfc_pie_chart(pfc_data):
-    labels = ['Белки', 'Жиры', 'Углеводы']
-    sizes = [pfc_data.get('protein', 0), pfc_data.get('fat', 0), pfc_data.get('carbs', 0)]
-    if sum(sizes) == 0: sizes = [1, 1, 1]
-    colors = ['#ff9999','#66b3ff','#99ff99']
-    fig, ax = plt.subplots(figsize=(6, 4))
-    ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, colors=colors)
-    ax.axis('equal'); plt.title(f"Баланс БЖУ (в граммах)\nБ: {sizes[0]}г, Ж: {sizes[1]}г, У: {sizes[2]}г")
-    buf = io.BytesIO(); plt.savefig(buf, format='png'); buf.seek(0); plt.close()
-    return buf
+async def create_pfc_pie_chart(pfc_data):
+    return await chart_service.pfc_pie_chart(pfc_data)
 
 ### НАЧАЛО ИСПРАВЛЕННОЙ ФУНКЦИИ ###
 
-async def generate_personalized_menu_with_llm(user_profile, calorie_target, pfc_targets, num_days=1, meal_to_replace=None):
+async def generate_personalized_menu_with_llm(user_profile, calorie_target, pfc_targets, num_days=1, meal_to_replace=None, avoid_meals=None):
     if not GEMINI_API_KEY:
         return None # Возвращаем None при ошибке ключа
 
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     safety_settings = [
         {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
         {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
@@ -104,24 +269,16 @@ async def generate_personalized_menu_with_llm(user_profile, calorie_target, pfc_
         Выступи в роли диетолога. Найди замену для блюда "{original_meal_name}".
         Это должно быть простое, здоровое и похожее по типу блюдо (завтрак на завтрак, ужин на ужин).
 
-        Верни ответ ИСКЛЮЧИТЕЛЬНО в формате JSON. Не добавляй никакого текста до или после JSON.
-        Структура JSON должна быть следующей (только один объект):
-        {{
-          "meal_name": "Новый прием пищи (Новое название)",
-          "items": [{{"food_item": "продукт", "grams": 100}}],
-          "total_calories": 400,
-          "total_protein": 30,
-          "total_fat": 15,
-          "total_carbs": 35,
-          "recipe": "Краткий рецепт приготовления нового блюда."
-        }}
+        Верни ответ ИСКЛЮЧИТЕЛЬНО в формате JSON, один объект, без текста до или после:
+        {MEAL_SCHEMA}
+        t — прием пищи, n — название, i — продукты [название, количество, г/мл/шт], k — [ккал, белки, жиры, углеводы], r — рецепт.
         """
+        if avoid_meals:
+            prompt += f"\n        Не предлагай эти блюда: {', '.join(avoid_meals)}.\n"
         try:
-            response = await model.generate_content_async(prompt, safety_settings=safety_settings)
-            json_text = response.text.strip().replace("```json", "").replace("```", "")
-            return json.loads(json_text)
+            return expand_meal(await llm_gateway.generate_json(prompt, label="menu_replace", safety_settings=safety_settings))
         except Exception as e:
-            print(f"Ошибка при замене блюда через API: {e}")
+            logger.warning("Ошибка при замене блюда через API", extra=fields(error=str(e)))
             return None # Возвращаем None в случае ошибки
 
     else:
@@ -137,72 +294,79 @@ async def generate_personalized_menu_with_llm(user_profile, calorie_target, pfc_
         Суточная цель по калориям: примерно {calorie_target} ккал.
         Цель по БЖУ: Белки ~{pfc_targets['p']}г, Жиры ~{pfc_targets['f']}г, Углеводы ~{pfc_targets['c']}г.
 
-        Пожалуйста, верни ответ ИСКЛЮЧИТЕЛЬНО в формате JSON. Не добавляй никакого текста до или после JSON.
-        Структура JSON должна быть следующей:
-        {{
-          "weekly_plan": [
-            {{
-              "day_name": "День 1",
-              "meals": [
-                {{
-                  "meal_name": "Завтрак (Название блюда)",
-                  "items": [{{"food_item": "название продукта", "grams": 100}}],
-                  "total_calories": 350, "total_protein": 20, "total_fat": 10, "total_carbs": 45,
-                  "recipe": "Краткий рецепт приготовления."
-                }},
-                {{ "meal_name": "Обед (Название блюда)", "items": [], "total_calories": 550, "total_protein": 40, "total_fat": 20, "total_carbs": 50, "recipe": "..."}},
-                {{ "meal_name": "Ужин (Название блюда)", "items": [], "total_calories": 400, "total_protein": 30, "total_fat": 15, "total_carbs": 35, "recipe": "..."}}
-              ]
-            }}
-          ],
-          "shopping_list": ["Продукт 1: X г", "Продукт 2: Y г"]
-        }}
-        Создай разнообразные и простые блюда. Список покупок должен включать все ингредиенты на {num_days} дней.
+        Верни ответ ИСКЛЮЧИТЕЛЬНО в формате компактного JSON, без текста до или после:
+        {MENU_SCHEMA}
+        d — дни ({num_days}), m — приемы пищи дня (завтрак, обед, ужин). В блюде: t — прием пищи, n — название,
+        i — продукты [название, количество, г/мл/шт], k — [ккал, белки, жиры, углеводы], r — краткий рецепт.
+        Создай разнообразные и простые блюда. Список покупок и итоги по дням не нужны.
         """
-        response = None
+        if avoid_meals:
+            prompt += f"\n        Не повторяй эти блюда: {', '.join(avoid_meals)}.\n"
         try:
-            response = await model.generate_content_async(prompt, safety_settings=safety_settings)
-            json_text = response.text.strip().replace("```json", "").replace("```", "")
-            return json.loads(json_text)
+            # Одинаковые промпты для разных дней должны давать разные меню, поэтому без single-flight
+            # Список покупок не запрашиваем: он собирается из продуктов блюд
+            return expand_menu(await llm_gateway.generate_json(prompt, label="menu", single_flight=False, safety_settings=safety_settings))
         except Exception as e:
-            if response:
-                print(f"Не удалось распарсить JSON. Ответ от Gemini: {response.text}")
-            print(f"Ошибка при вызове API Gemini: {e}")
+            logger.warning("Ошибка при генерации меню через API", extra=fields(days=num_days, error=str(e)))
             return {"weekly_plan": [], "shopping_list": [f"ОШИБКА: Не удалось сгенерировать меню."]}
 
 ### КОНЕЦ ИСПРАВЛЕННОЙ ФУНКЦИИ ###
 
+async def generate_replacement_meal(user_id, meal, avoid_names):
+    user_profile = user_profiles_data.get(str(user_id), {})
+    return await generate_personalized_menu_with_llm(user_profile, None, None, meal_to_replace=meal, avoid_meals=avoid_names)
+
+replacement_prefetcher = ReplacementPrefetcher(generate_replacement_meal, per_meal=REPLACEMENT_PREFETCH_PER_MEAL, ttl=REPLACEMENT_PREFETCH_TTL)
+
 async def calculate_calories_from_food_list_llm(user_id, food_list_items):
+    # Сначала локальный справочник, затем кэш; в Gemini отправляем только неизвестные продукты
+    known, unknown = [], []
+    for item in food_list_items:
+        local = food_index.resolve(item)
+        if local: known.append(local); continue
+        cached = nutrition_cache.get(item)
+        if cached: known.append(cached)
+        elif item not in unknown: unknown.append(item)
+    if not unknown:
+        nutrition_cache.llm_calls_saved += 1
+        return sum_nutrients(known)
     if not GEMINI_API_KEY: return None
     
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    food_list_str = ", ".join(food_list_items)
+    food_list_str = "\n".join(f"{i}. {item}" for i, item in enumerate(unknown, 1))
     
     prompt = f"""
-    Подсчитай КБЖУ для следующего списка съеденных продуктов: {food_list_str}.
-    Верни ответ ТОЛЬКО в формате JSON, без лишнего текста. Пример:
-    {{
-      "calories": 500,
-      "protein": 30,
-      "fat": 20,
-      "carbs": 50
-    }}
+    Подсчитай КБЖУ отдельно для каждого из следующих съеденных продуктов:
+    {food_list_str}
+    Верни ответ ТОЛЬКО в формате JSON, без лишнего текста: массив в том же порядке, по одному объекту на продукт. Пример:
+    [
+      {{"calories": 500, "protein": 30, "fat": 20, "carbs": 50}}
+    ]
     """
     
     try:
-        response = await model.generate_content_async(prompt)
-        json_text = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(json_text)
+        nutrition_cache.llm_calls += 1
+        per_item = await llm_gateway.generate_json(prompt, label="food_calories")
+        if not isinstance(per_item, list) or len(per_item) != len(unknown):
+            raise ValueError(f"ожидалось {len(unknown)} объектов, получено: {str(per_item)[:200]}")
+        # Сначала проверяем весь ответ: кэшируем продукты, только если корректны все
+        fresh = {item: parse_nutrients(nutrients) for item, nutrients in zip(unknown, per_item)}
+        for item, nutrients in fresh.items(): nutrition_cache.put(item, nutrients)
+        return sum_nutrients(known + [fresh[item] for item in food_list_items if item in fresh])
     except Exception as e:
-        print(f"Ошибка при подсчете КБЖУ через API: {e}")
+        logger.warning("Ошибка при подсчете КБЖУ через API", extra=fields(user_id=user_id, items=len(unknown), error=str(e)))
         return None
 
-async def generate_recipe_from_ingredients(user_id, ingredients_text):
+async def generate_recipe_from_ingredients(user_id, ingredients_text, seen_recipes=()):
+    """Рецепт из продуктов пользователя: сначала из сохраненных рецептов, Gemini — только если подходящего нет.
+    Возвращает (id рецепта или None, рецепт, недостающие продукты)."""
+    exclusions = user_profiles_data.get(str(user_id), {}).get('exclusions', [])
+    found = recipe_index.find(ingredients_text, exclusions, skip=seen_recipes)
+    if found: return found
     if not GEMINI_API_KEY: return None
 
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
     prompt = f"""
     Придумай простой и здоровый рецепт из следующих ингредиентов: {ingredients_text}.
+    {f"Не используй эти продукты: {', '.join(exclusions)}." if exclusions else ""}
     Верни ответ ТОЛЬКО в формате JSON со следующей структурой:
     {{
       "dish_name": "Название блюда",
@@ -212,29 +376,27 @@ async def generate_recipe_from_ingredients(user_id, ingredients_text):
     }}
     """
     try:
-        response = await model.generate_content_async(prompt)
-        json_text = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(json_text)
+        recipe = await llm_gateway.generate_json(prompt, label="fridge_recipe")
     except Exception as e:
-        print(f"Ошибка при генерации рецепта через API: {e}")
+        logger.warning("Ошибка при генерации рецепта через API", extra=fields(user_id=user_id, error=str(e)))
         return None
+    if not isinstance(recipe, dict) or not recipe.get('dish_name'): return None
+    try:
+        recipe_id = await retry_busy(recipe_index.add, recipe)
+    except sqlite3.OperationalError as e:
+        # Рецепт уже есть — покажем его, даже если сохранить для других не удалось
+        logger.warning("Не удалось сохранить рецепт", extra=fields(user_id=user_id, error=str(e))); recipe_id = None
+    return recipe_id, recipe, []
 
 ### НОВЫЙ КОД: Функция для автоматической установки напоминаний ###
 async def schedule_reminders_for_user(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Проверяет и устанавливает напоминания для пользователя, если их еще нет."""
-    # Уникальные имена задач для каждого пользователя
-    water_job_name = f"drink_water_{chat_id}"
-    weigh_job_name = f"weigh_in_{chat_id}"
-    
-    # Проверяем, существует ли уже задача на напоминание о воде
-    if not context.job_queue.get_jobs_by_name(water_job_name):
-        context.job_queue.run_repeating(send_water_reminder, interval=7200, chat_id=chat_id, name=water_job_name)
-        print(f"Установлено напоминание о воде для {chat_id}")
-
-    # Проверяем, существует ли уже задача на напоминание о взвешивании
-    if not context.job_queue.get_jobs_by_name(weigh_job_name):
-        context.job_queue.run_daily(check_and_send_weigh_in_reminder, time=datetime.time(hour=20, minute=0), chat_id=chat_id, name=weigh_job_name)
-        print(f"Установлено напоминание о взвешивании для {chat_id}")
+    """Подписывает пользователя на напоминания о воде и взвешивании, если он еще не подписан."""
+    try:
+        if await retry_busy(reminder_scheduler.subscribe, chat_id):
+            logger.info("Установлены напоминания о воде и взвешивании", extra=fields(chat_id=chat_id))
+    except sqlite3.OperationalError as e:
+        # Не мешаем настройке профиля: подписка повторится при следующем вызове
+        logger.warning("Не удалось подписать на напоминания", extra=fields(chat_id=chat_id, error=str(e)))
 
 # --- Основные команды ---
 
@@ -259,7 +421,18 @@ async def calculate_and_send_calories(update: Update, context: ContextTypes.DEFA
     targets = await calculate_target_calories_and_pfc(user_id)
     if not targets[0]: await update.message.reply_text("❗ Не удалось рассчитать цели. Убедитесь, что ваш вес записан."); return
     latest_weight = get_latest_weight(user_id)
-    await update.message.reply_text(f"📊 *Ваш текущий профиль:*\nПол: {user_profile.get('gender').capitalize()}, Возраст: {user_profile.get('age')}, Рост: {user_profile.get('height')} см\nАктивность: {user_profile.get('activity')}, Цель: {user_profile.get('diet_goal', 'баланс')}\nПоследний вес: *{latest_weight}* кг.\n\n✅ *Ваша суточная цель для похудения:*\nКалории: *{targets[0]}* ккал, Белки: *{targets[1]}* г, Жиры: *{targets[2]}* г, Углеводы: *{targets[3]}* г", parse_mode='Markdown')
+    await update.message.reply_text(f"📊 *Ваш текущий профиль:*\nПол: {user_profile.get('gender').capitalize()}, Возраст: {user_profile.get('age')}, Рост: {user_profile.get('height')} см\nАктивность: {user_profile.get('activity')}, Цель: {user_profile.get('diet_goal', 'баланс')}\nПоследний вес: *{latest_weight}* кг.\n\n✅ *Ваша суточная цель для похудения:*\nКалории: *{targets[0]}* ккал, Белки: *{targets[1]}* г, Жиры: *{targets[2]}* г, Углеводы: *{targets[3]}* г\n\n{format_diary_summary(user_id, targets[0])}", parse_mode='Markdown')
+
+def format_diary_summary(user_id, target_calories):
+    """Съедено сегодня, остаток до цели и среднее за неделю — из готовых итогов дневника."""
+    kcal, p, f, c = food_diary.today(user_id)
+    text = f"📅 *Сегодня съедено:* {round(kcal)} ккал, Б {round(p)} г, Ж {round(f)} г, У {round(c)} г"
+    if target_calories: text += f"\nОсталось на сегодня: *{target_calories - round(kcal)}* ккал"
+    week, days_logged = food_diary.rolling(user_id)
+    if days_logged:
+        text += f"\n📈 За 7 дней в среднем {round(week[0] / days_logged)} ккал в день ({days_logged} дн. с записями)"
+        if target_calories: text += f", {round(week[0] / days_logged / target_calories * 100)}% от цели"
+    return text
 
 async def calories_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await calculate_and_send_calories(update, context)
@@ -270,16 +443,45 @@ async def log_food_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = ReplyKeyboardMarkup([["Готово"]], resize_keyboard=True)
     await update.message.reply_text("🍽️ Вводите продукты по одному. Когда закончите, нажмите 'Готово'.", reply_markup=reply_markup)
 
+def format_day_iso(day):
+    return f"{day[8:10]}.{day[5:7]}.{day[:4]}"
+
+def format_progress_summary(chat_id):
+    """Сводка по тренду веса: читается из WeightTrend, не зависит от длины истории."""
+    trend = weight_store.trend(chat_id)
+    lines = [f"📈 *Прогресс веса* — записей: {trend.count}, последний вес: *{get_latest_weight(chat_id)}* кг",
+             f"Тренд (сглаженный вес): *{trend.ema:.1f}* кг, с начала: {trend.ema - trend.first_weight:+.1f} кг"]
+    slope = trend.slope()
+    if slope is not None: lines.append(f"Темп за последние 4 недели: {slope * 7:+.2f} кг в неделю")
+    deltas = trend.weekly_deltas()[-PROGRESS_WEEKS_SHOWN:]
+    if deltas: lines.append("По неделям: " + ", ".join(f"с {monday.strftime('%d.%m')} {delta:+.1f}" for monday, delta in deltas))
+    goal_weight = (user_profiles_data.get(chat_id) or {}).get('goal_weight')
+    if not goal_weight: lines.append("🎯 Задайте целевой вес командой /goal, например /goal 75, — здесь появится прогноз.")
+    elif slope is not None:
+        projected = trend.projected_date(goal_weight)
+        lines.append(f"🎯 Цель {goal_weight:g} кг: " + (f"при текущем темпе — примерно к {projected.strftime('%d.%m.%Y')}" if projected else "при текущем темпе не прогнозируется"))
+    return "\n".join(lines)
+
+def format_progress_page(chat_id, older_than=None, newer_than=None):
+    """Сводка и страница истории веса с кнопками листания."""
+    rows, has_older, has_newer = weight_store.page(chat_id, PROGRESS_PAGE_SIZE, older_than, newer_than)
+    lines = [format_progress_summary(chat_id), "", "*История:*"]
+    lines.extend(f"▫️ {format_day_iso(day)}: {weight} кг" for day, weight in rows)
+    buttons = []
+    if has_newer and rows: buttons.append(InlineKeyboardButton("◀️ Новее", callback_data=f"wprog:n:{rows[0][0]}"))
+    if has_older and rows: buttons.append(InlineKeyboardButton("Старее ▶️", callback_data=f"wprog:o:{rows[-1][0]}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
 async def progress_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = str(update.effective_chat.id); data = load_json_data(WEIGHT_LOG_FILE)
-    if chat_id not in data or not data[chat_id]: await update.message.reply_text("⚠️ Прогресс пока пуст. Запиши свой вес."); return
-    log = data[chat_id]; sorted_log = sorted(log.items(), key=lambda x: x[0])
-    text = "📈 Прогресс веса по дням:\n"; dates = [datetime.datetime.strptime(d, "%Y-%m-%d").date() for d, w in sorted_log]; weights = [w for d, w in sorted_log]
-    for date_obj, weight in zip(dates, weights): text += f"▫️ {date_obj.strftime('%d.%m.%Y')}: {weight} кг\n"
-    await update.message.reply_text(text)
-    if len(dates) < 2: return
-    plt.figure(figsize=(10, 6)); plt.plot(dates, weights, marker='o', linestyle='-'); plt.title("График веса", fontsize=16); plt.xlabel("Дата"); plt.ylabel("Вес (кг)"); plt.grid(True); plt.gcf().autofmt_xdate();
-    buf = io.BytesIO(); plt.savefig(buf, format='png', bbox_inches='tight'); buf.seek(0); plt.close()
+    chat_id = str(update.effective_chat.id)
+    if not get_latest_weight(chat_id): await update.message.reply_text("⚠️ Прогресс пока пуст. Запиши свой вес."); return
+    text, reply_markup = format_progress_page(chat_id)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+    if weight_store.trend(chat_id).count < 2: return
+    since = (datetime.date.today() - datetime.timedelta(days=PROGRESS_CHART_DAYS)).isoformat()
+    series = weight_store.series(chat_id, since)
+    if len(series) < 2: return
+    buf = await chart_service.weight_chart(series)
     await update.message.reply_photo(buf)
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -319,27 +521,126 @@ async def generate_and_send_menu(update_or_query: Update | CallbackQuery, contex
     # Здесь происходит вызов ВАШЕЙ функции
     user_profile = user_profiles_data.get(str(user_id), {})
     pfc_targets = {'p': targets[1], 'f': targets[2], 'c': targets[3]}
-    menu_data = await generate_personalized_menu_with_llm(user_profile, targets[0], pfc_targets, num_days=num_days)
+    pool_key = menu_pool_key(user_profile.get('diet_goal'), targets[0], pfc_targets, user_profile.get('exclusions', []))
+    seen_pool_menus = context.user_data.setdefault('seen_pool_menus', [])
+    menu_data = {"days": []}
+    context.user_data['last_weekly_menu'] = menu_data
+    replacement_prefetcher.clear_user(user_id)
+    used_dishes = set()
+
+    async def deliver(day_data, menu_id):
+        day_menu = day_data['weekly_plan'][0]
+        # Пользователь хранит только ссылки на блюда, сами блюда лежат в meal_store
+        day = {"day_name": f"День {len(menu_data['days']) + 1}" if num_days > 1 else day_menu.get('day_name'), "meal_ids": await retry_busy(meal_store.put_many, day_menu['meals'])}
+        menu_data['days'].append(day)
+        used_dishes.update(meal_dish_names(day_menu))
+        seen_pool_menus.append(menu_id); del seen_pool_menus[:-MENU_POOL_SEEN_LIMIT]
+        await send_day_menu(context, chat_id, len(menu_data['days']) - 1, day)
+
+    # Готовые дни из пула отправляем сразу
+    while len(menu_data['days']) < num_days:
+        pooled = menu_pool.take(pool_key, seen_pool_menus)
+        if not pooled: break
+        await deliver(pooled[1], pooled[0])
 
-    if not menu_data or not menu_data.get('weekly_plan'):
+    async def regenerate_day(day_data):
+        return await generate_menu_day(user_profile, targets[0], pfc_targets, avoid_meals=sorted(used_dishes)) or day_data
+
+    # Остальные дни генерируем параллельно отдельными запросами и отправляем по мере готовности
+    missing_days = num_days - len(menu_data['days'])
+    pending = {asyncio.create_task(generate_menu_day(user_profile, targets[0], pfc_targets)): False for _ in range(missing_days)}  # задача -> это перегенерация
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            regenerated = pending.pop(task)
+            day_data = task.result()
+            if not day_data: continue
+            if not regenerated and meal_dish_names(day_data['weekly_plan'][0]) & used_dishes:
+                # Блюда повторяют уже отправленный день — перегенерируем этот день отдельной задачей, готовые дни его не ждут
+                pending[asyncio.create_task(regenerate_day(day_data))] = True; continue
+            await deliver(day_data, menu_pool.add(pool_key, day_data))
+
+    if not menu_data['days']:
         await context.bot.send_message(chat_id=chat_id, text="❗ Не удалось сгенерировать меню.")
         return
+    if len(menu_data['days']) < num_days:
+        await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Удалось составить меню только на {len(menu_data['days'])} из {num_days} дней.")
 
-    context.user_data['last_weekly_menu'] = menu_data
-    for day_index, day_menu in enumerate(menu_data['weekly_plan']):
-        total_cals = sum(m.get('total_calories', 0) for m in day_menu['meals'])
-        total_p = sum(m.get('total_protein', 0) for m in day_menu['meals'])
-        total_f = sum(m.get('total_fat', 0) for m in day_menu['meals'])
-        total_c = sum(m.get('total_carbs', 0) for m in day_menu['meals'])
-        await context.bot.send_message(chat_id=chat_id, text=f"🍽️ *{day_menu.get('day_name', 'Ваше меню')}*\nИтог: *К ~{total_cals} | Б {total_p}г | Ж {total_f}г | У {total_c}г*", parse_mode='Markdown')
-        for meal_index, meal in enumerate(day_menu['meals']):
-            response_text = f"*{meal.get('meal_name', 'Прием пищи')}*\nКБЖУ: *{meal.get('total_calories', 0)} | {meal.get('total_protein', 0)} | {meal.get('total_fat', 0)} | {meal.get('total_carbs', 0)}*"
-            keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Заменить", callback_data=f"replace:{day_index}:{meal_index}"), InlineKeyboardButton("📖 Рецепт", callback_data=f"recipe:{day_index}:{meal_index}")]])
-            await context.bot.send_message(chat_id=chat_id, text=response_text, reply_markup=keyboard, parse_mode='Markdown')
-
-    if menu_data.get('shopping_list'):
+    menu_meals = [pair for day in menu_data['days'] for pair in day_meals(meal_store, day)]
+    if any(meal.get('items') for _, meal in menu_meals):
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🛒 Показать список покупок", callback_data="show_shopping_list")]])
         await context.bot.send_message(chat_id=chat_id, text="Меню сгенерировано. Показать итоговый список покупок?", reply_markup=keyboard)
+    # Пока пользователь читает меню, в фоне готовим замены, чтобы «Заменить» срабатывало сразу
+    replacement_prefetcher.schedule(user_id, menu_meals, [meal.get('meal_name', '') for _, meal in menu_meals])
+
+async def generate_menu_day(user_profile, calorie_target, pfc_targets, avoid_meals=None):
+    """Генерирует меню на один день; неудачный ответ перезапрашивается отдельно от остальных дней."""
+    for _ in range(MENU_DAY_ATTEMPTS):
+        day_data = await generate_personalized_menu_with_llm(user_profile, calorie_target, pfc_targets, num_days=1, avoid_meals=avoid_meals)
+        if day_data and day_data.get('weekly_plan') and day_data['weekly_plan'][0].get('meals'): return day_data
+    return None
+
+def meal_dish_names(day_menu):
+    return {m.get('meal_name', '').strip().lower() for m in day_menu.get('meals', [])}
+
+async def get_user_menu(user_data):
+    """Последнее меню пользователя со ссылками на блюда. Меню старого формата с полными блюдами переводится на ссылки."""
+    menu_data = user_data.get('last_weekly_menu')
+    if menu_data and 'weekly_plan' in menu_data:
+        menu_data = user_data['last_weekly_menu'] = await retry_busy(compact_menu, meal_store, menu_data)
+    return menu_data
+
+def format_day_header(day_name, meals):
+    total_cals = sum(m.get('total_calories', 0) for m in meals)
+    total_p = sum(m.get('total_protein', 0) for m in meals)
+    total_f = sum(m.get('total_fat', 0) for m in meals)
+    total_c = sum(m.get('total_carbs', 0) for m in meals)
+    return f"🍽️ *{day_name or 'Ваше меню'}*\nИтог: *К ~{total_cals} | Б {total_p}г | Ж {total_f}г | У {total_c}г*"
+
+def format_meal(meal):
+    return f"*{meal.get('meal_name', 'Прием пищи')}*\nКБЖУ: *{meal.get('total_calories', 0)} | {meal.get('total_protein', 0)} | {meal.get('total_fat', 0)} | {meal.get('total_carbs', 0)}*"
+
+def menu_dish_names(menu_data):
+    return [meal.get('meal_name', '') for day in menu_data['days'] for _, meal in day_meals(meal_store, day)]
+
+def meal_keyboard_row(day_index, key, replace_label="🔄 Заменить", recipe_label="📖 Рецепт"):
+    # В кнопках id блюда, а не его позиция: рецепт находится без меню, замена — по id внутри дня
+    return [InlineKeyboardButton(replace_label, callback_data=f"replace:{day_index}:{key}"), InlineKeyboardButton(recipe_label, callback_data=f"recipe:{key}")]
+
+def format_merged_day(day_index, day):
+    """Текст и клавиатура дня одним сообщением: по строке кнопок на каждый прием пищи."""
+    meals = day_meals(meal_store, day)
+    text = "\n\n".join([format_day_header(day.get('day_name'), [meal for _, meal in meals])] + [format_meal(meal) for _, meal in meals])
+    rows = []
+    for key, meal in meals:
+        meal_type = meal.get('meal_name', 'Блюдо').split('(')[0].strip()
+        rows.append(meal_keyboard_row(day_index, key, f"🔄 {meal_type}", f"📖 {meal_type}"))
+    return text, InlineKeyboardMarkup(rows)
+
+async def send_day_menu(context: ContextTypes.DEFAULT_TYPE, chat_id, day_index, day):
+    if MERGE_MENU_DAY_MESSAGES:
+        text, keyboard = format_merged_day(day_index, day)
+        await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard, parse_mode='Markdown')
+        return
+    meals = day_meals(meal_store, day)
+    await context.bot.send_message(chat_id=chat_id, text=format_day_header(day.get('day_name'), [meal for _, meal in meals]), parse_mode='Markdown')
+    for key, meal in meals:
+        keyboard = InlineKeyboardMarkup([meal_keyboard_row(day_index, key)])
+        await context.bot.send_message(chat_id=chat_id, text=format_meal(meal), reply_markup=keyboard, parse_mode='Markdown')
+
+def parse_menu_callback(data, menu_data):
+    """Разбирает recipe:<id>, replace:<день>:<id> и кнопки старого формата <действие>:<день>:<номер блюда>. Возвращает (действие, день, id) или None."""
+    parts = data.split(':')
+    try:
+        if parts[0] == 'recipe' and len(parts) == 2: return 'recipe', None, parts[1]
+        action, day_index, key = parts[0], int(parts[1]), parts[2]
+        if len(key) < 16:
+            # Кнопки, отправленные до перехода на id блюд
+            if not menu_data or day_index >= len(menu_data['days']): return None
+            key = menu_data['days'][day_index]['meal_ids'][int(key)]
+        return action, day_index, key
+    except (ValueError, IndexError):
+        return None
 
 async def prefs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id); profile = user_profiles_data.get(user_id, {})
@@ -348,11 +649,32 @@ async def prefs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("👍 Добавить любимый", callback_data="prefs:add_pref"), InlineKeyboardButton("👎 Добавить нелюбимый", callback_data="prefs:add_excl")], [InlineKeyboardButton("🗑️ Очистить списки", callback_data="prefs:clear_all")]])
     await update.message.reply_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
+async def goal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/goal 75 — целевой вес для прогноза в «Прогресс веса», /goal 0 — убрать цель."""
+    chat_id = str(update.effective_chat.id); profile = user_profiles_data.get(chat_id)
+    if not profile: await update.message.reply_text("❗ Сначала настройте профиль (/start)."); return
+    try: goal_weight = float(context.args[0].replace(',', '.'))
+    except (ValueError, IndexError): await update.message.reply_text("❗ Укажите целевой вес в кг. Пример: /goal 75"); return
+    if goal_weight == 0:
+        profile.pop('goal_weight', None); user_profiles_data.mark_dirty(chat_id)
+        await update.message.reply_text("Цель по весу убрана."); return
+    if not 20 <= goal_weight <= 300: await update.message.reply_text("❗ Пожалуйста, введите реальный вес (от 20 до 300 кг)."); return
+    profile['goal_weight'] = goal_weight; user_profiles_data.mark_dirty(chat_id)
+    await update.message.reply_text(f"🎯 Цель сохранена: {goal_weight:g} кг. Прогноз — в «Прогресс веса».")
+
 async def fridge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['setup_step'] = SETUP_STATE_AWAITING_FRIDGE_INGREDIENTS
     await update.message.reply_text("🧊 Перечислите через запятую продукты, которые у вас есть, и я попробую придумать из них блюдо.")
 
 
+def format_fridge_recipe(recipe, missing):
+    text = f"🍳 *{recipe.get('dish_name', 'Блюдо')}*\n{recipe.get('description', '')}\n\n*Ингредиенты:* {', '.join(recipe.get('ingredients_used', []))}"
+    if missing: text += f"\n⚠️ Не хватает: {', '.join(missing)}"
+    steps = recipe.get('recipe_steps', [])
+    if steps: text += "\n\n" + "\n".join(f"{i}. {step}" for i, step in enumerate(steps, 1))
+    return text
+
+
 # --- Обработчики ---
 async def inline_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query; await query.answer()
@@ -360,10 +682,15 @@ async def inline_button_handler(update: Update, context: ContextTypes.DEFAULT_TY
     if data.startswith("gen_menu:"):
         num_days = int(data.split(':')[1]); await query.edit_message_text(f"Принято! Генерирую меню на {num_days} дней...")
         await generate_and_send_menu(query, context, num_days); return
+    if data.startswith("wprog:"):
+        _, direction, day = data.split(':', 2); chat_id = str(query.message.chat_id)
+        text, reply_markup = format_progress_page(chat_id, older_than=day if direction == 'o' else None, newer_than=day if direction == 'n' else None)
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown'); return
     if data == "show_shopping_list":
-        menu_data = context.user_data.get('last_weekly_menu')
-        if not menu_data or not menu_data.get('shopping_list'): await query.edit_message_text("Не удалось найти список покупок."); return
-        shopping_list = menu_data.get('shopping_list', [])
+        menu_data = await get_user_menu(context.user_data) or {"days": []}
+        # Список собирается из текущих блюд меню, поэтому учитывает и замененные блюда
+        shopping_list = build_shopping_list(meal for day in menu_data['days'] for _, meal in day_meals(meal_store, day)) or menu_data.get('shopping_list', [])
+        if not shopping_list: await query.edit_message_text("Не удалось найти список покупок."); return
         shopping_list_text = "🛒 *Ваш итоговый список покупок:*\n\n" + "\n".join(f"• {item}" for item in shopping_list)
         await query.edit_message_text(text=shopping_list_text, parse_mode='Markdown'); return
     if data.startswith("prefs:"):
@@ -374,30 +701,50 @@ async def inline_button_handler(update: Update, context: ContextTypes.DEFAULT_TY
             context.user_data['setup_step'] = SETUP_STATE_ADDING_EXCLUSION; await query.message.reply_text("Какой продукт добавить в нелюбимые?")
         elif action == "clear_all":
             user_profiles_data[user_id]['preferences'] = []; user_profiles_data[user_id]['exclusions'] = []
-            with open(USER_PROFILES_FILE, "w", encoding="utf-8") as f: json.dump(user_profiles_data, f, indent=4)
+            user_profiles_data.mark_dirty(user_id)
             await query.message.reply_text("✅ Ваши списки предпочтений очищены.")
         await query.edit_message_text(text=query.message.text); return
     if data.startswith("recipe:") or data.startswith("replace:"):
-        try: action, day_index_str, meal_index_str = data.split(':'); day_index, meal_index = int(day_index_str), int(meal_index_str)
-        except ValueError: await query.edit_message_text("Ошибка: неверные данные кнопки."); return
-        menu_data = context.user_data.get('last_weekly_menu')
-        if not menu_data or day_index >= len(menu_data['weekly_plan']) or meal_index >= len(menu_data['weekly_plan'][day_index]['meals']):
-            await query.edit_message_text("Меню устарело, сгенерируйте новое."); return
-        meal = menu_data['weekly_plan'][day_index]['meals'][meal_index]
+        menu_data = await get_user_menu(context.user_data)
+        parsed = parse_menu_callback(data, menu_data)
+        if not parsed: await query.edit_message_text("Меню устарело, сгенерируйте новое."); return
+        action, day_index, key = parsed
+        meal = meal_store.get(key)
         if action == 'recipe':
+            if not meal: await context.bot.send_message(chat_id=query.message.chat_id, text="Рецепт не найден."); return
             recipe_text = meal.get('recipe', 'Рецепт не найден.')
             await context.bot.send_message(chat_id=query.message.chat_id, text=f"📖 *Рецепт для \"{meal.get('meal_name')}\"*: \n\n{recipe_text}", parse_mode='Markdown')
-        elif action == 'replace':
-            await query.edit_message_text(f"🔄 Ищу замену для *{meal['meal_name']}*...", parse_mode='Markdown')
-            user_profile = user_profiles_data.get(str(query.from_user.id), {})
-            replacement_meal = await generate_personalized_menu_with_llm(user_profile, None, None, meal_to_replace=meal)
+            return
+        if not meal or not menu_data or day_index >= len(menu_data['days']) or key not in menu_data['days'][day_index]['meal_ids']:
+            await query.edit_message_text("Меню устарело, сгенерируйте новое."); return
+        day = menu_data['days'][day_index]
+        user_id = query.from_user.id
+        # Заготовленная замена отдается сразу, без промежуточного «Ищу замену...»
+        prefetched = replacement_prefetcher.ready(user_id, key) > 0
+        if MERGE_MENU_DAY_MESSAGES:
+            # Сообщение содержит весь день: показываем статус строкой внизу и перерисовываем день целиком
+            day_text, day_keyboard = format_merged_day(day_index, day)
+            if not prefetched: await query.edit_message_text(f"{day_text}\n\n🔄 Ищу замену для *{meal['meal_name']}*...", reply_markup=day_keyboard, parse_mode='Markdown')
+            replacement_meal = await replacement_prefetcher.take(user_id, key, meal, menu_dish_names(menu_data))
+            if not replacement_meal: await query.edit_message_text(f"{day_text}\n\nНе удалось найти замену для *{meal['meal_name']}*.", reply_markup=day_keyboard, parse_mode='Markdown'); return
+            # Пока шла генерация, блюдо могли заменить другой кнопкой — ищем его позицию заново
+            if key not in day['meal_ids']: return
+            new_key = await retry_busy(meal_store.put, replacement_meal)
+            day['meal_ids'][day['meal_ids'].index(key)] = new_key
+            day_text, day_keyboard = format_merged_day(day_index, day)
+            await query.edit_message_text(text=day_text, reply_markup=day_keyboard, parse_mode='Markdown')
+        else:
+            if not prefetched: await query.edit_message_text(f"🔄 Ищу замену для *{meal['meal_name']}*...", parse_mode='Markdown')
+            replacement_meal = await replacement_prefetcher.take(user_id, key, meal, menu_dish_names(menu_data))
             if not replacement_meal: await query.edit_message_text(f"Не удалось найти замену для *{meal['meal_name']}*.", parse_mode='Markdown'); return
-            context.user_data['last_weekly_menu']['weekly_plan'][day_index]['meals'][meal_index] = replacement_meal
+            if key not in day['meal_ids']: return
+            new_key = await retry_busy(meal_store.put, replacement_meal)
+            day['meal_ids'][day['meal_ids'].index(key)] = new_key
             original_meal_type = meal.get('meal_name').split('(')[0].strip()
             new_meal_name_only = replacement_meal.get('meal_name', 'Блюдо').replace(original_meal_type, "").strip()
             new_text = f"{original_meal_type}: *{new_meal_name_only}*\nКБЖУ: *{replacement_meal.get('total_calories',0)} | {replacement_meal.get('total_protein',0)} | {replacement_meal.get('total_fat',0)} | {replacement_meal.get('total_carbs',0)}*"
-            new_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Заменить", callback_data=f"replace:{day_index}:{meal_index}"), InlineKeyboardButton("📖 Рецепт", callback_data=f"recipe:{day_index}:{meal_index}")]])
-            await query.edit_message_text(text=new_text, reply_markup=new_keyboard, parse_mode='Markdown')
+            await query.edit_message_text(text=new_text, reply_markup=InlineKeyboardMarkup([meal_keyboard_row(day_index, new_key)]), parse_mode='Markdown')
+        replacement_prefetcher.schedule(user_id, [(new_key, replacement_meal)], menu_dish_names(menu_data))
 
 async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
@@ -413,7 +760,7 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
     current_setup_step = context.user_data.get('setup_step')
 
     if text.lower().startswith("вес"):
-        try: weight_value = float(text[3:].strip().replace(',', '.')); save_weight(chat_id_str, weight_value); await update.message.reply_text(f"✅ Вес сохранён: {weight_value} кг")
+        try: weight_value = float(text[3:].strip().replace(',', '.')); await save_weight(chat_id_str, weight_value); await update.message.reply_text(f"✅ Вес сохранён: {weight_value} кг")
         except (ValueError, IndexError): await update.message.reply_text("❗ Неверный формат. Пример: Вес 80.5")
         return
 
@@ -436,7 +783,7 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
         elif current_setup_step == SETUP_STATE_WEIGHT_INITIAL:
             try:
                 weight = float(text.replace(',', '.'));
-                if 20 <= weight <= 300: save_weight(chat_id_str, weight); context.user_data['setup_step'] = SETUP_STATE_ACTIVITY; await update.message.reply_text("Какой у вас уровень физической активности? (число от 1 до 5)")
+                if 20 <= weight <= 300: await save_weight(chat_id_str, weight); context.user_data['setup_step'] = SETUP_STATE_ACTIVITY; await update.message.reply_text("Какой у вас уровень физической активности? (число от 1 до 5)")
                 else: await update.message.reply_text("❗ Пожалуйста, введите реальный вес (от 20 до 300 кг).")
             except ValueError: await update.message.reply_text("❗ Пожалуйста, введите вес числом (можно с точкой).")
         elif current_setup_step == SETUP_STATE_ACTIVITY:
@@ -454,7 +801,6 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
             diet_goal = goal_map.get(text.lower())
             if diet_goal:
                 user_profiles_data[chat_id_str] = {'gender': context.user_data.get('profile_gender'), 'age': context.user_data.get('profile_age'), 'height': context.user_data.get('profile_height'), 'activity': context.user_data.get('profile_activity'), 'diet_goal': diet_goal, 'preferences': [], 'exclusions': []}
-                with open(USER_PROFILES_FILE, "w", encoding="utf-8") as f: json.dump(user_profiles_data, f, indent=4)
                 for key in list(context.user_data.keys()):
                     if key.startswith('profile_') or key == 'setup_step': context.user_data.pop(key, None)
                 
@@ -464,32 +810,164 @@ async def handle_text_messages(update: Update, context: ContextTypes.DEFAULT_TYP
                 await calculate_and_send_calories(update, context)
                 await update.message.reply_text("Теперь вы можете использовать основные функции. Напоминания о воде и взвешивании включены автоматически.", reply_markup=MAIN_REPLY_MARKUP)
             else: await update.message.reply_text("❗ Пожалуйста, выберите один из вариантов с помощью кнопок.")
+        elif current_setup_step == SETUP_STATE_AWAITING_FRIDGE_INGREDIENTS:
+            context.user_data.pop('setup_step', None)
+            seen_recipes = context.user_data.setdefault('seen_fridge_recipes', [])
+            result = await generate_recipe_from_ingredients(user_id, text, seen_recipes)
+            if not result: await update.message.reply_text("❗ Не удалось придумать блюдо из этих продуктов. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP); return
+            recipe_id, recipe, missing = result
+            if recipe_id: seen_recipes.append(recipe_id); del seen_recipes[:-FRIDGE_SEEN_LIMIT]
+            await update.message.reply_text(format_fridge_recipe(recipe, missing), parse_mode='Markdown', reply_markup=MAIN_REPLY_MARKUP)
+        return
+
+    if current_setup_step == SETUP_STATE_LOGGING_FOOD_AWAITING_INPUT:
+        items = context.user_data.setdefault('current_food_log_session_items', [])
+        if text.lower() != "готово":
+            items.append(text); await update.message.reply_text(f"➕ {text}"); return
+        context.user_data.pop('setup_step', None); context.user_data.pop('current_food_log_session_items', None)
+        if not items: await update.message.reply_text("Список пуст, ничего не записано.", reply_markup=MAIN_REPLY_MARKUP); return
+        nutrients = await calculate_calories_from_food_list_llm(user_id, items)
+        if not nutrients: await update.message.reply_text("❗ Не удалось посчитать КБЖУ. Попробуйте позже.", reply_markup=MAIN_REPLY_MARKUP); return
+        await retry_busy(food_diary.add, user_id, items, nutrients)
+        targets = await calculate_target_calories_and_pfc(user_id)
+        meal_text = f"✅ Записано: *{nutrients['calories']}* ккал, Б {nutrients['protein']} г, Ж {nutrients['fat']} г, У {nutrients['carbs']} г"
+        await update.message.reply_text(f"{meal_text}\n\n{format_diary_summary(user_id, targets[0])}", parse_mode='Markdown', reply_markup=MAIN_REPLY_MARKUP)
+        await update.message.reply_photo(await create_pfc_pie_chart(food_diary.pfc_data(user_id)))
         return
 
     # ... (остальная часть handle_text_messages без изменений) ...
 
 
 ### НОВЫЙ КОД: Функции-колбэки для напоминаний ###
-async def send_water_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Отправляет напоминание о воде."""
-    job = context.job
-    await context.bot.send_message(job.chat_id, text="💧 Не забудьте выпить стакан воды!")
-
-async def check_and_send_weigh_in_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Проверяет, взвесился ли пользователь сегодня, и если нет - напоминает."""
-    job = context.job
-    chat_id_str = str(job.chat_id)
+async def send_reminders(context: ContextTypes.DEFAULT_TYPE, chat_ids, text) -> int:
+    """Рассылает напоминание пачками; заблокировавших бота отписывает."""
+    async def send(chat_id):
+        try:
+            await context.bot.send_message(chat_id, text=text, rate_limit_args=PRIORITY_BROADCAST)
+        except Forbidden:
+            reminder_scheduler.unsubscribe(chat_id); raise
+    # Темп отправки задает outbound_limiter, пачки лишь ограничивают число одновременных запросов
+    return await send_batched(send, chat_ids, batch_size=REMINDER_BATCH_SIZE, pause=0)
+
+async def water_reminder_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Напоминает о воде пользователям текущего слота."""
+    recipients = reminder_scheduler.water_recipients(reminder_scheduler.current_slot())
+    if recipients: await send_reminders(context, recipients, "💧 Не забудьте выпить стакан воды!")
+
+async def weigh_in_reminder_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Напоминает взвеситься тем, кто сегодня еще не записал вес."""
     today_iso = datetime.date.today().isoformat()
-    
-    weight_data = load_json_data(WEIGHT_LOG_FILE)
-    user_weight_log = weight_data.get(chat_id_str, {})
-    
-    if today_iso not in user_weight_log:
-        await context.bot.send_message(job.chat_id, text="⚖️ Напоминаю: сегодня нужно взвеситься и записать свой вес! (Пример: `вес 80.5`)")
+    # Дата последнего взвешивания хранится в памяти WeightStore, на диск не ходим
+    recipients = [chat_id for chat_id in reminder_scheduler.subscribers() if weight_store.latest_day(chat_id) != today_iso]
+    sent = await send_reminders(context, recipients, "⚖️ Напоминаю: сегодня нужно взвеситься и записать свой вес! (Пример: `вес 80.5`)")
+    logger.info("Напоминание о взвешивании разослано", extra=fields(sent=sent, recipients=len(recipients)))
+
+
+async def compact_diary_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Раз в сутки удаляет старые сырые записи дневника; итоги по дням остаются."""
+    removed, removed_days = await timed_io_async("diary_compact", food_diary.compact)
+    logger.info("Дневник питания очищен", extra=fields(removed_entries=removed, removed_days=removed_days))
+
+def prune_meals(live_ids):
+    # Ссылки из всех сохраненных меню, в том числе других воркеров; затем сама чистка
+    live_ids = set(live_ids)
+    for _, user_data in bot_persistence.stored_user_data(): live_ids.update(menu_meal_ids(user_data.get('last_weekly_menu')))
+    return meal_store.prune(live_ids)
+
+async def prune_meals_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Раз в сутки удаляет блюда, на которые не ссылаются ни меню пользователей, ни пул."""
+    # Меню этого воркера могут быть еще не сохранены, а пул живет только в памяти: их ссылки собираем здесь
+    live_ids = {key for user_data in context.application.user_data.values() for key in menu_meal_ids(user_data.get('last_weekly_menu'))}
+    live_ids.update(meal_id(meal) for meal in menu_pool.meals())
+    removed = await timed_io_async("meals_prune", prune_meals, live_ids)
+    logger.info("Неиспользуемые блюда удалены", extra=fields(removed=removed, live=len(live_ids)))
+
+async def sync_shared_state_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Подтягивает профили и рецепты, которые записали другие воркеры."""
+    with io_seconds.time(op="profiles_sync"): await user_profiles_data.sync_async()
+    timed_io("recipes_refresh", recipe_index.refresh)  # обычно это несколько строк по первичному ключу; индекс меняем в потоке event loop
+
+async def flush_profiles_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Периодически сбрасывает изменённые профили и тренды веса на диск."""
+    with io_seconds.time(op="profiles_flush"): await user_profiles_data.flush_async()
+    with io_seconds.time(op="weight_trends_flush"): await weight_store.flush_trends_async()
+
+async def save_nutrition_cache_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Периодически сохраняет кэш КБЖУ и пишет статистику попаданий."""
+    items = nutrition_cache.snapshot()
+    if items is None: return
+    await timed_io_async("nutrition_cache_save", nutrition_cache.save, items)
+    logger.info("Кэш КБЖУ сохранен", extra=fields(cache=nutrition_cache.stats(), food_index=food_index.stats()))
+
+async def fill_menu_pool_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """В тихие часы заранее генерирует однодневные меню для ключей пула, по которым есть пользователи."""
+    demand = {}
+    for i, user_id in enumerate(list(user_profiles_data.keys()), 1):
+        # Расчет целей не ждет ничего асинхронного: без этого проход по всем профилям не отдал бы loop обработчикам
+        if i % MENU_POOL_DEMAND_BATCH == 0: await asyncio.sleep(0)
+        # Пул в памяти у каждого воркера свой: пополняем его под свои чаты
+        if not worker_shard.owns(user_id): continue
+        targets = await calculate_target_calories_and_pfc(user_id)
+        if not targets[0]: continue
+        profile = user_profiles_data.get(user_id)
+        key = menu_pool_key(profile.get('diet_goal'), targets[0], {'p': targets[1], 'f': targets[2], 'c': targets[3]}, profile.get('exclusions', []))
+        entry = demand.setdefault(key, [0, profile]); entry[0] += 1
+    generated = 0
+    # Сначала самые популярные ключи; генерируем под середину корзины, а не под конкретного пользователя
+    for key, (users, profile) in sorted(demand.items(), key=lambda kv: -kv[1][0]):
+        diet_goal, calorie_bucket, (p, f, c), _ = key
+        while menu_pool.size(key) < MENU_POOL_TARGET_PER_KEY and generated < MENU_POOL_MAX_GENERATIONS_PER_RUN:
+            generated += 1
+            menu_data = await generate_personalized_menu_with_llm(profile, calorie_bucket, {'p': p, 'f': f, 'c': c}, num_days=1)
+            if not menu_data or not menu_data.get('weekly_plan'): break
+            menu_pool.add(key, menu_data)
+    logger.info("Пул меню пополнен", extra=fields(generated=generated, **menu_pool.stats()))
+
+async def log_llm_stats_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пишет в лог очередь, задержки и ошибки обращений к Gemini."""
+    logger.info("Статистика Gemini", extra=fields(**llm_gateway.stats()))
+    logger.info("Заготовленные замены блюд", extra=fields(**replacement_prefetcher.stats()))
+    logger.info("Рецепты из холодильника", extra=fields(**recipe_index.stats()))
+    if update_forwarder is not None: logger.info("Пересылка апдейтов воркерам", extra=fields(shard=str(worker_shard), **update_forwarder.stats()))
+
+async def prewarm_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """После старта в фоне загружает Gemini и matplotlib, чтобы первый запрос к ним не ждал импорта."""
+    started = datetime.datetime.now()
+    if GEMINI_API_KEY: await llm_gateway.get_model()
+    await chart_service.warm_up()
+    logger.info("Прогрев зависимостей завершен", extra=fields(seconds=round((datetime.datetime.now() - started).total_seconds(), 1)))
+
+async def on_shutdown(application) -> None:
+    """Сохраняет всё несохранённое при остановке бота."""
+    # Обработчики уже остановлены: пишем в потоке, где можно дождаться записи других воркеров (см. db.Database)
+    saved = await timed_io_async("profiles_flush", user_profiles_data.flush)
+    if saved: logger.info("При остановке сохранены профили", extra=fields(profiles=saved))
+    await timed_io_async("weight_trends_flush", weight_store.flush_trends)
+    timed_io("nutrition_cache_save", nutrition_cache.save)
+    chart_service.shutdown()
+    if update_forwarder is not None: await update_forwarder.close()
+
+async def log_handler_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Пишет необработанное исключение в лог вместе с request_id апдейта или задачи."""
+    if isinstance(update, Update): value = f"{WORKER_INDEX}-{update.update_id}"
+    elif context.job is not None: value = f"job:{context.job.name}"
+    else: value = None
+    chat = update.effective_chat if isinstance(update, Update) else None
+    with request_context(value):
+        logger.error("Необработанное исключение", exc_info=context.error, extra=fields(chat_id=chat.id if chat else None))
+    if chat is not None and is_busy(context.error):
+        # Запись не прошла и после повторов: без ответа пользователь решил бы, что она сохранена
+        await context.bot.send_message(chat_id=chat.id, text="⚠️ Не удалось сохранить данные: база занята. Повторите, пожалуйста, через минуту.")
+
+def record_job_lag(scheduler, event):
+    job = scheduler.get_job(event.job_id)
+    name = job.name if job is not None else event.job_id
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for scheduled in event.scheduled_run_times: job_lag_seconds.observe(max(0.0, (now - scheduled).total_seconds()), job=name)
 
 
 # --- ЕДИНЫЕ ОПРЕДЕЛЕНИЯ ДЛЯ МЕНЮ ---
-MAIN_MENU_HANDLERS = {
+MAIN_MENU_HANDLERS = {text: observed(callback) for text, callback in {
     "Показать меню на день": menu_command,
     "Меню на неделю": weekly_menu_command,
     "Рассчитать КБЖУ": calories_command,
@@ -497,7 +975,7 @@ MAIN_MENU_HANDLERS = {
     "Записать еду": log_food_command,
     "Предпочтения": prefs_command,
     "Что в холодильнике?": fridge_command,
-}
+}.items()}
 
 main_keyboard_layout = [
     ["Показать меню на день", "Меню на неделю"],
@@ -507,43 +985,103 @@ main_keyboard_layout = [
 ]
 MAIN_REPLY_MARKUP = ReplyKeyboardMarkup(main_keyboard_layout, resize_keyboard=True)
 
+def init_storage() -> None:
+    """Открывает базу и загружает данные, переносит старые JSON-файлы при первом запуске."""
+    global user_profiles_data, database, weight_store, reminder_scheduler, bot_persistence, meal_store, recipe_index, food_diary
+    database = Database(DATABASE_FILE)
+    # Переносы старых файлов выполняет только первый воркер, чтобы они не шли параллельно
+    migrate = worker_shard.primary
+    weight_store = WeightStore(database)
+    imported = timed_io("weight_log_import", weight_store.import_json, WEIGHT_LOG_FILE) if migrate else 0
+    if imported: logger.info("Импортированы записи веса", extra=fields(path=WEIGHT_LOG_FILE, rows=imported))
+    user_profiles_data = ProfileRepository(database)
+    imported = timed_io("profiles_import", user_profiles_data.import_json, USER_PROFILES_FILE) if migrate else 0
+    if imported: logger.info("Импортированы профили", extra=fields(path=USER_PROFILES_FILE, rows=imported))
+    meal_store = MealStore(database)
+    recipe_index = RecipeIndex(database)
+    food_diary = FoodDiary(database, raw_retention_days=DIARY_RAW_RETENTION_DAYS)
+    reminder_scheduler = ReminderScheduler(database, water_interval=WATER_REMINDER_INTERVAL, slot_seconds=REMINDER_SLOT_SECONDS, owns=worker_shard.owns)
+    if migrate and not database.get_meta("reminders_migrated"):
+        # Раньше напоминания жили только в памяти JobQueue: подписываем всех, кто уже настроил профиль
+        subscribed = reminder_scheduler.subscribe_many(user_profiles_data.keys())
+        database.set_meta("reminders_migrated", datetime.datetime.now().isoformat())
+        if subscribed: logger.info("Существующие пользователи подписаны на напоминания", extra=fields(subscribed=subscribed))
+    bot_persistence = SQLitePersistence(database, update_interval=PERSISTENCE_UPDATE_INTERVAL)
+    migrated = timed_io("persistence_migrate", bot_persistence.migrate_pickle, PERSISTENCE_FILE) if migrate else 0
+    if migrated: logger.info("Перенесены данные PicklePersistence", extra=fields(path=PERSISTENCE_FILE, rows=migrated))
+    timed_io("nutrition_cache_load", nutrition_cache.load, *(nutrition_cache_file(index) for index in range(WORKER_COUNT)))
+    timed_io("food_index_load", food_index.load, FOOD_COMPOSITION_FILE)
+
+def build_application(token, request=None):
+    """Собирает приложение с обработчиками и фоновыми задачами. request — свой транспорт для Bot API (для тестов)."""
+    global update_forwarder, update_processor
+    job_queue = JobQueue()
+    builder = ApplicationBuilder().token(token).persistence(bot_persistence).job_queue(job_queue).rate_limiter(outbound_limiter).post_shutdown(on_shutdown)
+    update_processor = ChatOrderedUpdateProcessor(UPDATE_CONCURRENCY)
+    builder = builder.concurrent_updates(update_processor)
+    if request is not None: builder = builder.request(request).get_updates_request(request)
+    if TELEGRAM_API_URL: builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if WORKER_COUNT > 1 and WORKER_URLS:
+        update_forwarder = UpdateForwarder(worker_shard, WORKER_URLS, secret_token=token.split(':')[-1])
+        builder = builder.application_class(ShardedApplication, kwargs={"forwarder": update_forwarder})
+    app = builder.build()
+    scheduler = app.job_queue.scheduler
+    scheduler.add_listener(lambda event: record_job_lag(scheduler, event), EVENT_JOB_SUBMITTED)
+    app.job_queue.run_repeating(observed_job(flush_profiles_job), interval=PROFILE_FLUSH_INTERVAL, name="flush_profiles")
+    app.job_queue.run_repeating(observed_job(log_llm_stats_job), interval=LLM_STATS_LOG_INTERVAL, name="log_llm_stats")
+    app.job_queue.run_daily(observed_job(fill_menu_pool_job), time=MENU_POOL_FILL_TIME, name="fill_menu_pool")
+    if worker_shard.primary: app.job_queue.run_daily(observed_job(compact_diary_job), time=DIARY_COMPACT_TIME, name="compact_diary")
+    if worker_shard.primary: app.job_queue.run_daily(observed_job(prune_meals_job), time=MEALS_PRUNE_TIME, name="prune_meals")
+    if WORKER_COUNT > 1: app.job_queue.run_repeating(observed_job(sync_shared_state_job), interval=SHARED_STATE_SYNC_INTERVAL, name="sync_shared_state")
+    app.job_queue.run_repeating(observed_job(save_nutrition_cache_job), interval=NUTRITION_CACHE_SAVE_INTERVAL, name="save_nutrition_cache")
+    app.job_queue.run_repeating(observed_job(water_reminder_tick), interval=REMINDER_SLOT_SECONDS, first=reminder_scheduler.seconds_to_next_slot(), name="water_reminders")
+    app.job_queue.run_daily(observed_job(weigh_in_reminder_tick), time=WEIGH_IN_REMINDER_TIME, name="weigh_in_reminders")
+    app.job_queue.run_once(observed_job(prewarm_job), when=PREWARM_DELAY, name="prewarm")
+
+    # ### ИЗМЕНЕНО: Удалены команды для напоминаний ###
+    app.add_handler(CommandHandler("start", observed(start)))
+    app.add_handler(CommandHandler("prefs", observed(prefs_command)))
+    app.add_handler(CommandHandler("fridge", observed(fridge_command)))
+    app.add_handler(CommandHandler("goal", observed(goal_command)))
+    
+    app.add_handler(CallbackQueryHandler(observed(inline_button_handler)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, observed(handle_text_messages)))
+    app.add_error_handler(log_handler_error)
+    return app
+
 # ===== ИЗМЕНЕННАЯ ФУНКЦИЯ MAIN =====
 def main() -> None:
     """Запускает бота в режиме вебхука и включает очередь задач."""
-    global user_profiles_data
-    user_profiles_data = load_json_data(USER_PROFILES_FILE)
-    
-    persistence = PicklePersistence(filepath=PERSISTENCE_FILE)
-    job_queue = JobQueue()
+    setup_logging(LOG_LEVEL, json_format=LOG_FORMAT != "text")
+    init_storage()
 
     TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
     if not TOKEN:
         raise ValueError("Не найден токен TELEGRAM_BOT_TOKEN в переменных окружения")
 
-    app = ApplicationBuilder().token(TOKEN).persistence(persistence).job_queue(job_queue).build()
-
-    # ### ИЗМЕНЕНО: Удалены команды для напоминаний ###
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("prefs", prefs_command))
-    app.add_handler(CommandHandler("fridge", fridge_command))
-    
-    app.add_handler(CallbackQueryHandler(inline_button_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_messages))
+    app = build_application(TOKEN)
     
     # --- НАСТРОЙКИ ВЕБХУКА ---
     PORT = int(os.environ.get('PORT', 8443))
     RENDER_EXTERNAL_URL = os.environ.get('RENDER_EXTERNAL_URL')
     if not RENDER_EXTERNAL_URL:
         raise ValueError("Не найдена переменная RENDER_EXTERNAL_URL.")
+    if WORKER_COUNT > 1 and len(WORKER_URLS) != WORKER_COUNT:
+        raise ValueError(f"Для {WORKER_COUNT} воркеров в WORKER_URLS нужно {WORKER_COUNT} адресов.")
 
-    print("Бот запускается в режиме вебхука с автоматическими напоминаниями...")
+    logger.info("Бот запускается в режиме вебхука с автоматическими напоминаниями", extra=fields(shard=str(worker_shard), port=PORT))
     
-    app.run_webhook(
+    # Свой сервер вместо run_webhook: рядом с вебхуком отдаем /metrics
+    asyncio.run(serve_webhook(
+        app,
         listen="0.0.0.0",
         port=PORT,
         secret_token=TOKEN.split(':')[-1],
-        webhook_url=RENDER_EXTERNAL_URL
-    )
+        webhook_url=RENDER_EXTERNAL_URL,
+        registry=metrics_registry,
+        metrics_token=METRICS_TOKEN,
+        loop_monitor=loop_monitor,
+    ))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+import datetime
+import hashlib
+import json
+import zlib
+from collections import OrderedDict
+
+from db import Database
+
+
+def meal_id(meal):
+    """Идентификатор блюда по содержимому: одинаковые блюда получают один id."""
+    canonical = json.dumps(meal, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+class MealStore:
+    """Блюда, сохранённые один раз по хэшу содержимого.
+
+    Меню пользователя хранит только id блюд, а само блюдо с рецептом
+    лежит в базе сжатым. Одно и то же блюдо из пула или повторной генерации
+    занимает одну запись на всех пользователей. Недавние блюда держатся
+    в памяти (LRU). Возвращаемые словари общие — их нельзя менять на месте.
+    """
+
+    def __init__(self, db: Database, cache_size=2000):
+        self.db = db
+        self.cache_size = cache_size
+        self.db.execute("CREATE TABLE IF NOT EXISTS meals (id TEXT PRIMARY KEY, data BLOB NOT NULL, orphan_since TEXT) WITHOUT ROWID")
+        if "orphan_since" not in {row[1] for row in self.db.execute("PRAGMA table_info(meals)")}:
+            self.db.execute("ALTER TABLE meals ADD COLUMN orphan_since TEXT")
+        self._cache = OrderedDict()
+
+    def _remember(self, key, meal):
+        self._cache[key] = meal
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+
+    def put_many(self, meals):
+        """Сохраняет блюда и возвращает их id в том же порядке."""
+        ids = [meal_id(meal) for meal in meals]
+        unique = dict(zip(ids, meals))
+        if not unique: return ids
+        # Кэш только для чтения: блюдо без ссылок могли удалить из базы (см. prune), поэтому наличие проверяем в базе
+        stored = dict(self.db.execute(f"SELECT id, orphan_since FROM meals WHERE id IN ({','.join('?' * len(unique))})", list(unique)).fetchall())
+        rows = [(key, zlib.compress(json.dumps(meal, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))) for key, meal in unique.items() if key not in stored]
+        revived = [(key,) for key, orphan_since in stored.items() if orphan_since is not None]
+        if rows or revived:
+            with self.db.transaction() as conn:
+                if rows: conn.executemany("INSERT OR IGNORE INTO meals (id, data) VALUES (?, ?)", rows)
+                if revived: conn.executemany("UPDATE meals SET orphan_since = NULL WHERE id = ?", revived)
+        for key, meal in unique.items():
+            if key in self._cache: self._cache.move_to_end(key)
+            else: self._remember(key, meal)
+        return ids
+
+    def put(self, meal):
+        return self.put_many([meal])[0]
+
+    def get(self, key):
+        meal = self._cache.get(key)
+        if meal is not None:
+            self._cache.move_to_end(key)
+            return meal
+        row = self.db.execute("SELECT data FROM meals WHERE id = ?", (key,)).fetchone()
+        if row is None: return None
+        meal = json.loads(zlib.decompress(row[0]))
+        self._remember(key, meal)
+        return meal
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM meals").fetchone()[0]
+
+    def prune(self, live_ids, today=None):
+        """Удаляет блюда, на которые не ссылается ни одно меню из live_ids. Возвращает число удаленных.
+
+        Блюдо без ссылок сначала только помечается и удаляется, если ссылок нет и
+        на проходе в другой день: за это время сохраняются меню, которые другие
+        воркеры держат в памяти. Повторное сохранение блюда снимает пометку.
+        """
+        today = (today or datetime.date.today()).isoformat()
+        with self.db.transaction(immediate=True) as conn:
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS live_meals (id TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.executemany("INSERT OR IGNORE INTO live_meals (id) VALUES (?)", ((key,) for key in live_ids))
+            removed = [row[0] for row in conn.execute(
+                "DELETE FROM meals WHERE orphan_since < ? AND id NOT IN (SELECT id FROM live_meals) RETURNING id", (today,)).fetchall()]
+            conn.execute("UPDATE meals SET orphan_since = NULL WHERE orphan_since IS NOT NULL AND id IN (SELECT id FROM live_meals)")
+            conn.execute("UPDATE meals SET orphan_since = ? WHERE orphan_since IS NULL AND id NOT IN (SELECT id FROM live_meals)", (today,))
+            conn.execute("DELETE FROM live_meals")
+        for key in removed: self._cache.pop(key, None)
+        return len(removed)
+
+
+def compact_menu(store: MealStore, menu):
+    """Превращает меню с полными блюдами в меню со ссылками: {"days": [{"day_name", "meal_ids"}], "shopping_list"}."""
+    days = [{"day_name": day.get("day_name"), "meal_ids": store.put_many(day.get("meals", []))} for day in menu.get("weekly_plan", [])]
+    return {"days": days, "shopping_list": list(menu.get("shopping_list", []))}
+
+
+def menu_meal_ids(menu):
+    """id блюд меню со ссылками; у меню старого формата блюда лежат в самом меню и id нет."""
+    return [key for day in (menu or {}).get("days", ()) for key in day.get("meal_ids", ())]
+
+
+def day_meals(store: MealStore, day):
+    """Пары (id, блюдо) дня со ссылками; блюда, которых нет в хранилище, пропускаются."""
+    return [(key, meal) for key, meal in ((key, store.get(key)) for key in day["meal_ids"]) if meal is not None]
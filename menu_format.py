@@ -0,0 +1,58 @@
+from food_cache import UNIT_ALIASES, canonicalize_food_item
+
+# Компактная схема ответа Gemini: короткие ключи, без списка покупок и итогов по дню,
+# которые считаются локально. Блюдо: t — прием пищи, n — название,
+# i — продукты [название, количество, единица], k — [ккал, белки, жиры, углеводы], r — рецепт.
+MEAL_SCHEMA = '{"t": "Завтрак", "n": "Название блюда", "i": [["продукт", 100, "г"], ["яйцо", 2, "шт"]], "k": [350, 20, 10, 45], "r": "Краткий рецепт."}'
+MENU_SCHEMA = '{"d": [{"m": [' + MEAL_SCHEMA + ', ...]}, ...]}'
+
+# Единицы, в которых суммируется список покупок: килограммы и литры переводятся в граммы и миллилитры
+_BASE_UNITS = {"г": ("г", 1), "кг": ("г", 1000), "мл": ("мл", 1), "л": ("мл", 1000), "шт": ("шт", 1)}
+
+
+def _number(value):
+    try: return float(str(value).replace(",", "."))
+    except ValueError: return 0.0
+
+
+def expand_meal(compact):
+    """Блюдо из компактной схемы -> блюдо в формате бота (meal_name, items, total_*, recipe)."""
+    calories, protein, fat, carbs = (list(compact.get("k") or []) + [0, 0, 0, 0])[:4]
+    items = []
+    for item in compact.get("i") or []:
+        if isinstance(item, dict): item = (item.get("food_item"), item.get("amount", item.get("grams")), item.get("unit"))
+        name, amount, unit = (list(item) + [None, None, None])[:3]
+        if name: items.append({"food_item": str(name), "amount": _number(amount or 0), "unit": str(unit or "г")})
+    meal_type, dish = compact.get("t", "Прием пищи"), compact.get("n")
+    return {"meal_name": f"{meal_type} ({dish})" if dish else meal_type, "items": items,
+            "total_calories": calories, "total_protein": protein, "total_fat": fat, "total_carbs": carbs, "recipe": compact.get("r", "")}
+
+
+def expand_menu(compact):
+    """Меню из компактной схемы -> {"weekly_plan": [...], "shopping_list": [...]}, список покупок собирается локально."""
+    weekly_plan = [{"day_name": f"День {index}", "meals": [expand_meal(meal) for meal in day.get("m") or []]}
+                   for index, day in enumerate(compact.get("d") or [], 1)]
+    return {"weekly_plan": weekly_plan, "shopping_list": build_shopping_list(meal for day in weekly_plan for meal in day["meals"])}
+
+
+def _format_amount(amount, unit):
+    if unit in ("г", "мл") and amount >= 1000:
+        amount, unit = amount / 1000, "кг" if unit == "г" else "л"
+    return f"{round(amount, 1):g} {unit}"
+
+
+def build_shopping_list(meals):
+    """Суммирует продукты всех блюд по названию и единице: «Рис: 240 г», «Яйцо: 4 шт»."""
+    totals = {}  # (название, единица) -> [отображаемое название, количество]
+    for meal in meals:
+        for item in meal.get("items") or []:
+            name = (item.get("food_item") or "").strip()
+            if not name: continue
+            if "amount" in item:
+                amount, unit = _number(item["amount"]), UNIT_ALIASES.get(str(item.get("unit", "г")).lower().rstrip("."), str(item.get("unit", "")))
+            else:
+                amount, unit = _number(item.get("grams", 0)), "г"  # блюда, сгенерированные до компактной схемы
+            unit, factor = _BASE_UNITS.get(unit, (unit, 1))
+            entry = totals.setdefault((canonicalize_food_item(name), unit), [name[:1].upper() + name[1:], 0.0])
+            entry[1] += amount * factor
+    return [f"{name}: {_format_amount(amount, unit)}" if amount else name for (_, unit), (name, amount) in totals.items()]
@@ -0,0 +1,99 @@
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+CALORIE_BUCKET = 100  # ккал
+PFC_BUCKET = 10  # граммов
+
+
+def menu_pool_key(diet_goal, calorie_target, pfc_targets, exclusions=()):
+    """Ключ пула: цель диеты, корзина калорий, корзина БЖУ и хэш исключений."""
+    calorie_bucket = int(round(calorie_target / CALORIE_BUCKET)) * CALORIE_BUCKET
+    pfc_bucket = tuple(int(round(pfc_targets[k] / PFC_BUCKET)) * PFC_BUCKET for k in ("p", "f", "c"))
+    normalized = sorted({e.strip().lower() for e in exclusions or () if e.strip()})
+    exclusions_hash = hashlib.sha1("|".join(normalized).encode("utf-8")).hexdigest()[:12] if normalized else ""
+    return diet_goal or "баланс", calorie_bucket, pfc_bucket, exclusions_hash
+
+
+def _menu_id(menu_data):
+    return hashlib.sha1(json.dumps(menu_data, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class MenuPool:
+    """Готовые однодневные меню, сгруппированные по ключу menu_pool_key.
+
+    Пул заполняется в фоне (в тихие часы) и живыми генерациями; выдача
+    чередует меню так, чтобы пользователь не видел повторов. Старые записи
+    вытесняются по TTL и по размеру.
+    """
+
+    def __init__(self, ttl=3 * 24 * 3600, max_per_key=20, max_total=2000, clock=time.time):
+        self.ttl = ttl
+        self.max_per_key = max_per_key
+        self.max_total = max_total
+        self._clock = clock
+        self._pools = {}  # key -> OrderedDict(menu_id -> {"menu", "created", "served"})
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, key, menu_data):
+        """Кладет однодневное меню в пул. Возвращает его id."""
+        menu_id = _menu_id(menu_data)
+        pool = self._pools.setdefault(key, OrderedDict())
+        if menu_id not in pool:
+            pool[menu_id] = {"menu": copy.deepcopy(menu_data), "created": self._clock(), "served": 0}
+            self._total += 1
+        self._evict(key)
+        return menu_id
+
+    def take(self, key, seen=()):
+        """Выдает наименее показанное меню, которого пользователь еще не видел, или None."""
+        self._expire(key)
+        pool = self._pools.get(key)
+        candidates = [(entry["served"], entry["created"], menu_id) for menu_id, entry in (pool or {}).items() if menu_id not in seen]
+        if not candidates:
+            self.misses += 1
+            return None
+        _, _, menu_id = min(candidates)
+        entry = pool[menu_id]
+        entry["served"] += 1
+        self.hits += 1
+        return menu_id, copy.deepcopy(entry["menu"])
+
+    def meals(self):
+        """Блюда всех меню в пуле."""
+        return [meal for pool in self._pools.values() for entry in pool.values()
+                for day in entry["menu"].get("weekly_plan", ()) for meal in day.get("meals", ())]
+
+    def size(self, key=None):
+        if key is None: return self._total
+        self._expire(key)
+        return len(self._pools.get(key, ()))
+
+    def _expire(self, key):
+        pool = self._pools.get(key)
+        if not pool: return
+        deadline = self._clock() - self.ttl
+        # Записи в OrderedDict идут по времени добавления
+        while pool and next(iter(pool.values()))["created"] < deadline:
+            pool.popitem(last=False); self._total -= 1
+        if not pool: del self._pools[key]
+
+    def _evict(self, key):
+        self._expire(key)
+        pool = self._pools.get(key)
+        while pool and len(pool) > self.max_per_key:
+            pool.popitem(last=False); self._total -= 1
+        while self._total > self.max_total:
+            # Вытесняем самую старую запись среди всех ключей
+            oldest_key = min(self._pools, key=lambda k: next(iter(self._pools[k].values()))["created"])
+            self._pools[oldest_key].popitem(last=False); self._total -= 1
+            if not self._pools[oldest_key]: del self._pools[oldest_key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"keys": len(self._pools), "menus": self._total, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0}
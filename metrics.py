@@ -0,0 +1,183 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)  # Gemini, графики
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"): return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # кортеж значений меток -> значение
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames): raise ValueError(f"{self.name}: ожидаются метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма в формате Prometheus: счетчики по корзинам, сумма и число наблюдений."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None: entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = entry[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound: counts[i] += 1; break
+        entry[1] += value; entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus.
+
+    Счетчики, которые уже ведут сами компоненты (статистика Gemini, кэшей,
+    очередей), не дублируются: collector снимает их в момент запроса /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """func() возвращает значения на момент запроса: [(тип, имя, описание, {метка: значение}, число), ...]."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self._metrics: lines.extend(metric.render())
+        collected = {}  # имя -> метрика, чтобы строки одного имени шли одним блоком
+        for func in self._collectors:
+            try:
+                samples = list(func())
+            except Exception as e:  # сломанный сборщик не должен ронять /metrics
+                lines.append(f"# collector {getattr(func, '__name__', func)} failed: {_escape(e)}"); continue
+            for kind, name, documentation, labels, value in samples:
+                metric = collected.get(name)
+                if metric is None: metric = collected[name] = (Gauge if kind == "gauge" else Counter)(name, documentation, tuple(labels))
+                metric._values[metric._key(labels)] = value
+        for metric in collected.values(): lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LoopMonitor:
+    """Замечает блокировки event loop: задача просыпается каждые interval секунд и меряет опоздание.
+
+    Заметное опоздание значит, что какой-то код держал loop без await
+    (синхронный ввод-вывод, тяжелые вычисления). on_lag(lag) вызывается на
+    каждом замере.
+    """
+
+    def __init__(self, on_lag, interval=0.1):
+        self.on_lag = on_lag
+        self.interval = interval
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.on_lag(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        if self._task is None: self._task = asyncio.get_running_loop().create_task(self._run(), name="loop_monitor")
+
+    async def stop(self):
+        if self._task is None: return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from logs import fields
+from ratelimit import PriorityRateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0  # ответы на действия пользователя
+PRIORITY_BROADCAST = 1  # рассылки напоминаний
+
+# Методы, на которые распространяются лимиты Telegram на отправку сообщений
+SEND_ENDPOINTS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+}
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Ограничитель исходящих запросов для Application.
+
+    Общий лимит бота (около 30 сообщений в секунду) и лимит на чат
+    (1 сообщение в секунду с небольшим всплеском, в группах — 20 в минуту).
+    Интерактивные ответы проходят раньше рассылок. При RetryAfter отправка
+    всех сообщений приостанавливается на указанное Telegram время, после
+    чего запрос повторяется.
+    """
+
+    def __init__(self, overall_rate=30, chat_rate=1.0, chat_burst=5, group_rate=20 / 60, max_retries=3, on_request=None):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self._overall = None
+        self._chats = {}
+        self._last_cleanup = time.monotonic()
+        self.sent = 0
+        self.retry_after_count = 0
+        self.on_request = on_request  # on_request(метод, секунды) после каждого запроса к Bot API: для метрик
+
+    async def initialize(self):
+        self._overall = PriorityRateLimiter(self.overall_rate, capacity=self.overall_rate)
+
+    async def shutdown(self):
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, capacity=self.chat_burst)
+            self._chats[chat_id] = bucket
+        now = time.monotonic()
+        if now - self._last_cleanup > 60:
+            # Удаляем ведра неактивных чатов, чтобы словарь не рос вместе с числом пользователей
+            self._last_cleanup = now
+            for key in [k for k, b in self._chats.items() if b.idle and k != chat_id]: del self._chats[key]
+        return bucket
+
+    @property
+    def queue_depth(self):
+        return self._overall.waiting if self._overall else 0
+
+    async def _timed(self, endpoint, callback, args, kwargs):
+        if self.on_request is None: return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            self.on_request(endpoint, time.perf_counter() - started)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in SEND_ENDPOINTS:
+            return await self._timed(endpoint, callback, args, kwargs)
+        priority = rate_limit_args if isinstance(rate_limit_args, int) else PRIORITY_INTERACTIVE
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None: await self._chat_bucket(chat_id).acquire()
+            await self._overall.acquire(priority)
+            try:
+                result = await self._timed(endpoint, callback, args, kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                if attempt == self.max_retries: raise
+                self.retry_after_count += 1
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                logger.warning("Telegram попросил подождать (RetryAfter)", extra=fields(endpoint=endpoint, delay=delay, attempt=attempt + 1))
+                self._overall.pause(delay)
+                await asyncio.sleep(delay)
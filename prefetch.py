@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from logs import fields
+
+logger = logging.getLogger(__name__)
+
+
+def _dish_name(meal):
+    return (meal.get("meal_name") or "").strip().lower()
+
+
+class _Generation:
+    """Идущая генерация кандидатов для одного блюда."""
+    __slots__ = ("task", "first", "urgent", "slot_waiter")
+
+    def __init__(self, first, urgent):
+        self.task = None
+        self.first = first  # готов первый кандидат или генерация закончилась
+        self.urgent = urgent  # ее ждет нажатие «Заменить»: место среди фоновых не нужно
+        self.slot_waiter = None
+
+
+class ReplacementPrefetcher:
+    """Заранее сгенерированные замены блюд.
+
+    После отправки меню в фоне генерируется по per_meal альтернатив на каждое
+    блюдо. Кандидаты лежат в очереди пользователя (не больше max_per_user,
+    старые вытесняются) и живут ttl секунд. Нажатие «Заменить» забирает
+    готового кандидата; если генерация этого блюда ещё идёт, повторные нажатия
+    ждут её, а не запускают новую. Кандидат достается одному ждущему,
+    остальным генерируется свой.
+    Фоновых генераций идет не больше background_concurrency, остальные ждут
+    в очереди. Генерации, которых ждет нажатие, в эту очередь не встают, а
+    фоновая генерация, к которой присоединилось нажатие, выходит из очереди.
+    generate(user_id, meal, avoid_names) -> блюдо или None.
+    """
+
+    def __init__(self, generate, per_meal=1, max_per_user=24, ttl=6 * 3600, background_concurrency=2, max_users=10000, clock=time.monotonic):
+        self.generate = generate
+        self.per_meal = per_meal
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.max_users = max_users
+        self._clock = clock
+        self._free_slots = background_concurrency
+        self._slot_waiters = deque()  # Future фоновых генераций, ждущих места, по порядку
+        self._queues = OrderedDict()  # user_id -> OrderedDict(meal_key -> deque[(created, кандидат)])
+        self._in_flight = {}  # (user_id, meal_key) -> _Generation
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.wasted = 0
+
+    def _user_queue(self, user_id):
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = OrderedDict()
+            while len(self._queues) > self.max_users: self.wasted += sum(map(len, self._queues.popitem(last=False)[1].values()))
+        self._queues.move_to_end(user_id)
+        return queue
+
+    def ready(self, user_id, meal_key):
+        """Сколько готовых кандидатов для блюда лежит в очереди (без проверки срока)."""
+        queue = self._queues.get(user_id)
+        return len(queue.get(meal_key, ())) if queue else 0
+
+    def _store(self, user_id, meal_key, candidate):
+        queue = self._user_queue(user_id)
+        queue.setdefault(meal_key, deque()).append((self._clock(), candidate))
+        while sum(map(len, queue.values())) > self.max_per_user:
+            # Вытесняем кандидатов для блюд, показанных раньше всех
+            oldest = next(iter(queue))
+            queue[oldest].popleft(); self.wasted += 1
+            if not queue[oldest]: del queue[oldest]
+
+    async def _acquire_slot(self, generation):
+        # True — место среди фоновых получено, False — генерацию ждет нажатие и место не нужно
+        if self._free_slots:
+            self._free_slots -= 1; return True
+        waiter = generation.slot_waiter = asyncio.get_running_loop().create_future()
+        self._slot_waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result(): self._release_slot()
+            raise
+        finally:
+            generation.slot_waiter = None
+
+    def _release_slot(self):
+        while self._slot_waiters:
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done(): waiter.set_result(True); return  # место переходит следующему в очереди
+        self._free_slots += 1
+
+    def _promote(self, generation):
+        generation.urgent = True
+        if generation.slot_waiter is not None and not generation.slot_waiter.done(): generation.slot_waiter.set_result(False)
+
+    async def _run(self, generation, user_id, meal, avoid_names):
+        slot = not generation.urgent and await self._acquire_slot(generation)
+        try:
+            candidate = await self.generate(user_id, meal, sorted(avoid_names))
+        except Exception as e:
+            logger.warning("Ошибка предварительной генерации замены", extra=fields(user_id=user_id, error=str(e))); return None
+        finally:
+            if slot: self._release_slot()
+        if candidate: avoid_names.add(_dish_name(candidate))
+        return candidate
+
+    def _start(self, user_id, meal_key, meal, avoid_names, count, urgent=False):
+        generation = _Generation(asyncio.get_running_loop().create_future(), urgent)
+        first = generation.first
+
+        async def produce():
+            try:
+                for _ in range(count):
+                    candidate = await self._run(generation, user_id, meal, avoid_names)
+                    if not candidate: break
+                    self.prefetched += 1
+                    self._store(user_id, meal_key, candidate)
+                    if not first.done(): first.set_result(True)
+            finally:
+                if not first.done(): first.set_result(False)
+
+        generation.task = asyncio.create_task(produce())
+        self._in_flight[(user_id, meal_key)] = generation
+        generation.task.add_done_callback(lambda _: self._in_flight.pop((user_id, meal_key), None))
+        return generation
+
+    def schedule(self, user_id, meals, shown_names=()):
+        """Запускает фоновую генерацию замен для блюд [(meal_key, блюдо), ...], если их ещё нет."""
+        shown = {name.strip().lower() for name in shown_names}
+        for meal_key, meal in meals:
+            missing = self.per_meal - self.ready(user_id, meal_key)
+            if missing <= 0 or (user_id, meal_key) in self._in_flight: continue
+            self._start(user_id, meal_key, meal, shown | {_dish_name(meal)}, missing)
+
+    def _pop(self, user_id, meal_key, shown):
+        queue = self._queues.get(user_id)
+        candidates = queue.get(meal_key) if queue else None
+        while candidates:
+            created, candidate = candidates.popleft()
+            if self._clock() - created > self.ttl or _dish_name(candidate) in shown:
+                self.wasted += 1; continue
+            if not candidates: del queue[meal_key]
+            return candidate
+        if candidates is not None: del queue[meal_key]
+        return None
+
+    async def take(self, user_id, meal_key, meal, shown_names=()):
+        """Замена для блюда: готовый кандидат, результат идущей генерации или новая генерация."""
+        shown = {name.strip().lower() for name in shown_names}
+        candidate = self._pop(user_id, meal_key, shown)
+        if candidate:
+            self.hits += 1; return candidate
+        if (user_id, meal_key) in self._in_flight: self.joined += 1
+        else: self.misses += 1
+        while True:
+            generation = self._in_flight.get((user_id, meal_key))
+            if generation is None: generation = self._start(user_id, meal_key, meal, shown | {_dish_name(meal)}, 1, urgent=True)
+            else: self._promote(generation)  # фоновую генерацию ждет пользователь: очередь фоновых ей больше не нужна
+            first = generation.first
+            await asyncio.shield(generation.task if first.done() else first)  # первого кандидата уже забрали: ждем следующих
+            candidate = self._pop(user_id, meal_key, shown)
+            # Кандидата мог забрать другой ждущий того же блюда: тогда ждем или запускаем свою генерацию.
+            # Если генерация не дала ни одного кандидата, повторять ее бессмысленно
+            if candidate or not first.result(): return candidate
+
+    def clear_user(self, user_id):
+        """Новое меню: старые кандидаты больше не понадобятся."""
+        queue = self._queues.pop(user_id, None)
+        if queue: self.wasted += sum(map(len, queue.values()))
+
+    def stats(self):
+        lookups = self.hits + self.joined + self.misses
+        return {"hits": self.hits, "joined": self.joined, "misses": self.misses, "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "prefetched": self.prefetched, "wasted": self.wasted, "queued": sum(len(c) for q in self._queues.values() for c in q.values()), "in_flight": len(self._in_flight)}
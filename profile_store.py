@@ -0,0 +1,149 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+
+from db import Database
+from logs import fields
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileRepository:
+    """Профили пользователей с отложенной записью.
+
+    Чтение идёт из памяти. Изменённые профили помечаются «грязными» и
+    сбрасываются в SQLite пачкой, в одной транзакции и вне event loop.
+    Запись затрагивает только изменённые строки, поэтому её стоимость не
+    зависит от общего числа профилей.
+
+    Каждая запись получает номер seq, растущий в порядке коммитов. Когда
+    базу делят несколько процессов, sync() подтягивает профили, записанные
+    другими процессами, читая только строки с seq больше уже виденного.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.db.execute("CREATE TABLE IF NOT EXISTS profiles (chat_id TEXT PRIMARY KEY, data TEXT NOT NULL, seq INTEGER NOT NULL DEFAULT 0)")
+        if "seq" not in {row[1] for row in self.db.execute("PRAGMA table_info(profiles)")}:
+            self.db.execute("ALTER TABLE profiles ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS profiles_seq ON profiles (seq)")
+        self._profiles = {}
+        self._seq = 0  # наибольший прочитанный seq
+        for chat_id, data, seq in self.db.execute("SELECT chat_id, data, seq FROM profiles"):
+            self._profiles[chat_id] = json.loads(data); self._seq = max(self._seq, seq)
+        self._written = {}  # chat_id -> seq последней собственной записи
+        self._dirty = set()
+        self._writing = set()  # взяты на запись, но еще не записаны
+        self._flush_lock = asyncio.Lock()
+
+    # --- Словарный интерфейс, как у прежнего user_profiles_data ---
+
+    def get(self, chat_id, default=None):
+        return self._profiles.get(str(chat_id), default)
+
+    def __getitem__(self, chat_id):
+        return self._profiles[str(chat_id)]
+
+    def __setitem__(self, chat_id, profile):
+        self._profiles[str(chat_id)] = profile
+        self._dirty.add(str(chat_id))
+
+    def __contains__(self, chat_id):
+        return str(chat_id) in self._profiles
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def keys(self):
+        return self._profiles.keys()
+
+    def mark_dirty(self, chat_id):
+        """Вызывать после изменения вложенных полей профиля на месте."""
+        if str(chat_id) in self._profiles:
+            self._dirty.add(str(chat_id))
+
+    @property
+    def dirty_count(self):
+        return len(self._dirty)
+
+    # --- Сброс на диск ---
+
+    def _take_dirty(self):
+        # Сериализуем в вызывающем потоке, чтобы не читать словари, которые меняют обработчики
+        rows = [(chat_id, json.dumps(self._profiles[chat_id], ensure_ascii=False)) for chat_id in self._dirty if chat_id in self._profiles]
+        self._dirty.clear()
+        self._writing.update(chat_id for chat_id, _ in rows)
+        return rows
+
+    def _write(self, rows):
+        try:
+            seq = self._write_rows(rows)
+            for chat_id, _ in rows: self._written[chat_id] = seq
+        finally:
+            self._writing.difference_update(chat_id for chat_id, _ in rows)
+
+    def _write_rows(self, rows):
+        # IMMEDIATE берет блокировку записи сразу, поэтому seq двух процессов не совпадут и растут в порядке коммитов
+        with self.db.transaction(immediate=True) as conn:
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM profiles").fetchone()[0]
+            conn.executemany("INSERT OR REPLACE INTO profiles (chat_id, data, seq) VALUES (?, ?, ?)", [(chat_id, data, seq) for chat_id, data in rows])
+        return seq
+
+    def _fetch_changes(self):
+        return self.db.execute("SELECT chat_id, data, seq FROM profiles WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+
+    def _apply_changes(self, rows):
+        # Свои еще не сохраненные изменения важнее: такие профили не трогаем
+        updated = 0
+        for chat_id, data, seq in rows:
+            self._seq = seq
+            if chat_id in self._dirty or chat_id in self._writing or self._written.get(chat_id) == seq: continue
+            self._profiles[chat_id] = json.loads(data); updated += 1
+        return updated
+
+    def sync(self):
+        """Подтягивает профили, измененные другими процессами. Возвращает число обновленных профилей."""
+        return self._apply_changes(self._fetch_changes())
+
+    async def sync_async(self):
+        """То же, что sync(), но чтение из базы — в фоновом потоке."""
+        return self._apply_changes(await asyncio.to_thread(self._fetch_changes))
+
+    def flush(self):
+        """Синхронный сброс (для остановки и скриптов)."""
+        rows = self._take_dirty()
+        if rows: self._write(rows)
+        return len(rows)
+
+    async def flush_async(self):
+        """Сбрасывает накопленные изменения в фоновом потоке. Параллельные вызовы объединяются."""
+        if not self._dirty or self._flush_lock.locked():
+            return 0
+        async with self._flush_lock:
+            rows = self._take_dirty()
+            if not rows: return 0
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                logger.exception("Ошибка при сохранении профилей", extra=fields(profiles=len(rows)))
+                self._dirty.update(chat_id for chat_id, _ in rows)
+                return 0
+            return len(rows)
+
+    def import_json(self, filepath):
+        """Однократный импорт старого user_profiles.json. Возвращает число перенесённых профилей."""
+        if self.db.get_meta("user_profiles_imported") or not os.path.exists(filepath):
+            return 0
+        try:
+            with open(filepath, "r", encoding="utf-8") as f: data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Не удалось прочитать файл", extra=fields(path=filepath, error=str(e))); return 0
+        imported = 0
+        for chat_id, profile in data.items():
+            if str(chat_id) not in self._profiles:
+                self[chat_id] = profile; imported += 1
+        self.flush()
+        self.db.set_meta("user_profiles_imported", datetime.datetime.now().isoformat())
+        return imported
@@ -0,0 +1,86 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class TokenBucket:
+    """Ограничение частоты запросов: не больше rate в секунду, всплеск до capacity."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self):
+        """Ведро полное и никто не ждет — его можно удалить."""
+        self._refill()
+        return self._tokens >= self.capacity and not self._lock.locked()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PriorityRateLimiter:
+    """Token bucket, который при нехватке токенов пропускает ожидающих по приоритету (меньше — раньше)."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._waiters = []  # куча (приоритет, порядковый номер, future)
+        self._counter = itertools.count()
+        self._pump_task = None
+
+    def _take(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if now >= self._paused_until and self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов, например после RetryAfter от Telegram."""
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        self._tokens = 0
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority=0):
+        if not self._waiters and self._take(): return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            if self._waiters[0][2].done():  # ожидающий отменен
+                heapq.heappop(self._waiters); continue
+            if self._take():
+                heapq.heappop(self._waiters)[2].set_result(None); continue
+            now = self._clock()
+            await asyncio.sleep(max(self._paused_until - now, (1 - self._tokens) / self.rate, 0.001))
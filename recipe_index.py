@@ -0,0 +1,183 @@
+import hashlib
+import json
+import re
+import sys
+from collections import defaultdict
+from itertools import combinations
+
+from db import Database
+from food_cache import canonicalize_food_item
+
+# Есть почти в каждом доме; в рецепте не требуют совпадения с продуктами пользователя
+PANTRY = {"соль", "перец", "черный перец", "молотый перец", "вода", "сахар", "специи", "растительное масло", "подсолнечное масло"}
+
+KEY_SIZE = 3  # сколько продуктов в ключе индекса
+
+_AMOUNT_RE = re.compile(r"\d+(?:\.\d+)?\s*(?:г|кг|мл|л|шт|%)?(?!\w)")
+_SPLIT_RE = re.compile(r"[,;\n]+")
+
+
+def stem_key(name):
+    # Грубая нормализация окончаний: «куриную грудку» и «куриная грудка» дают «курин груд»
+    return " ".join(word if len(word) <= 3 or word[-1].isdigit() or word[-1] == "%" else word[:max(3, len(word) - 2)] for word in name.split())
+
+
+def canonical_ingredient(text):
+    """«Куриное филе 300 г» и «филе куриное» -> «курин фил»: без количеств, основы слов в алфавитном порядке."""
+    text = _AMOUNT_RE.sub(" ", canonicalize_food_item(text))
+    return " ".join(sorted(stem_key(text).split()))
+
+
+def canonical_ingredients(items):
+    """Множество продуктов без кладовки. items — список строк или текст через запятую."""
+    if isinstance(items, str): items = _SPLIT_RE.split(items)
+    result = set()
+    for item in items:
+        text = " ".join(_AMOUNT_RE.sub(" ", canonicalize_food_item(str(item))).split())
+        if not text or text in PANTRY: continue
+        result.add(" ".join(sorted(stem_key(text).split())))
+    return frozenset(result)
+
+
+class RecipeIndex:
+    """Рецепты из «Что в холодильнике?», найденные по набору продуктов.
+
+    Рецепт индексируется по тройкам из четырех своих самых редких продуктов
+    (короткие рецепты — по всему набору). Если рецепту не хватает не больше
+    одного продукта, хотя бы одна из этих троек целиком есть у пользователя,
+    поэтому поиск читает короткие списки по тройкам, а не длинные списки
+    вроде «яйцо» или «лук». Сочетания продуктов пользователя перебираются
+    только пока их начало есть в индексе, а списки читаются от самых коротких
+    (редких) к длинным. В памяти — только множества продуктов; найденный
+    рецепт читается из базы одним запросом по первичному ключу.
+    """
+
+    def __init__(self, db: Database, min_coverage=0.75, max_candidates=500):
+        self.db = db
+        self.min_coverage = min_coverage
+        self.max_candidates = max_candidates
+        self.db.execute("CREATE TABLE IF NOT EXISTS fridge_recipes (id INTEGER PRIMARY KEY, signature TEXT UNIQUE NOT NULL, ingredients TEXT NOT NULL, data TEXT NOT NULL)")
+        self._ingredients = {}  # id рецепта -> frozenset продуктов
+        # Префиксное дерево ключей: продукт -> узел (dict) или, если ключ дальше не продолжается, список id рецептов.
+        # Рецепты ключа, у которого есть продолжения, лежат в его узле под None
+        self._trie = {}
+        self._flexible = set()  # id рецептов, которым можно не хватать одного продукта
+        self._frequency = defaultdict(int)  # продукт -> число рецептов с ним
+        self.hits = 0
+        self.misses = 0
+        self._max_id = 0
+        self.refresh()
+
+    def refresh(self):
+        """Добавляет в индекс рецепты, сохраненные с прошлого чтения (в том числе другими процессами). Возвращает их число."""
+        rows = self.db.execute("SELECT id, ingredients FROM fridge_recipes WHERE id > ? ORDER BY id", (self._max_id,)).fetchall()
+        if not rows: return 0
+        self._max_id = rows[-1][0]
+        # Свои рецепты add() уже проиндексировал; списки продуктов разбираем одним вызовом json.loads
+        rows = [row for row in rows if row[0] not in self._ingredients]
+        parsed = json.loads("[" + ",".join(ingredients for _, ingredients in rows) + "]")
+        # sys.intern: одна строка на продукт на все рецепты
+        rows = [(recipe_id, frozenset(map(sys.intern, items))) for (recipe_id, _), items in zip(rows, parsed)]
+        # Частоты считаем заранее, чтобы редкие продукты выбирались по всей базе
+        for _, ingredients in rows:
+            for item in ingredients: self._frequency[item] += 1
+        for recipe_id, ingredients in rows: self._index(recipe_id, ingredients)
+        return len(rows)
+
+    def _index(self, recipe_id, ingredients):
+        self._ingredients[recipe_id] = ingredients
+        allow_missing = self._allows_missing(len(ingredients))
+        if allow_missing: self._flexible.add(recipe_id)
+        size = min(len(ingredients) - allow_missing, KEY_SIZE)
+        frequency = self._frequency
+        rarest = sorted(ingredients, key=lambda i: (frequency[i], i))[:size + allow_missing]
+        for *path, last in combinations(sorted(rarest), size):
+            node = self._trie
+            for item in path:
+                child = node.get(item)
+                if child is None: child = node[item] = {}
+                elif child.__class__ is list: child = node[item] = {None: child}
+                node = child
+            child = node.get(last)
+            if child is None: node[last] = [recipe_id]
+            elif child.__class__ is list: child.append(recipe_id)
+            else: child.setdefault(None, []).append(recipe_id)
+
+    def _allows_missing(self, count):
+        return count > 1 and (count - 1) / count >= self.min_coverage
+
+    def add(self, recipe):
+        """Сохраняет рецепт Gemini. Возвращает id или None, если продуктов нет или такой рецепт уже есть."""
+        ingredients = canonical_ingredients(recipe.get("ingredients_used") or [])
+        if not ingredients: return None
+        signature = hashlib.sha1(json.dumps([recipe.get("dish_name", "").strip().lower(), sorted(ingredients)], ensure_ascii=False).encode("utf-8")).hexdigest()
+        cursor = self.db.execute("INSERT OR IGNORE INTO fridge_recipes (signature, ingredients, data) VALUES (?, ?, ?)",
+                                 (signature, json.dumps(sorted(ingredients), ensure_ascii=False), json.dumps(recipe, ensure_ascii=False)))
+        if not cursor.rowcount: return None
+        ingredients = frozenset(map(sys.intern, ingredients))
+        for item in ingredients: self._frequency[item] += 1
+        self._index(cursor.lastrowid, ingredients)
+        return cursor.lastrowid
+
+    def _excluded(self, ingredients, exclusions):
+        # Исключение «масло» запрещает и «сливочное масло»: сравниваем по словам
+        return any(words <= set(item.split()) for item in ingredients for words in exclusions)
+
+    def _postings(self, available):
+        """Списки рецептов по ключам, целиком состоящим из продуктов available, от коротких (редких) к длинным.
+
+        Дерево обходится только по существующим узлам: сочетание продуктов
+        продолжается, только если его начало есть в индексе.
+        """
+        items = sorted(available)
+        postings = []
+        stack = [(self._trie, 0)]
+        while stack:
+            node, start = stack.pop()
+            for i in range(start, len(items)):
+                child = node.get(items[i])
+                if child is None: continue
+                if child.__class__ is list: postings.append(child); continue
+                if None in child: postings.append(child[None])
+                stack.append((child, i + 1))
+        postings.sort(key=len)
+        return postings
+
+    def match(self, available, exclusions=(), skip=()):
+        """Лучший рецепт для набора продуктов: (id, недостающие продукты) или None. Все множества — канонические."""
+        exclusion_words = [set(item.split()) for item in exclusions]
+        candidates = set()
+        for recipe_ids in self._postings(available):
+            # Для очень частых наборов продуктов не перебираем всё: хватит лучшего из первых max_candidates
+            room = self.max_candidates - len(candidates)
+            if room <= 0: break
+            candidates.update(recipe_ids if len(recipe_ids) <= room else recipe_ids[:room])
+        recipes, flexible = self._ingredients, self._flexible
+        # Сначала рецепты без недостающих продуктов, затем использующие больше продуктов, затем новые
+        best, best_rank = None, (False, 0, 0)
+        for recipe_id in candidates:
+            ingredients = recipes[recipe_id]
+            if ingredients <= available: rank = (True, len(ingredients), recipe_id)
+            elif recipe_id in flexible and len(ingredients - available) == 1: rank = (False, len(ingredients), recipe_id)
+            else: continue
+            if rank <= best_rank or recipe_id in skip: continue
+            if exclusion_words and self._excluded(ingredients, exclusion_words): continue
+            best, best_rank = recipe_id, rank
+        return (best, recipes[best] - available) if best is not None else None
+
+    def find(self, ingredients_text, exclusions=(), skip=()):
+        """Рецепт для продуктов пользователя: (id, рецепт, недостающие продукты) или None."""
+        found = self.match(canonical_ingredients(ingredients_text), {canonical_ingredient(e) for e in exclusions} - {""}, set(skip))
+        if found is None:
+            self.misses += 1; return None
+        recipe_id, missing = found
+        row = self.db.execute("SELECT data FROM fridge_recipes WHERE id = ?", (recipe_id,)).fetchone()
+        self.hits += 1
+        recipe = json.loads(row[0])
+        return recipe_id, recipe, [item for item in recipe.get("ingredients_used", []) if canonical_ingredient(item) in missing]
+
+    def __len__(self):
+        return len(self._ingredients)
+
+    def stats(self):
+        return {"recipes": len(self._ingredients), "hits": self.hits, "misses": self.misses}
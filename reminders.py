@@ -0,0 +1,96 @@
+import asyncio
+import time
+from array import array
+
+from db import Database
+
+
+class ReminderScheduler:
+    """Подписки на напоминания, разложенные по временным слотам.
+
+    Вместо двух задач JobQueue на каждого пользователя — одна задача на тик:
+    цикл напоминаний о воде делится на слоты по slot_seconds, и каждый
+    пользователь закреплен за одним слотом. На тике обходится только список
+    его слота. Подписки хранятся в базе и переживают перезапуск.
+
+    owns(chat_id) — фильтр своих чатов, когда ботом управляют несколько
+    воркеров: в базе лежат все подписки, а в памяти и в рассылке — только
+    свои, поэтому каждое напоминание отправляет ровно один воркер.
+    """
+
+    def __init__(self, db: Database, water_interval=7200, slot_seconds=300, clock=time.time, owns=None):
+        self.db = db
+        self.water_interval = water_interval
+        self.slot_seconds = slot_seconds
+        self.slots_count = water_interval // slot_seconds
+        self._clock = clock
+        self._owns = owns or (lambda chat_id: True)
+        self.db.execute("CREATE TABLE IF NOT EXISTS reminder_subscriptions (chat_id INTEGER PRIMARY KEY, water_slot INTEGER NOT NULL)")
+        self._slot_of = {}  # chat_id -> слот
+        self._slots = [array("q") for _ in range(self.slots_count)]
+        for chat_id, slot in self.db.execute("SELECT chat_id, water_slot FROM reminder_subscriptions"):
+            if not self._owns(chat_id): continue
+            slot %= self.slots_count
+            self._slot_of[chat_id] = slot
+            self._slots[slot].append(chat_id)
+
+    def current_slot(self, now=None):
+        # Тики приходят на границах слотов, поэтому округляем, а не отбрасываем дробную часть
+        now = self._clock() if now is None else now
+        return int(round((now % self.water_interval) / self.slot_seconds)) % self.slots_count
+
+    def seconds_to_next_slot(self, now=None):
+        now = self._clock() if now is None else now
+        return self.slot_seconds - now % self.slot_seconds
+
+    def subscribe(self, chat_id):
+        """Подписывает пользователя. Первое напоминание о воде — примерно через water_interval. Возвращает True для новой подписки."""
+        chat_id = int(chat_id)
+        if chat_id in self._slot_of: return False
+        slot = self.current_slot()
+        self.db.execute("INSERT OR REPLACE INTO reminder_subscriptions (chat_id, water_slot) VALUES (?, ?)", (chat_id, slot))
+        # Чужой чат (его апдейт обработан здесь, пока владелец был недоступен) только записываем в базу
+        if self._owns(chat_id):
+            self._slot_of[chat_id] = slot
+            self._slots[slot].append(chat_id)
+        return True
+
+    def subscribe_many(self, chat_ids):
+        new_rows = []
+        for chat_id in map(int, chat_ids):
+            if chat_id in self._slot_of: continue
+            # Распределяем равномерно по слотам, чтобы не отправлять всем сразу
+            slot = chat_id % self.slots_count
+            if self._owns(chat_id):
+                self._slot_of[chat_id] = slot
+                self._slots[slot].append(chat_id)
+            new_rows.append((chat_id, slot))
+        if new_rows: self.db.executemany("INSERT OR REPLACE INTO reminder_subscriptions (chat_id, water_slot) VALUES (?, ?)", new_rows)
+        return len(new_rows)
+
+    def unsubscribe(self, chat_id):
+        chat_id = int(chat_id)
+        slot = self._slot_of.pop(chat_id, None)
+        if slot is None: return
+        members = self._slots[slot]
+        members.pop(members.index(chat_id))
+        self.db.execute("DELETE FROM reminder_subscriptions WHERE chat_id = ?", (chat_id,))
+
+    def water_recipients(self, slot):
+        return array("q", self._slots[slot])
+
+    def subscribers(self):
+        return list(self._slot_of)
+
+    def __len__(self):
+        return len(self._slot_of)
+
+
+async def send_batched(send, chat_ids, batch_size=25, pause=1.0):
+    """Вызывает send(chat_id) пачками по batch_size с паузой между пачками. Возвращает число успешных отправок."""
+    sent = 0
+    for start in range(0, len(chat_ids), batch_size):
+        results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids[start:start + batch_size]), return_exceptions=True)
+        sent += sum(1 for r in results if not isinstance(r, BaseException))
+        if start + batch_size < len(chat_ids): await asyncio.sleep(pause)
+    return sent
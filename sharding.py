@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import zlib
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from logs import fields
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(chat_id, count):
+    """Номер воркера, которому принадлежит чат. Хэш стабилен между процессами и перезапусками."""
+    return zlib.crc32(str(int(chat_id)).encode("ascii")) % count
+
+
+def update_chat_id(update):
+    """Чат апдейта, а для апдейтов без чата — пользователь; None, если нет ни того, ни другого."""
+    if update.effective_chat is not None: return update.effective_chat.id
+    if update.effective_user is not None: return update.effective_user.id
+    return None
+
+
+class WorkerShard:
+    """Доля чатов одного воркера при запуске нескольких процессов бота.
+
+    Каждый чат закреплен за одним воркером по хэшу chat_id: только владелец
+    обрабатывает его апдейты, держит в памяти его состояние и рассылает ему
+    напоминания. Все воркеры должны быть запущены с одинаковым count.
+    """
+
+    def __init__(self, index=0, count=1):
+        if count < 1 or not 0 <= index < count: raise ValueError(f"Неверный номер воркера {index} из {count}")
+        self.index = index
+        self.count = count
+
+    @property
+    def primary(self):
+        """Первый воркер выполняет общие для всех задачи: миграции и обслуживание базы."""
+        return self.index == 0
+
+    def owner(self, chat_id):
+        return shard_of(chat_id, self.count) if self.count > 1 else 0
+
+    def owns(self, chat_id):
+        return self.count == 1 or shard_of(chat_id, self.count) == self.index
+
+    def __repr__(self):
+        return f"WorkerShard({self.index}/{self.count})"
+
+
+class UpdateForwarder:
+    """Пересылает чужие апдейты воркеру-владельцу на его вебхук, как это сделал бы сам Telegram."""
+
+    def __init__(self, shard: WorkerShard, worker_urls, secret_token=None, timeout=10.0):
+        if len(worker_urls) != shard.count: raise ValueError(f"Нужно {shard.count} адресов воркеров, задано {len(worker_urls)}")
+        self.shard = shard
+        self.worker_urls = list(worker_urls)
+        self.headers = {"X-Telegram-Bot-Api-Secret-Token": secret_token} if secret_token else {}
+        self.timeout = timeout
+        self._client = None
+        self.forwarded = 0
+        self.failed = 0
+
+    async def forward(self, update: Update) -> bool:
+        """True, если владелец принял апдейт; иначе его нужно обработать здесь."""
+        if self._client is None: self._client = httpx.AsyncClient(timeout=self.timeout)
+        url = self.worker_urls[self.shard.owner(update_chat_id(update))]
+        try:
+            response = await self._client.post(url, json=update.to_dict(), headers=self.headers)
+        except httpx.HTTPError as e:
+            logger.warning("Не удалось переслать апдейт владельцу", extra=fields(update_id=update.update_id, url=url, error=str(e)))
+            self.failed += 1; return False
+        if response.status_code != 200:
+            logger.warning("Владелец не принял апдейт", extra=fields(update_id=update.update_id, url=url, status=response.status_code))
+            self.failed += 1; return False
+        self.forwarded += 1
+        return True
+
+    async def close(self):
+        if self._client is not None: await self._client.aclose(); self._client = None
+
+    def stats(self):
+        return {"forwarded": self.forwarded, "failed": self.failed}
+
+
+class ShardedApplication(Application):
+    """Application, который обрабатывает только апдейты своих чатов, а остальные пересылает владельцу.
+
+    Пересылка происходит до построения контекста, поэтому воркер не
+    загружает и не сохраняет user_data чужих чатов. Если владелец
+    недоступен, апдейт обрабатывается на месте, чтобы не потерять его.
+    """
+
+    def __init__(self, *, forwarder: UpdateForwarder = None, **kwargs):
+        super().__init__(**kwargs)
+        self.forwarder = forwarder
+
+    async def process_update(self, update: object) -> None:
+        if self.forwarder is not None and isinstance(update, Update):
+            chat_id = update_chat_id(update)
+            if chat_id is not None and not self.forwarder.shard.owns(chat_id) and await self.forwarder.forward(update): return
+        await super().process_update(update)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает до max_concurrent_updates апдейтов одновременно, но апдейты одного чата — по очереди.
+
+    Обработчики ведут диалог через context.user_data (шаг анкеты, ожидаемый
+    ввод), поэтому два сообщения одного чата нельзя обрабатывать параллельно.
+    Апдейты разных чатов друг друга не ждут: пока один чат ждет Gemini,
+    остальные обслуживаются. Апдейт, ждущий свой чат, занимает место в
+    max_concurrent_updates, поэтому лимит берется с запасом.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}  # chat_id -> [asyncio.Lock, апдейтов в работе и в очереди]
+        self.waited = 0
+
+    async def do_process_update(self, update, coroutine) -> None:
+        chat_id = update_chat_id(update) if isinstance(update, Update) else None
+        if chat_id is None: await coroutine; return
+        entry = self._chats.get(chat_id)
+        if entry is None: entry = self._chats[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            if entry[0].locked(): self.waited += 1
+            async with entry[0]: await coroutine  # asyncio.Lock отдает блокировку в порядке очереди
+        finally:
+            entry[1] -= 1
+            if not entry[1]: del self._chats[chat_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self):
+        return {"in_progress": self.current_concurrent_updates, "chats": len(self._chats), "waited": self.waited}
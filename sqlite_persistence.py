@@ -0,0 +1,188 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import pickle
+import zlib
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import Database
+from logs import fields
+
+logger = logging.getLogger(__name__)
+
+USER, CHAT, BOT, CALLBACK, CONVERSATION = "user", "chat", "bot", "callback", "conversation:"
+
+
+def _dumps(obj):
+    # Меню с рецептами хорошо сжимаются: строка становится в 3–4 раза меньше
+    return zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 1)
+
+
+def _loads(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для Application поверх общей базы SQLite.
+
+    В отличие от PicklePersistence, которая при каждом сохранении заново
+    пишет данные всех пользователей в один файл, здесь каждая запись
+    user_data/chat_data — отдельная строка. Application передаёт на
+    сохранение только изменённых пользователей, и они пишутся пачкой в одной
+    транзакции вне event loop. user_data и chat_data загружаются лениво:
+    при старте ничего не читается, строка пользователя подгружается при
+    первом его апдейте (через refresh_user_data).
+    """
+
+    def __init__(self, db: Database, store_data: PersistenceInput = None, update_interval=60):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.db = db
+        self.db.execute("CREATE TABLE IF NOT EXISTS persistence (kind TEXT NOT NULL, key TEXT NOT NULL, data BLOB NOT NULL, PRIMARY KEY (kind, key)) WITHOUT ROWID")
+        self._loaded = {USER: set(), CHAT: set()}
+        self._last_bot_data = None
+        self._last_callback_data = None
+        self._pending = {}  # (kind, key) -> объект для записи или None для удаления
+        self._batch = None
+        self.rows_written = 0
+
+    # --- Чтение ---
+
+    def _read(self, kind, key):
+        row = self.db.execute("SELECT data FROM persistence WHERE kind = ? AND key = ?", (kind, str(key))).fetchone()
+        return _loads(row[0]) if row else None
+
+    def stored_user_data(self, batch=1000):
+        """Все сохраненные user_data пачками по batch строк: пары (user_id, данные). Для обслуживания базы вне event loop."""
+        last = ""
+        while True:
+            rows = self.db.execute("SELECT key, data FROM persistence WHERE kind = ? AND key > ? ORDER BY key LIMIT ?", (USER, last, batch)).fetchall()
+            for key, data in rows: yield key, _loads(data)
+            if len(rows) < batch: return
+            last = rows[-1][0]
+
+    def _merge_stored(self, kind, key, data):
+        # Дополняем словарь сохранёнными значениями; то, что уже записано в памяти, важнее
+        stored = self._read(kind, key)
+        if stored:
+            for name, value in stored.items(): data.setdefault(name, value)
+
+    def _ensure_loaded(self, kind, key, data):
+        if key in self._loaded[kind]: return
+        self._loaded[kind].add(key)
+        self._merge_stored(kind, key, data)
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        data = self._read(BOT, "")
+        self._last_bot_data = _dumps(data) if data is not None else None
+        return data if data is not None else {}
+
+    async def get_callback_data(self):
+        return self._read(CALLBACK, "")
+
+    async def get_conversations(self, name):
+        rows = self.db.execute("SELECT key, data FROM persistence WHERE kind = ?", (CONVERSATION + name,)).fetchall()
+        return {tuple(json.loads(key)): _loads(data) for key, data in rows}
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._ensure_loaded(USER, user_id, user_data)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        self._ensure_loaded(CHAT, chat_id, chat_data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- Запись ---
+
+    def _write(self, items):
+        upserts = [(kind, key, _dumps(obj)) for (kind, key), obj in items if obj is not None]
+        deletes = [(kind, key) for (kind, key), obj in items if obj is None]
+        with self.db.transaction() as conn:
+            if upserts: conn.executemany("INSERT OR REPLACE INTO persistence (kind, key, data) VALUES (?, ?, ?)", upserts)
+            if deletes: conn.executemany("DELETE FROM persistence WHERE kind = ? AND key = ?", deletes)
+        self.rows_written += len(items)
+
+    async def _write_pending(self):
+        # Даём остальным update_* из того же прохода update_persistence встать в очередь
+        await asyncio.sleep(0)
+        self._batch = None
+        items, self._pending = list(self._pending.items()), {}
+        try:
+            await asyncio.to_thread(self._write, items)
+        except Exception:
+            for item_key, obj in items: self._pending.setdefault(item_key, obj)
+            raise
+
+    async def _queue(self, kind, key, obj):
+        # Application присылает глубокие копии, поэтому сериализовать их в потоке безопасно
+        self._pending[(kind, str(key))] = obj
+        if self._batch is None: self._batch = asyncio.ensure_future(self._write_pending())
+        await asyncio.shield(self._batch)
+
+    async def update_user_data(self, user_id, data):
+        # Данные пользователя, не загруженного через refresh, не должны затереть сохранённые
+        if user_id not in self._loaded[USER]: self._merge_stored(USER, user_id, data)
+        await self._queue(USER, user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        if chat_id not in self._loaded[CHAT]: self._merge_stored(CHAT, chat_id, data)
+        await self._queue(CHAT, chat_id, data)
+
+    async def update_bot_data(self, data):
+        # bot_data приходит на каждом проходе; пишем только если он изменился
+        dumped = _dumps(data)
+        if dumped == self._last_bot_data: return
+        self._last_bot_data = dumped
+        await self._queue(BOT, "", data)
+
+    async def update_callback_data(self, data):
+        dumped = _dumps(data)
+        if dumped == self._last_callback_data: return
+        self._last_callback_data = dumped
+        await self._queue(CALLBACK, "", data)
+
+    async def update_conversation(self, name, key, new_state):
+        await self._queue(CONVERSATION + name, json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._loaded[USER].discard(user_id)
+        await self._queue(USER, user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._loaded[CHAT].discard(chat_id)
+        await self._queue(CHAT, chat_id, None)
+
+    async def flush(self):
+        if self._batch is not None: await asyncio.shield(self._batch)
+        if self._pending:
+            items, self._pending = list(self._pending.items()), {}
+            await asyncio.to_thread(self._write, items)
+
+    # --- Перенос со старого формата ---
+
+    def migrate_pickle(self, filepath):
+        """Однократный перенос данных из файла PicklePersistence. Возвращает число перенесённых записей."""
+        if self.db.get_meta("pickle_migrated") or not os.path.exists(filepath):
+            return 0
+        try:
+            with open(filepath, "rb") as f: data = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, OSError) as e:
+            logger.warning("Не удалось прочитать файл", extra=fields(path=filepath, error=str(e))); return 0
+        items = [((USER, str(k)), v) for k, v in (data.get("user_data") or {}).items()]
+        items += [((CHAT, str(k)), v) for k, v in (data.get("chat_data") or {}).items()]
+        if data.get("bot_data"): items.append(((BOT, ""), data["bot_data"]))
+        if data.get("callback_data"): items.append(((CALLBACK, ""), data["callback_data"]))
+        for name, states in (data.get("conversations") or {}).items():
+            items += [((CONVERSATION + name, json.dumps(list(key))), state) for key, state in states.items()]
+        if items: self._write(items)
+        self.db.set_meta("pickle_migrated", datetime.datetime.now().isoformat())
+        return len(items)
@@ -0,0 +1,104 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from db import LOOP_BUSY_TIMEOUT, Database, retry_busy
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "bot.db")
+    db = Database(path)
+    db.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value TEXT)")
+    db.close()
+    return path
+
+
+def hold_write_lock(db, started, seconds):
+    with db.transaction(immediate=True) as conn:
+        conn.execute("INSERT INTO items (value) VALUES ('фон')")
+        started.set(); time.sleep(seconds)
+
+
+def test_background_transaction_does_not_block_event_loop(path):
+    db = Database(path)
+    started = threading.Event()
+    thread = threading.Thread(target=hold_write_lock, args=(db, started, 1.0)); thread.start()
+    started.wait()
+
+    async def read():
+        t0 = time.perf_counter()
+        db.execute("SELECT COUNT(*) FROM items").fetchone()
+        return time.perf_counter() - t0
+
+    assert asyncio.run(read()) < 0.2
+    thread.join(); db.close()
+
+
+def test_single_event_loop_attempt_waits_only_loop_busy_timeout(path):
+    db, other_process = Database(path), Database(path)
+    started = threading.Event()
+    thread = threading.Thread(target=hold_write_lock, args=(other_process, started, 2.0)); thread.start()
+    started.wait()
+
+    async def write():
+        t0 = time.perf_counter()
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("INSERT INTO items (value) VALUES ('обработчик')")
+        return time.perf_counter() - t0
+
+    assert asyncio.run(write()) < LOOP_BUSY_TIMEOUT + 0.5
+    # Вне event loop запись дожидается освобождения блокировки
+    db.execute("INSERT INTO items (value) VALUES ('скрипт')")
+    thread.join()
+    assert db.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 2
+    db.close(); other_process.close()
+
+
+def test_retry_busy_waits_out_lock_without_blocking_loop(path):
+    db, other_process = Database(path), Database(path)
+    started = threading.Event()
+    thread = threading.Thread(target=hold_write_lock, args=(other_process, started, 1.0)); thread.start()
+    started.wait()
+
+    async def write():
+        loop = asyncio.get_running_loop()
+        gaps, last = [], loop.time()
+
+        async def tick():
+            nonlocal last
+            while True:
+                await asyncio.sleep(0.01); now = loop.time(); gaps.append(now - last); last = now
+
+        ticker = asyncio.create_task(tick())
+        await retry_busy(db.execute, "INSERT INTO items (value) VALUES ('обработчик')")
+        ticker.cancel()
+        return max(gaps)
+
+    assert asyncio.run(write()) < LOOP_BUSY_TIMEOUT + 0.15
+    thread.join()
+    assert db.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 2
+    db.close(); other_process.close()
+
+
+def test_retry_busy_gives_up_after_timeout(path):
+    db, other_process = Database(path), Database(path)
+    started = threading.Event()
+    thread = threading.Thread(target=hold_write_lock, args=(other_process, started, 1.5)); thread.start()
+    started.wait()
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(retry_busy(db.execute, "INSERT INTO items (value) VALUES ('обработчик')", timeout=0.3))
+    thread.join()
+    db.close(); other_process.close()
+
+
+def test_transaction_rolls_back_on_error(path):
+    db = Database(path)
+    with pytest.raises(ValueError):
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO items (value) VALUES ('x')"); raise ValueError
+    assert db.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0
+    db.close()
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from food_index import FoodIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def index():
+    return FoodIndex().load(os.path.join(ROOT, "data", "food_composition.json"))
+
+
+@pytest.mark.parametrize("line", [
+    "вино 150 мл",  # не «виноград» по префиксу
+    "картофель фри 150г",  # не «картофель»: «фри» ничем не покрыто
+    "салат 200г",  # не «листья салата»
+    "сырок 1 шт",  # не «сыр твердый» по основе
+    "творожок",  # не «творог 5%»
+    "суп",
+    "масло",
+    "каша",
+    "бананн 1",  # опечатки тоже решает Gemini
+])
+def test_uncertain_lines_go_to_gemini(index, line):
+    assert index.resolve(line) is None
+
+
+@pytest.mark.parametrize("line, calories", [
+    ("овсянка 50г", 176),
+    ("2 яйца", 173),
+    ("куриную грудку 150 гр", 170),
+    ("творога 200г", 242),
+    ("помидоры 200г", 40),
+    ("молоко 2,5% 250 мл", 130),
+    ("банан", 115),
+])
+def test_confident_lines_resolve_locally(index, line, calories):
+    assert round(index.resolve(line)["calories"]) == calories
+
+
+
+def test_find_matches_only_whole_names(index):
+    assert index.find("куриную грудку").name == index.find("куриная грудка").name
+    assert index.find("бананн") is None and index.find("греч") is None
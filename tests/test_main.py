@@ -0,0 +1,180 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+import db
+import main
+from db import Database
+from food_cache import NutritionCache
+from food_index import FoodIndex
+from meal_store import MealStore
+from menu_pool import MenuPool
+from weight_store import WeightStore
+
+
+class FakeGateway:
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def generate_json(self, prompt, label="llm", **kwargs):
+        return self.reply
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test")
+    monkeypatch.setattr(main, "nutrition_cache", NutritionCache())
+    monkeypatch.setattr(main, "food_index", FoodIndex())
+    return lambda reply: monkeypatch.setattr(main, "llm_gateway", FakeGateway(reply))
+
+
+def test_malformed_food_response_caches_nothing(llm):
+    llm([{"calories": 100, "protein": 1, "fat": 2, "carbs": 3}, {"calories": "много"}])
+    assert asyncio.run(main.calculate_calories_from_food_list_llm(1, ["квашеная репа", "морошка"])) is None
+    assert len(main.nutrition_cache) == 0
+
+
+def test_valid_food_response_is_cached(llm):
+    llm([{"calories": 100, "protein": 1, "fat": 2, "carbs": 3}, {"calories": 50}])
+    totals = asyncio.run(main.calculate_calories_from_food_list_llm(1, ["квашеная репа", "морошка"]))
+    assert totals == {"calories": 150, "protein": 1, "fat": 2, "carbs": 3}
+    assert main.nutrition_cache.get("морошка")["calories"] == 50
+
+
+def test_menu_pool_demand_pass_yields_to_handlers(monkeypatch):
+    async def no_targets(user_id): return None, None, None, None
+    monkeypatch.setattr(main, "user_profiles_data", {str(i): {} for i in range(10 * main.MENU_POOL_DEMAND_BATCH)})
+    monkeypatch.setattr(main, "calculate_target_calories_and_pfc", no_targets)
+
+    async def scenario():
+        ticks = 0
+
+        async def handler():
+            nonlocal ticks
+            while True: ticks += 1; await asyncio.sleep(0)
+
+        task = asyncio.create_task(handler()); await asyncio.sleep(0)
+        await main.fill_menu_pool_job(None)
+        task.cancel()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 10
+
+
+def day(*dishes):
+    return {"weekly_plan": [{"day_name": "День", "meals": [{"meal_name": dish, "recipe": "-"} for dish in dishes]}]}
+
+
+async def noop(*args, **kwargs):
+    pass
+
+
+def test_duplicate_day_regenerates_without_holding_ready_days(monkeypatch, tmp_path):
+    # Второй день повторяет первый и перегенерируется долго; третий готов раньше и не должен его ждать
+    replies = iter([(0.01, day("омлет")), (0.02, day("омлет")), (0.05, day("суп"))])
+
+    async def generate_menu_day(profile, calories, pfc, avoid_meals=None):
+        delay, reply = (0.2, day("каша")) if avoid_meals else next(replies)
+        await asyncio.sleep(delay)
+        return reply
+
+    async def targets(user_id): return 2000, 100, 60, 250
+    sent = []
+
+    async def send_day_menu(context, chat_id, index, menu_day): sent.append(main.day_meals(main.meal_store, menu_day)[0][1]["meal_name"])
+    monkeypatch.setattr(main, "generate_menu_day", generate_menu_day)
+    monkeypatch.setattr(main, "calculate_target_calories_and_pfc", targets)
+    monkeypatch.setattr(main, "send_day_menu", send_day_menu)
+    monkeypatch.setattr(main, "meal_store", MealStore(Database(str(tmp_path / "bot.db"))))
+    monkeypatch.setattr(main, "menu_pool", MenuPool())
+    monkeypatch.setattr(main, "replacement_prefetcher", SimpleNamespace(clear_user=lambda user_id: None, schedule=lambda *args: None))
+    monkeypatch.setattr(main, "user_profiles_data", {"7": {}})
+    query = SimpleNamespace(message=SimpleNamespace(chat=SimpleNamespace(id=7)), from_user=SimpleNamespace(id=7), send_message=noop)
+    context = SimpleNamespace(bot=SimpleNamespace(send_message=noop), user_data={})
+    asyncio.run(main.generate_and_send_menu(query, context, 3))
+    assert sent == ["омлет", "суп", "каша"]
+
+
+class FakeProfiles(dict):
+    def mark_dirty(self, chat_id):
+        self.dirty = chat_id
+
+
+def command(chat_id, *args):
+    replies = []
+
+    async def reply_text(text, **kwargs): replies.append(text)
+    update = SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id), message=SimpleNamespace(reply_text=reply_text))
+    return update, SimpleNamespace(args=list(args)), replies
+
+
+def test_goal_command_sets_and_clears_goal(monkeypatch):
+    profiles = FakeProfiles({"5": {"height": 170}})
+    monkeypatch.setattr(main, "user_profiles_data", profiles)
+    for args, goal in [(("72,5",), 72.5), (("5",), 72.5), ((), 72.5), (("0",), None)]:
+        update, context, replies = command(5, *args)
+        asyncio.run(main.goal_command(update, context))
+        assert profiles["5"].get("goal_weight") == goal and replies
+    assert profiles.dirty == "5"
+
+
+def hold_write_lock(path, started, seconds):
+    other_process = Database(path)
+    with other_process.transaction(immediate=True):
+        started.set(); time.sleep(seconds)
+    other_process.close()
+
+
+def weigh_in(chat_id, text):
+    replies = []
+
+    async def reply_text(text, **kwargs): replies.append(text)
+    update = SimpleNamespace(message=SimpleNamespace(text=text, reply_text=reply_text),
+                             effective_chat=SimpleNamespace(id=chat_id), effective_user=SimpleNamespace(id=chat_id))
+    return update, SimpleNamespace(user_data={}), replies
+
+
+@pytest.fixture
+def locked_store(monkeypatch, tmp_path):
+    path = str(tmp_path / "bot.db")
+    store = WeightStore(Database(path))
+    monkeypatch.setattr(main, "weight_store", store)
+
+    def lock(seconds):
+        started = threading.Event()
+        thread = threading.Thread(target=hold_write_lock, args=(path, started, seconds)); thread.start()
+        started.wait()
+        return thread
+    return store, lock
+
+
+def test_weigh_in_waits_out_a_busy_database(locked_store):
+    store, lock = locked_store
+    thread = lock(1.0)  # дольше LOOP_BUSY_TIMEOUT: раньше запись терялась
+    update, context, replies = weigh_in(8, "Вес 81,5")
+    asyncio.run(main.handle_text_messages(update, context))
+    thread.join()
+    assert replies == ["✅ Вес сохранён: 81.5 кг"] and store.latest(8) == 81.5
+
+
+def test_user_is_told_when_database_stays_busy(locked_store, monkeypatch):
+    store, lock = locked_store
+    monkeypatch.setattr(db, "LOOP_WRITE_TIMEOUT", 0.3)
+    thread = lock(1.5)
+    update, context, replies = weigh_in(8, "Вес 81,5")
+    with pytest.raises(sqlite3.OperationalError) as failure:
+        asyncio.run(main.handle_text_messages(update, context))
+    thread.join()
+    assert replies == [] and store.latest(8) is None
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs): sent.append((chat_id, text))
+    message = {"message_id": 1, "date": 0, "text": "Вес 81,5", "chat": {"id": 8, "type": "private"}}
+    error_context = SimpleNamespace(error=failure.value, job=None, bot=SimpleNamespace(send_message=send_message))
+    asyncio.run(main.log_handler_error(Update.de_json({"update_id": 1, "message": message}, None), error_context))
+    assert sent and sent[0][0] == 8 and "не удалось сохранить" in sent[0][1].lower()
@@ -0,0 +1,47 @@
+import datetime
+
+import pytest
+
+from db import Database
+from meal_store import MealStore, menu_meal_ids
+
+DAY = datetime.date(2026, 10, 1)
+NEXT_DAY = DAY + datetime.timedelta(days=1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    yield db
+    db.close()
+
+
+def meal(name):
+    return {"meal_name": name, "recipe": f"Рецепт: {name}"}
+
+
+def test_unreferenced_meal_is_removed_on_a_later_pass(db):
+    store = MealStore(db)
+    kept, dropped = store.put_many([meal("Омлет"), meal("Суп")])
+    assert store.prune({kept}, today=DAY) == 0  # сначала только пометка
+    assert store.prune({kept}, today=DAY) == 0  # второй проход в тот же день ничего не удаляет
+    assert store.prune({kept}, today=NEXT_DAY) == 1
+    assert len(store) == 1 and store.get(dropped) is None and store.get(kept) == meal("Омлет")
+
+
+def test_reused_meal_survives_and_pruned_meal_is_stored_again(db):
+    store = MealStore(db)
+    revived, dropped = store.put_many([meal("Омлет"), meal("Суп")])
+    store.prune(set(), today=DAY)
+    store.put(meal("Омлет"))  # снова попало в меню до следующего прохода
+    assert store.prune(set(), today=NEXT_DAY) == 1
+    assert store.get(revived) is not None
+    # Блюдо из пула выдают снова уже после удаления: оно должно вернуться в базу, а не только в кэш
+    assert store.put(meal("Суп")) == dropped
+    assert MealStore(db).get(dropped) == meal("Суп")
+
+
+def test_menu_meal_ids():
+    assert menu_meal_ids({"days": [{"meal_ids": ["a", "b"]}, {"meal_ids": ["c"]}]}) == ["a", "b", "c"]
+    assert menu_meal_ids({"weekly_plan": [{"meals": [meal("Омлет")]}]}) == []
+    assert menu_meal_ids(None) == []
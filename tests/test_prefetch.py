@@ -0,0 +1,85 @@
+import asyncio
+
+from prefetch import ReplacementPrefetcher
+
+
+class FakeGenerator:
+    def __init__(self, delay=0.01, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    async def __call__(self, user_id, meal, avoid_names):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return None if self.fail else {"meal_name": f"Замена {self.calls}"}
+
+
+MEAL = {"meal_name": "Омлет"}
+
+
+def test_concurrent_takes_for_same_meal_both_get_replacement():
+    async def scenario():
+        generate = FakeGenerator()
+        prefetcher = ReplacementPrefetcher(generate)
+        first, second = await asyncio.gather(prefetcher.take(1, "d1:breakfast", MEAL), prefetcher.take(1, "d1:breakfast", MEAL))
+        assert first and second and first != second
+        assert generate.calls == 2
+        assert prefetcher.stats()["misses"] == 1 and prefetcher.stats()["joined"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_take_joins_prefetch_in_progress():
+    async def scenario():
+        generate = FakeGenerator()
+        prefetcher = ReplacementPrefetcher(generate, per_meal=2)
+        prefetcher.schedule(1, [("d1:lunch", MEAL)])
+        taken = await asyncio.gather(*(prefetcher.take(1, "d1:lunch", MEAL) for _ in range(3)))
+        assert len({meal["meal_name"] for meal in taken}) == 3
+        assert generate.calls == 3
+
+    asyncio.run(scenario())
+
+
+def test_failed_generation_is_not_retried_by_waiters():
+    async def scenario():
+        generate = FakeGenerator(fail=True)
+        prefetcher = ReplacementPrefetcher(generate)
+        assert await asyncio.gather(prefetcher.take(1, "d1:dinner", MEAL), prefetcher.take(1, "d1:dinner", MEAL)) == [None, None]
+        assert generate.calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_tap_does_not_queue_behind_background_prefetches():
+    async def scenario():
+        generate = FakeGenerator(delay=0.05)
+        prefetcher = ReplacementPrefetcher(generate, background_concurrency=1)
+        prefetcher.schedule(1, [(f"d{day}:lunch", MEAL) for day in range(1, 8)])
+        loop = asyncio.get_running_loop(); started = loop.time()
+        assert await prefetcher.take(1, "d9:lunch", MEAL)  # промах: своя генерация вне очереди
+        assert await prefetcher.take(1, "d7:lunch", MEAL)  # фоновая генерация в конце очереди выходит из нее
+        assert loop.time() - started < 0.2
+        assert prefetcher.stats()["misses"] == 1 and prefetcher.stats()["joined"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_background_prefetches_respect_their_cap():
+    async def scenario():
+        active, peak = 0, 0
+
+        async def generate(user_id, meal, avoid_names):
+            nonlocal active, peak
+            active += 1; peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return {"meal_name": f"Замена {user_id}"}
+
+        prefetcher = ReplacementPrefetcher(generate, background_concurrency=2)
+        for user_id in range(5): prefetcher.schedule(user_id, [("d1:lunch", MEAL), ("d1:dinner", MEAL)])
+        while prefetcher.stats()["in_flight"]: await asyncio.sleep(0.01)
+        assert peak == 2 and prefetcher.stats()["prefetched"] == 10
+
+    asyncio.run(scenario())
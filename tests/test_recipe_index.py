@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from db import Database
+from recipe_index import RecipeIndex, canonical_ingredients
+
+PRODUCTS = ["яйца", "лук", "морковь", "картофель", "молоко", "сыр", "помидоры", "чеснок", "куриное филе", "рис",
+            "гречка", "огурцы", "сметана", "творог", "капуста", "говядина", "фасоль", "кабачок", "тыква", "шпинат"]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    yield db
+    db.close()
+
+
+def recipe(name, *ingredients):
+    return {"dish_name": name, "ingredients_used": list(ingredients), "recipe_steps": ["Шаг 1"]}
+
+
+def brute_force(index, available, skip=()):
+    # Тот же порядок, что в RecipeIndex.match, но по всем рецептам
+    best = None
+    for recipe_id, ingredients in index._ingredients.items():
+        missing = ingredients - available
+        if recipe_id in skip or len(missing) > 1 or (missing and not index._allows_missing(len(ingredients))): continue
+        rank = (not missing, len(ingredients), recipe_id)
+        if best is None or rank > best[0]: best = (rank, recipe_id, missing)
+    return best and (best[1], best[2])
+
+
+def test_match_agrees_with_full_scan(db):
+    rng = random.Random(7)
+    index = RecipeIndex(db, max_candidates=10 ** 9)
+    for i in range(2000): index.add(recipe(f"Блюдо {i}", *rng.sample(PRODUCTS, rng.randint(2, 7))))
+    reloaded = RecipeIndex(db, max_candidates=10 ** 9)
+    for _ in range(300):
+        available = canonical_ingredients(rng.sample(PRODUCTS, rng.randint(3, 10)))
+        skip = set(rng.sample(sorted(index._ingredients), 50))
+        assert index.match(available, skip=skip) == brute_force(index, available, skip)
+        assert reloaded.match(available) == brute_force(index, available)
+
+
+def test_find_prefers_complete_recipe_and_respects_exclusions(db):
+    index = RecipeIndex(db)
+    omelette = index.add(recipe("Омлет", "яйца 3 шт", "молоко 100 мл", "сыр"))
+    frittata = index.add(recipe("Фриттата", "яйца", "молоко", "сыр", "шпинат", "помидоры"))
+    assert index.find("яйца, молоко, сыр, помидоры")[0] == omelette  # полный рецепт лучше рецепта без одного продукта
+    assert index.find("яйца, молоко, сыр, помидоры, шпинат")[0] == frittata
+    found_id, found, missing = index.find("молоко, сыр, помидоры, шпинат")
+    assert (found_id, found["dish_name"], missing) == (frittata, "Фриттата", ["яйца"])
+    assert index.find("яйца, молоко, сыр, помидоры, шпинат", exclusions=["шпинат"])[0] == omelette
+    assert index.find("яйца, молоко, сыр", skip=[omelette]) is None
@@ -0,0 +1,64 @@
+import asyncio
+
+from telegram import Update
+
+from sharding import ChatOrderedUpdateProcessor
+
+
+def make_update(update_id, chat_id):
+    return Update.de_json({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": "привет",
+        "chat": {"id": chat_id, "type": "private"}, "from": {"id": chat_id, "is_bot": False, "first_name": "Тест"}}}, None)
+
+
+async def run_all(processor, updates, handle):
+    await asyncio.gather(*(processor.process_update(update, handle(update)) for update in updates))
+
+
+def test_same_chat_updates_run_in_order_one_at_a_time():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(8)
+        events = []
+
+        async def handle(update):
+            events.append(("start", update.update_id)); await asyncio.sleep(0.01); events.append(("end", update.update_id))
+
+        await run_all(processor, [make_update(i, 1) for i in range(4)], handle)
+        assert events == [(kind, i) for i in range(4) for kind in ("start", "end")]
+        assert processor.stats() == {"in_progress": 0, "chats": 0, "waited": 3}
+
+    asyncio.run(scenario())
+
+
+def test_different_chats_overlap():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(8)
+        active, peak = 0, 0
+
+        async def handle(update):
+            nonlocal active, peak
+            active += 1; peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+        await run_all(processor, [make_update(i, 100 + i) for i in range(4)], handle)
+        assert peak == 4
+        assert processor.stats()["waited"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_update_releases_chat():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(8)
+        handled = []
+
+        async def handle(update):
+            if update.update_id == 0: raise RuntimeError("сбой обработчика")
+            handled.append(update.update_id)
+
+        results = await asyncio.gather(*(processor.process_update(update, handle(update)) for update in [make_update(0, 1), make_update(1, 1)]), return_exceptions=True)
+        assert isinstance(results[0], RuntimeError) and handled == [1]
+        assert processor.stats()["chats"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+import datetime
+import json
+
+import pytest
+
+from db import Database
+from weight_store import WeightStore
+from weight_trend import WeightTrend
+
+
+def days(count, start=datetime.date(2024, 1, 1)):
+    return [(start + datetime.timedelta(days=i)).isoformat() for i in range(count)]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / "bot.db"))
+    yield db
+    db.close()
+
+
+def full_trend(store, chat_id):
+    return WeightTrend.from_series(store.series(chat_id)).to_dict()
+
+
+def test_trend_follows_saves(db):
+    store = WeightStore(db)
+    for i, day in enumerate(days(40)): store.save(1, 80 - i * 0.1, day)
+    store.save(1, 75.0, days(40)[-1])  # замена последнего дня
+    assert store.trend(1).to_dict() == full_trend(store, "1")
+
+
+def test_trend_replays_saves_after_checkpoint(db):
+    store = WeightStore(db)
+    for i, day in enumerate(days(20)): store.save(1, 80 - i * 0.1, day)
+    store.trend(1); store.flush_trends()
+    for i, day in enumerate(days(10, datetime.date(2024, 1, 20))): store.save(1, 78 - i * 0.1, day)
+    # Перезапуск без flush_trends: точка в базе отстала на 10 дней
+    assert WeightStore(db).trend(1).to_dict() == full_trend(store, "1")
+
+
+def test_backdated_save_rebuilds_trend(db):
+    store = WeightStore(db)
+    for i, day in enumerate(days(10)): store.save(1, 80 - i * 0.1, day)
+    store.save(1, 90.0, days(10)[3])
+    assert store.trend(1).to_dict() == full_trend(store, "1")
+    assert WeightStore(db).trend(1).to_dict() == full_trend(store, "1")
+
+
+def test_legacy_users_get_trends_on_start(db):
+    db.execute("CREATE TABLE weights (chat_id TEXT NOT NULL, day TEXT NOT NULL, weight REAL NOT NULL, PRIMARY KEY (chat_id, day)) WITHOUT ROWID")
+    db.executemany("INSERT INTO weights VALUES (?, ?, ?)", [(str(u), day, 70.0 + u) for u in range(3) for day in days(30)])
+    store = WeightStore(db)
+    assert db.execute("SELECT COUNT(*) FROM weight_trends").fetchone()[0] == 3
+    assert store.trend(2).to_dict() == full_trend(store, "2")
+
+
+def test_import_rebuilds_only_imported_users(db, tmp_path):
+    store = WeightStore(db)
+    store.save(1, 80.0, "2024-02-01"); store.save(2, 60.0, "2024-02-01")
+    store.trend(1); store.trend(2); store.flush_trends()
+    kept = db.execute("SELECT data FROM weight_trends WHERE chat_id = '2'").fetchone()[0]
+    path = tmp_path / "weight_log.json"
+    path.write_text(json.dumps({"1": {day: 82.0 for day in days(10)}}), encoding="utf-8")
+    assert store.import_json(str(path)) == 10
+    assert store.trend(1).count == 11
+    assert store.trend(1).to_dict() == full_trend(store, "1")
+    assert db.execute("SELECT data FROM weight_trends WHERE chat_id = '2'").fetchone()[0] == kept
@@ -0,0 +1,92 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+
+from logs import fields
+from metrics import CONTENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+
+def _token_matches(expected, given):
+    return given is not None and hmac.compare_digest(expected.encode(), given.encode())
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Принимает апдейты от Telegram (и от других воркеров) и ставит их в очередь Application."""
+
+    SUPPORTED_METHODS = ("POST",)
+
+    def initialize(self, bot_app, secret_token=None):
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and not _token_matches(self.secret_token, self.request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+            raise tornado.web.HTTPError(403)
+        try:
+            update = Update.de_json(json.loads(self.request.body), self.bot_app.bot)
+        except Exception as e:
+            logger.warning("Некорректный апдейт на вебхуке", extra=fields(error=str(e), size=len(self.request.body)))
+            raise tornado.web.HTTPError(400)
+        if update is not None:
+            self.bot_app.bot.insert_callback_data(update)
+            await self.bot_app.update_queue.put(update)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Метрики в текстовом формате Prometheus. Если задан token, нужен заголовок Authorization: Bearer <token>."""
+
+    SUPPORTED_METHODS = ("GET",)
+
+    def initialize(self, registry, token=None):
+        self.registry = registry
+        self.token = token
+
+    def get(self):
+        if self.token and not _token_matches(f"Bearer {self.token}", self.request.headers.get("Authorization")):
+            raise tornado.web.HTTPError(401)
+        self.set_header("Content-Type", CONTENT_TYPE)
+        self.write(self.registry.render())
+
+
+def make_web_app(application, registry, secret_token=None, metrics_token=None):
+    return tornado.web.Application([
+        (r"/metrics", MetricsHandler, {"registry": registry, "token": metrics_token}),
+        (r"/", TelegramWebhookHandler, {"bot_app": application, "secret_token": secret_token}),
+    ], log_function=lambda handler: None)  # запросы не логируем: их видно в метриках
+
+
+async def serve_webhook(application, *, listen, port, webhook_url, secret_token, registry, metrics_token=None, loop_monitor=None):
+    """Запускает бота за своим HTTP-сервером: вебхук на «/», метрики на «/metrics».
+
+    Заменяет Application.run_webhook, в чей сервер нельзя добавить свои
+    пути. Работает до SIGINT/SIGTERM, затем останавливает бота тем же порядком,
+    что и run_webhook, включая post_stop и post_shutdown.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM): loop.add_signal_handler(sig, stop.set)
+    server = tornado.httpserver.HTTPServer(make_web_app(application, registry, secret_token, metrics_token))
+    await application.initialize()
+    if application.post_init: await application.post_init(application)
+    try:
+        await application.bot.set_webhook(url=webhook_url, secret_token=secret_token)
+        server.listen(port, address=listen)
+        await application.start()
+        if loop_monitor is not None: loop_monitor.start()
+        logger.info("Вебхук и /metrics слушают порт", extra=fields(port=port))
+        await stop.wait()
+    finally:
+        server.stop()
+        if loop_monitor is not None: await loop_monitor.stop()
+        if application.running: await application.stop()
+        if application.post_stop: await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown: await application.post_shutdown(application)
@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+from collections import OrderedDict
+from itertools import groupby
+
+from db import Database
+from logs import fields
+from weight_trend import WeightTrend
+
+logger = logging.getLogger(__name__)
+
+
+class WeightStore:
+    """Журнал веса в SQLite: одна строка на (пользователь, день).
+
+    Запись веса — это вставка одной строки, а не перезапись всего файла.
+    Последний вес каждого пользователя держится в памяти, поэтому
+    get_latest_weight не ходит на диск. Тренд пользователя (WeightTrend)
+    обновляется в памяти при каждой записи, а в weight_trends лежит его
+    контрольная точка: flush_trends() сохраняет измененные тренды пачкой, а
+    при чтении тренда записи новее точки доигрываются из weights. Так запись
+    веса — одна вставка, а сводка прогресса не перечитывает историю. Точки
+    для старых пользователей и для импорта строятся один раз, за один проход
+    по weights в той же транзакции.
+    """
+
+    def __init__(self, db: Database, max_cached_trends=20000):
+        self.db = db
+        self.max_cached_trends = max_cached_trends
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS weights ("
+            " chat_id TEXT NOT NULL, day TEXT NOT NULL, weight REAL NOT NULL,"
+            " PRIMARY KEY (chat_id, day)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS weight_trends (chat_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._latest = {}  # chat_id -> (day, weight)
+        self._trends = OrderedDict()  # chat_id -> WeightTrend, LRU
+        self._dirty = set()  # chat_id, чей тренд новее точки в weight_trends
+        self._build_missing_trends()
+        self._load_latest()
+
+    def _load_latest(self):
+        # В SQLite «голые» колонки при MAX() берутся из строки с максимумом
+        rows = self.db.execute("SELECT chat_id, MAX(day), weight FROM weights GROUP BY chat_id").fetchall()
+        self._latest = {chat_id: (day, weight) for chat_id, day, weight in rows}
+
+    def save(self, chat_id, weight, day=None):
+        chat_id = str(chat_id)
+        day = day or datetime.date.today().isoformat()
+        current = self._latest.get(chat_id)
+        self.db.execute("INSERT OR REPLACE INTO weights (chat_id, day, weight) VALUES (?, ?, ?)", (chat_id, day, weight))
+        if current is not None and day < current[0]:
+            self._store_trend(chat_id, WeightTrend.from_series(self.series(chat_id)))  # запись задним числом
+            return
+        self._latest[chat_id] = (day, weight)
+        # Тренда нет в памяти — trend() доиграет эту запись при чтении
+        trend = self._trends.get(chat_id)
+        if trend is not None:
+            trend.add(datetime.date.fromisoformat(day).toordinal(), float(weight)); self._dirty.add(chat_id)
+
+    def latest(self, chat_id):
+        entry = self._latest.get(str(chat_id))
+        return entry[1] if entry else None
+
+    def latest_day(self, chat_id):
+        entry = self._latest.get(str(chat_id))
+        return entry[0] if entry else None
+
+    def series(self, chat_id, since=None):
+        """Записи пользователя, упорядоченные по дате: [(день, вес), ...]. since — первый день ISO."""
+        return self.db.execute("SELECT day, weight FROM weights WHERE chat_id = ? AND day >= ? ORDER BY day", (str(chat_id), since or "")).fetchall()
+
+    def page(self, chat_id, size, older_than=None, newer_than=None):
+        """Страница истории, новые записи сверху: ([(день, вес), ...], есть ли старее, есть ли новее).
+
+        Листание идет по ключу (день), а не по OFFSET, поэтому страница
+        читается за одно обращение к индексу при любой длине истории.
+        """
+        chat_id = str(chat_id)
+        if newer_than:
+            rows = self.db.execute("SELECT day, weight FROM weights WHERE chat_id = ? AND day > ? ORDER BY day LIMIT ?", (chat_id, newer_than, size + 1)).fetchall()
+            has_newer = len(rows) > size; rows = rows[:size][::-1]
+            has_older = True
+        else:
+            if older_than: rows = self.db.execute("SELECT day, weight FROM weights WHERE chat_id = ? AND day < ? ORDER BY day DESC LIMIT ?", (chat_id, older_than, size + 1)).fetchall()
+            else: rows = self.db.execute("SELECT day, weight FROM weights WHERE chat_id = ? ORDER BY day DESC LIMIT ?", (chat_id, size + 1)).fetchall()
+            has_older = len(rows) > size; rows = rows[:size]
+            has_newer = older_than is not None
+        return rows, has_older, has_newer
+
+    def trend(self, chat_id):
+        """Тренд пользователя из памяти или из контрольной точки в weight_trends плюс записи после нее."""
+        chat_id = str(chat_id)
+        trend = self._trends.get(chat_id)
+        if trend is None:
+            row = self.db.execute("SELECT data FROM weight_trends WHERE chat_id = ?", (chat_id,)).fetchone()
+            trend = WeightTrend.from_dict(json.loads(row[0])) if row else WeightTrend()
+            # Последний день точки тоже перечитываем: его вес могли заменить
+            since = datetime.date.fromordinal(trend.day).isoformat() if trend.day is not None else ""
+            missed = self.series(chat_id, since)
+            for day, weight in missed: trend.add(datetime.date.fromisoformat(day).toordinal(), float(weight))
+            if missed and missed[-1][0] > since: self._dirty.add(chat_id)
+            self._cache_trend(chat_id, trend)
+        self._trends.move_to_end(chat_id)
+        return trend
+
+    def _cache_trend(self, chat_id, trend):
+        self._trends[chat_id] = trend; self._trends.move_to_end(chat_id)
+        while len(self._trends) > self.max_cached_trends:
+            evicted_id, evicted = self._trends.popitem(last=False)
+            if evicted_id in self._dirty: self._dirty.discard(evicted_id); self._write_trend(evicted_id, evicted)
+
+    def _write_trend(self, chat_id, trend):
+        if trend.count: self.db.execute("INSERT OR REPLACE INTO weight_trends (chat_id, data) VALUES (?, ?)", (chat_id, json.dumps(trend.to_dict())))
+
+    def _store_trend(self, chat_id, trend):
+        self._dirty.discard(chat_id)
+        self._write_trend(chat_id, trend)
+        self._cache_trend(chat_id, trend)
+
+    def _take_dirty_trends(self):
+        # Сериализуем в вызывающем потоке, чтобы не читать тренды, которые меняют обработчики
+        rows = [(chat_id, json.dumps(self._trends[chat_id].to_dict())) for chat_id in self._dirty if chat_id in self._trends]
+        self._dirty.clear()
+        return rows
+
+    def _write_trend_rows(self, rows):
+        if rows: self.db.executemany("INSERT OR REPLACE INTO weight_trends (chat_id, data) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def flush_trends(self):
+        """Сохраняет контрольные точки измененных трендов одной транзакцией. Возвращает их число."""
+        return self._write_trend_rows(self._take_dirty_trends())
+
+    async def flush_trends_async(self):
+        """То же, что flush_trends(), но запись — в фоновом потоке."""
+        return await asyncio.to_thread(self._write_trend_rows, self._take_dirty_trends())
+
+    def _write_trends(self, conn, rows):
+        # rows — (chat_id, день, вес) по возрастанию chat_id и дня; conn — внутри транзакции.
+        # Тренды пишутся по мере чтения, вся история в памяти не собирается
+        def trends():
+            for chat_id, user_rows in groupby(rows, key=lambda row: row[0]):
+                self._trends.pop(chat_id, None); self._dirty.discard(chat_id)
+                yield chat_id, json.dumps(WeightTrend.from_series((day, weight) for _, day, weight in user_rows).to_dict())
+        conn.executemany("INSERT OR REPLACE INTO weight_trends (chat_id, data) VALUES (?, ?)", trends())
+
+    def _build_missing_trends(self):
+        """Однократная миграция: тренды для пользователей, записанных до появления weight_trends."""
+        if self.db.get_meta("weight_trends_built"): return
+        with self.db.transaction(immediate=True) as conn:
+            # Другой воркер мог успеть раньше
+            if not self.db.get_meta("weight_trends_built"):
+                self._write_trends(conn, conn.execute(
+                    "SELECT chat_id, day, weight FROM weights WHERE chat_id NOT IN (SELECT chat_id FROM weight_trends) ORDER BY chat_id, day"))
+                self.db.set_meta("weight_trends_built", datetime.datetime.now().isoformat())
+
+    def import_json(self, filepath):
+        """Однократный импорт старого weight_log.json. Возвращает число перенесённых записей."""
+        if self.db.get_meta("weight_log_imported") or not os.path.exists(filepath):
+            return 0
+        try:
+            with open(filepath, "r", encoding="utf-8") as f: data = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning("Не удалось прочитать файл", extra=fields(path=filepath, error=str(e))); return 0
+        rows = [(str(chat_id), day, float(weight)) for chat_id, log in data.items() for day, weight in log.items()]
+        with self.db.transaction(immediate=True) as conn:
+            # Не затираем записи, которые уже успели попасть в базу
+            conn.executemany("INSERT OR IGNORE INTO weights (chat_id, day, weight) VALUES (?, ?, ?)", rows)
+            # Импорт мог добавить записи задним числом: пересобираем тренды только у пользователей из файла
+            self._write_trends(conn, conn.execute(
+                "SELECT chat_id, day, weight FROM weights WHERE chat_id IN (SELECT value FROM json_each(?)) ORDER BY chat_id, day",
+                (json.dumps(sorted({row[0] for row in rows})),)))
+            self.db.set_meta("weight_log_imported", datetime.datetime.now().isoformat())
+        self._load_latest()
+        return len(rows)
@@ -0,0 +1,100 @@
+import datetime
+from collections import deque
+
+TREND_ALPHA = 0.1  # сглаживание за день: вчерашний тренд весит 0.9
+REGRESSION_DAYS = 28  # окно для наклона и прогноза
+WEEKS_KEPT = 9  # недельных точек тренда: хватает на 8 изменений
+MAX_PROJECTION_DAYS = 3 * 365
+
+
+class WeightTrend:
+    """Тренд веса пользователя, который обновляется при каждом взвешивании.
+
+    Хранит экспоненциально сглаженный вес (с учетом пропущенных дней),
+    сглаженный вес на конец каждой из последних недель и суммы для
+    линейной регрессии за последние REGRESSION_DAYS дней. Добавление записи
+    и чтение сводки не зависят от длины истории. Повторная запись за
+    последний день заменяет ее; запись задним числом требует пересборки
+    (см. WeightStore.save).
+    """
+
+    __slots__ = ("day", "ema", "prev_day", "prev_ema", "count", "first_day", "first_weight", "weeks", "points", "sx", "sy", "sxy", "sxx")
+
+    def __init__(self):
+        self.day = self.ema = self.prev_day = self.prev_ema = None  # день — порядковый номер
+        self.count = 0
+        self.first_day = self.first_weight = None
+        self.weeks = deque(maxlen=WEEKS_KEPT)  # [номер понедельника, тренд на конец недели]
+        self.points = deque()  # (день, вес) за окно регрессии
+        self.sx = self.sy = self.sxy = self.sxx = 0.0
+
+    @classmethod
+    def from_series(cls, series):
+        """series — [(день ISO, вес), ...] по возрастанию даты."""
+        trend = cls()
+        for day, weight in series: trend.add(datetime.date.fromisoformat(day).toordinal(), float(weight))
+        return trend
+
+    def add(self, day, weight):
+        """Учитывает вес за день day (порядковый номер). Возвращает False, если запись задним числом."""
+        if self.day is not None and day < self.day: return False
+        if day == self.day:
+            # Замена последней записи: откатываем тренд к предыдущему дню
+            self.day, self.ema = self.prev_day, self.prev_ema
+            self._remove_point(self.points.pop())
+            self.count -= 1
+        self.prev_day, self.prev_ema = self.day, self.ema
+        if self.ema is None:
+            self.ema = weight
+        else:
+            self.ema += (1 - (1 - TREND_ALPHA) ** (day - self.day)) * (weight - self.ema)
+        self.day = day
+        self.count += 1
+        if self.first_day is None or day == self.first_day: self.first_day, self.first_weight = day, weight
+        week = day - datetime.date.fromordinal(day).weekday()
+        if self.weeks and self.weeks[-1][0] == week: self.weeks[-1][1] = self.ema
+        else: self.weeks.append([week, self.ema])
+        self.points.append((day, weight)); self._add_point((day, weight))
+        while self.points[0][0] <= day - REGRESSION_DAYS: self._remove_point(self.points.popleft())
+        return True
+
+    def _add_point(self, point, sign=1):
+        x, y = point[0] - self.first_day, point[1]
+        self.sx += sign * x; self.sy += sign * y; self.sxy += sign * x * y; self.sxx += sign * x * x
+
+    def _remove_point(self, point):
+        self._add_point(point, -1)
+
+    def slope(self):
+        """Наклон линейной регрессии за последние REGRESSION_DAYS дней, кг в день, или None."""
+        n = len(self.points)
+        if n < 2: return None
+        denominator = n * self.sxx - self.sx * self.sx
+        if denominator <= 0: return None
+        return (n * self.sxy - self.sx * self.sy) / denominator
+
+    def weekly_deltas(self):
+        """Изменения сглаженного веса по неделям: [(понедельник, изменение), ...], последняя неделя в конце."""
+        weeks = list(self.weeks)
+        return [(datetime.date.fromordinal(week), ema - previous) for (_, previous), (week, ema) in zip(weeks, weeks[1:])]
+
+    def projected_date(self, goal_weight):
+        """Дата, когда тренд дойдет до goal_weight при текущем наклоне, или None, если он движется не туда."""
+        slope = self.slope()
+        if self.ema is None or goal_weight is None or not slope: return None
+        days = (goal_weight - self.ema) / slope
+        if days < 0 or days > MAX_PROJECTION_DAYS: return None
+        return datetime.date.fromordinal(self.day + round(days))
+
+    def to_dict(self):
+        return {"day": self.day, "ema": self.ema, "prev_day": self.prev_day, "prev_ema": self.prev_ema, "count": self.count,
+                "first_day": self.first_day, "first_weight": self.first_weight, "weeks": list(self.weeks), "points": list(self.points)}
+
+    @classmethod
+    def from_dict(cls, data):
+        trend = cls()
+        for key in ("day", "ema", "prev_day", "prev_ema", "count", "first_day", "first_weight"): setattr(trend, key, data[key])
+        trend.weeks.extend(data["weeks"])
+        for point in data["points"]:
+            point = tuple(point); trend.points.append(point); trend._add_point(point)
+        return trend